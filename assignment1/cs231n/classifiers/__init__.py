@@ -1,2 +1,3 @@
 from cs231n.classifiers.k_nearest_neighbor import *
 from cs231n.classifiers.linear_classifier import *
+from cs231n.classifiers.batched_linear import *
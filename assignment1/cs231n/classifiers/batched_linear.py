@@ -0,0 +1,194 @@
+from __future__ import print_function
+
+import numpy as np
+from past.builtins import xrange
+
+from cs231n.classifiers.linear_classifier import LinearSVM, Softmax
+
+
+def _batched_scores(W, X):
+  """
+  Compute the scores of K linear models with one matrix multiply.
+
+  Inputs:
+  - W: A numpy array of shape (D, K, C) containing the weights of K models.
+  - X: A numpy array of shape (N, D) containing a minibatch of data.
+
+  Returns:
+  - scores: A numpy array of shape (N, K, C).
+  """
+  D, K, C = W.shape
+  return X.dot(W.reshape(D, K * C)).reshape(X.shape[0], K, C)
+
+
+def _batched_grad(W, X, dscores, reg):
+  """
+  Backpropagate dscores of shape (N, K, C) into the weights of all K models
+  with one matrix multiply and add the L2 regularization gradient.
+  """
+  D, K, C = W.shape
+  N = X.shape[0]
+  dW = X.T.dot(dscores.reshape(N, K * C)).reshape(D, K, C)
+  dW /= N
+  dW += 2 * reg.reshape(1, K, 1) * W
+  return dW
+
+
+def svm_loss_batched(W, X, y, reg):
+  """
+  Structured SVM loss function for K models at once. Model k computes exactly
+  what svm_loss_vectorized(W[:, k, :], X, y, reg[k]) does.
+
+  Inputs:
+  - W: A numpy array of shape (D, K, C) containing the weights of K models.
+  - X: A numpy array of shape (N, D) containing a minibatch of data.
+  - y: A numpy array of shape (N,) containing training labels.
+  - reg: A numpy array of shape (K,) giving the regularization strength of
+    every model.
+
+  Returns a tuple of:
+  - loss: A numpy array of shape (K,) giving the loss of every model
+  - gradient with respect to weights W; an array of same shape as W
+  """
+  N = X.shape[0]
+  scores = _batched_scores(W, X) # NxKxC
+  correct_class_scores = scores[np.arange(N), :, y] # NxK
+  margins = np.maximum(0, scores - correct_class_scores[:, :, np.newaxis] + 1)
+  margins[np.arange(N), :, y] = 0
+  loss = np.sum(margins, axis=(0, 2)) / N + reg * np.sum(W * W, axis=(0, 2))
+
+  dscores = (margins > 0).astype(W.dtype)
+  dscores[np.arange(N), :, y] = -np.sum(dscores, axis=2)
+  return loss, _batched_grad(W, X, dscores, reg)
+
+
+def softmax_loss_batched(W, X, y, reg):
+  """
+  Softmax loss function for K models at once. Model k computes exactly what
+  softmax_loss_vectorized(W[:, k, :], X, y, reg[k]) does.
+
+  Inputs and outputs are the same as svm_loss_batched.
+  """
+  N = X.shape[0]
+  scores = _batched_scores(W, X) # NxKxC
+  scores -= np.max(scores, axis=2, keepdims=True)
+  log_probs = scores - np.log(np.sum(np.exp(scores), axis=2, keepdims=True))
+  loss = -np.sum(log_probs[np.arange(N), :, y], axis=0) / N
+  loss += reg * np.sum(W * W, axis=(0, 2))
+
+  dscores = np.exp(log_probs)
+  dscores[np.arange(N), :, y] -= 1
+  return loss, _batched_grad(W, X, dscores, reg)
+
+
+class BatchedLinearClassifier(object):
+  """
+  Train K linear classifiers with different learning rates and regularization
+  strengths in one pass over the same minibatches.
+
+  The weights of all models are stored in one array of shape (D, K, C) so
+  that the scores and gradients of every model come out of a single matrix
+  multiply per minibatch; self.W is a (K, D, C) view of it, so self.W[k] holds
+  the weights of model k.
+  """
+
+  loss_functions = {
+    'svm': (svm_loss_batched, LinearSVM),
+    'softmax': (softmax_loss_batched, Softmax),
+  }
+
+  def __init__(self, loss='svm'):
+    if loss not in self.loss_functions:
+      raise ValueError('Invalid loss "%s"' % loss)
+    self.loss_function, self.classifier_class = self.loss_functions[loss]
+    self.W = None
+    self._W = None
+
+  def train(self, X, y, learning_rates, regs, num_iters=100, batch_size=200,
+            verbose=False):
+    """
+    Train K linear classifiers using stochastic gradient descent, all on the
+    same minibatches.
+
+    Inputs:
+    - X: A numpy array of shape (N, D) containing training data.
+    - y: A numpy array of shape (N,) containing training labels.
+    - learning_rates: Sequence of K learning rates, one per model.
+    - regs: Sequence of K regularization strengths, one per model.
+    - num_iters: (integer) number of steps to take when optimizing
+    - batch_size: (integer) number of training examples to use at each step.
+    - verbose: (boolean) If true, print progress during optimization.
+
+    Outputs:
+    A numpy array of shape (num_iters, K) containing the value of the loss
+    function of every model at each training iteration.
+    """
+    learning_rates = np.asarray(learning_rates, dtype=np.float64)
+    regs = np.asarray(regs, dtype=np.float64)
+    if learning_rates.shape != regs.shape or learning_rates.ndim != 1:
+      raise ValueError('learning_rates and regs must be sequences of the '
+                       'same length')
+    K = learning_rates.shape[0]
+    num_train, dim = X.shape
+    num_classes = np.max(y) + 1
+    if self._W is None:
+      self._W = 0.001 * np.random.randn(dim, K, num_classes)
+      self.W = self._W.transpose(1, 0, 2)
+
+    lr = learning_rates.reshape(1, K, 1)
+    loss_history = np.zeros((num_iters, K))
+    for it in xrange(num_iters):
+      batch_mask = np.random.choice(num_train, batch_size)
+      loss, grad = self.loss_function(self._W, X[batch_mask], y[batch_mask],
+                                      regs)
+      loss_history[it] = loss
+      grad *= lr
+      self._W -= grad
+
+      if verbose and it % 100 == 0:
+        print('iteration %d / %d: mean loss %f' % (it, num_iters,
+                                                   np.mean(loss)))
+
+    return loss_history
+
+  def predict(self, X):
+    """
+    Predict labels for data points with every model.
+
+    Inputs:
+    - X: A numpy array of shape (N, D) containing data.
+
+    Returns:
+    - y_pred: A numpy array of shape (K, N) where y_pred[k] gives the labels
+      predicted by model k.
+    """
+    return np.argmax(_batched_scores(self._W, X), axis=2).T
+
+  def classifiers(self):
+    """
+    Return K independent trained classifiers (LinearSVM or Softmax instances,
+    depending on the loss), where classifier k owns a copy of self.W[k].
+    """
+    classifiers = []
+    for k in xrange(self.W.shape[0]):
+      clf = self.classifier_class()
+      clf.W = self.W[k].copy()
+      classifiers.append(clf)
+    return classifiers
+
+
+def train_grid(X, y, learning_rates, regs, loss='svm', num_iters=100,
+               batch_size=200, verbose=False):
+  """
+  Train one linear classifier for every (learning_rate, reg) pair of a grid
+  in a single batched pass.
+
+  Returns:
+  A dictionary mapping (learning_rate, reg) tuples to trained LinearSVM or
+  Softmax classifiers.
+  """
+  grid = [(lr, reg) for lr in learning_rates for reg in regs]
+  model = BatchedLinearClassifier(loss)
+  model.train(X, y, [lr for lr, _ in grid], [reg for _, reg in grid],
+              num_iters=num_iters, batch_size=batch_size, verbose=verbose)
+  return dict(zip(grid, model.classifiers()))
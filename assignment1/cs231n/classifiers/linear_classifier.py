@@ -1,6 +1,7 @@
 from __future__ import print_function
 
 import numpy as np
+from cs231n import hogwild
 from cs231n.classifiers.linear_svm import *
 from cs231n.classifiers.softmax import *
 from past.builtins import xrange
@@ -60,6 +61,7 @@ class LinearClassifier(object):
       sample_end = sample_start + batch_size
       X_batch = X[sample_start:sample_end]
       y_batch = y[sample_start:sample_end]
+      batch_i += 1
       #########################################################################
       #                       END OF YOUR CODE                                #
       #########################################################################
@@ -83,6 +85,44 @@ class LinearClassifier(object):
 
     return loss_history
 
+  def train_async(self, X, y, learning_rate=1e-3, reg=1e-5, num_iters=100,
+                  batch_size=200, num_workers=4, seed=None, verbose=False):
+    """
+    Train this linear classifier with lock-free asynchronous SGD (Hogwild).
+    num_workers processes sample their own minibatches and update a shared
+    copy of W in place without synchronizing with each other.
+
+    Inputs are the same as for train(), plus:
+    - num_workers: (integer) number of worker processes.
+    - seed: (integer) if not None, seed for the workers' minibatch sampling.
+
+    Outputs:
+    A numpy array containing the value of the loss function at each training
+    iteration, indexed by iteration across all workers.
+    """
+    num_train, dim = X.shape
+    num_classes = np.max(y) + 1
+    if self.W is None:
+      self.W = 0.001 * np.random.randn(dim, num_classes)
+    self.W = hogwild.to_shared(self.W)
+
+    def step(it):
+      batch_mask = np.random.choice(num_train, batch_size)
+      loss, grad = self.loss(X[batch_mask], y[batch_mask], reg)
+      self.W -= learning_rate * grad
+      if verbose and it % 100 == 0:
+        print('iteration %d / %d: loss %f' % (it, num_iters, loss))
+      return loss
+
+    try:
+      loss_history = hogwild.hogwild_train(step, num_iters,
+                                           num_workers=num_workers, seed=seed)
+    finally:
+      # Detach the weights from shared memory
+      self.W = np.array(self.W)
+
+    return loss_history
+
   def predict(self, X):
     """
     Use the trained weights of this linear classifier to predict labels for
@@ -102,7 +142,7 @@ class LinearClassifier(object):
     # TODO:                                                                   #
     # Implement this method. Store the predicted labels in y_pred.            #
     ###########################################################################
-    pass
+    y_pred = np.argmax(X.dot(self.W), axis=1)
     ###########################################################################
     #                           END OF YOUR CODE                              #
     ###########################################################################
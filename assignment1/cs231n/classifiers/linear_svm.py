@@ -70,7 +70,12 @@ def svm_loss_vectorized(W, X, y, reg):
   # Implement a vectorized version of the structured SVM loss, storing the    #
   # result in loss.                                                           #
   #############################################################################
-  pass
+  num_train = X.shape[0]
+  scores = X.dot(W) # NxC
+  correct_class_scores = scores[np.arange(num_train), y].reshape(-1, 1)
+  margins = np.maximum(0, scores - correct_class_scores + 1) # note delta = 1
+  margins[np.arange(num_train), y] = 0
+  loss = np.sum(margins) / num_train + reg * np.sum(W * W)
   #############################################################################
   #                             END OF YOUR CODE                              #
   #############################################################################
@@ -85,7 +90,9 @@ def svm_loss_vectorized(W, X, y, reg):
   # to reuse some of the intermediate values that you used to compute the     #
   # loss.                                                                     #
   #############################################################################
-  pass
+  dscores = (margins > 0).astype(W.dtype) # NxC
+  dscores[np.arange(num_train), y] = -np.sum(dscores, axis=1)
+  dW = X.T.dot(dscores) / num_train + 2 * reg * W
   #############################################################################
   #                             END OF YOUR CODE                              #
   #############################################################################
@@ -4,6 +4,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 from past.builtins import xrange
 
+from cs231n import hogwild
+
 class TwoLayerNet(object):
   """
   A two-layer fully-connected neural network. The net has an input dimension of
@@ -41,7 +43,7 @@ class TwoLayerNet(object):
     self.params['W2'] = std * np.random.randn(hidden_size, output_size)
     self.params['b2'] = np.zeros(output_size)
 
-  def loss(self, X, y=None, reg=0.0, dropout=1.):
+  def loss(self, X, y=None, reg=0.0, dropout=1., vectorized=True):
     """
     Compute the loss and gradients for a two layer fully connected neural
     network.
@@ -53,6 +55,11 @@ class TwoLayerNet(object):
       is not passed then we only return scores, and if it is passed then we
       instead return the loss and gradients.
     - reg: Regularization strength.
+    - dropout: Probability of keeping each hidden unit.
+    - vectorized: If true, compute the loss and gradients with a few matrix
+      products over the whole minibatch; otherwise loop over the samples and
+      classes. Both give the same results, except that the loop does not
+      apply the dropout mask to the gradients of W1 and b1.
 
     Returns:
     If y is None, return a matrix scores of shape (N, C) where scores[i, c] is
@@ -78,7 +85,8 @@ class TwoLayerNet(object):
     #############################################################################
     h_1     = X.dot(W1) + b1      # FC1, NxH
     relu_1  = np.maximum(h_1, 0)  # ReLU1, NxH
-    relu_1 *= (np.random.rand(*relu_1.shape) < dropout) / dropout  # Dropout1, NxH
+    mask    = (np.random.rand(*relu_1.shape) < dropout) / dropout
+    relu_1 *= mask                # Dropout1, NxH
     scores  = relu_1.dot(W2) + b2 # FC2, NxC
     #############################################################################
     #                              END OF YOUR CODE                             #
@@ -100,10 +108,13 @@ class TwoLayerNet(object):
     f_expsum = np.sum(np.exp(scores), axis=1) # N
     sm = np.exp(scores) / f_expsum.reshape(-1, 1) # NxC
 
-    loss_data = 0
-    for i, yi in enumerate(y):
-        loss_data_i = -scores[i, yi] + np.log(f_expsum[i])
-        loss_data += loss_data_i
+    if vectorized:
+      loss_data = np.sum(np.log(f_expsum) - scores[np.arange(N), y])
+    else:
+      loss_data = 0
+      for i, yi in enumerate(y):
+          loss_data_i = -scores[i, yi] + np.log(f_expsum[i])
+          loss_data += loss_data_i
     loss_data /= N
 
     loss_reg = np.sum(W1**2) + np.sum(W2**2)
@@ -121,32 +132,41 @@ class TwoLayerNet(object):
     # and biases. Store the results in the grads dictionary. For example,       #
     # grads['W1'] should store the gradient on W1, and be a matrix of same size #
     #############################################################################
-    grad_W1_data = np.zeros_like(W1)
-    grad_b1 = np.zeros_like(b1)
-    grad_W2_data = np.zeros_like(W2)
-    grad_b2 = np.zeros_like(b2)
-
-    for i, yi in enumerate(y):
-      drelu_1 = h_1[i] > 0 # H
-      # === W1 ===
-      X_i = X[i].reshape(-1, 1)
-      temp = np.zeros_like(W1)
-      for j in range(W2.shape[1]):
-        temp += np.exp(scores[i, j]) * W2[:, j] * drelu_1 * X_i
-      temp /= f_expsum[i]
-      grad_W1_data += -W2[:, yi] * drelu_1 * X_i + temp
-      # === b1 ===
-      temp = np.zeros_like(b1)
-      for j in range(W2.shape[1]):
-       temp += np.exp(scores[i, j]) * W2[:, j] * drelu_1
-      temp /= f_expsum[i]
-      grad_b1 += -W2[:, yi] * drelu_1 + temp
-      # === W2 ===
-      grad_W2_data += sm[i] * relu_1[i].reshape(-1, 1) # j != yi
-      grad_W2_data[:, yi] -= relu_1[i] # j == yi
-      # === b2 ===
-      grad_b2 += sm[i] # j != yi
-      grad_b2[yi] -= 1 # j == yi
+    if vectorized:
+      dscores = sm # NxC
+      dscores[np.arange(N), y] -= 1
+      grad_W2_data = relu_1.T.dot(dscores)
+      grad_b2 = np.sum(dscores, axis=0)
+      dh_1 = dscores.dot(W2.T) * mask * (h_1 > 0) # NxH
+      grad_W1_data = X.T.dot(dh_1)
+      grad_b1 = np.sum(dh_1, axis=0)
+    else:
+      grad_W1_data = np.zeros_like(W1)
+      grad_b1 = np.zeros_like(b1)
+      grad_W2_data = np.zeros_like(W2)
+      grad_b2 = np.zeros_like(b2)
+
+      for i, yi in enumerate(y):
+        drelu_1 = h_1[i] > 0 # H
+        # === W1 ===
+        X_i = X[i].reshape(-1, 1)
+        temp = np.zeros_like(W1)
+        for j in range(W2.shape[1]):
+          temp += np.exp(scores[i, j]) * W2[:, j] * drelu_1 * X_i
+        temp /= f_expsum[i]
+        grad_W1_data += -W2[:, yi] * drelu_1 * X_i + temp
+        # === b1 ===
+        temp = np.zeros_like(b1)
+        for j in range(W2.shape[1]):
+         temp += np.exp(scores[i, j]) * W2[:, j] * drelu_1
+        temp /= f_expsum[i]
+        grad_b1 += -W2[:, yi] * drelu_1 + temp
+        # === W2 ===
+        grad_W2_data += sm[i] * relu_1[i].reshape(-1, 1) # j != yi
+        grad_W2_data[:, yi] -= relu_1[i] # j == yi
+        # === b2 ===
+        grad_b2 += sm[i] # j != yi
+        grad_b2[yi] -= 1 # j == yi
 
     grad_W1_reg = 2 * reg * W1
     grad_W2_reg = 2 * reg * W2
@@ -249,6 +269,73 @@ class TwoLayerNet(object):
       'learning_rate_history': learning_rate_history
     }
 
+  def train_async(self, X, y, X_val, y_val,
+                  learning_rate=1e-3, learning_rate_decay=0.95,
+                  reg=5e-6, num_iters=100,
+                  batch_size=200, dropout=1., num_workers=4, seed=None,
+                  verbose=False):
+    """
+    Train this neural network with lock-free asynchronous SGD (Hogwild).
+    num_workers processes sample their own minibatches and update shared
+    copies of the parameters in place without synchronizing with each other.
+    The workers pause at the end of every epoch while the validation accuracy
+    is checked and the learning rate is decayed.
+
+    Inputs are the same as for train(), plus:
+    - num_workers: Number of worker processes.
+    - seed: If not None, seed for the workers' minibatch sampling.
+
+    Returns the same dictionary of histories as train(); train_acc_history is
+    measured on the last 1000 training examples.
+    """
+    num_train = X.shape[0]
+    iterations_per_epoch = max(num_train // batch_size, 1)
+
+    for prm_name in self.params.keys():
+      self.params[prm_name] = hogwild.to_shared(self.params[prm_name])
+
+    train_acc_history = []
+    val_acc_history = []
+    learning_rate_history = [learning_rate]
+
+    def step(it):
+      # Each worker decays its own learning rate once per epoch
+      epoch_learning_rate = learning_rate * \
+          learning_rate_decay ** (it // iterations_per_epoch)
+      batch_mask = np.random.choice(num_train, batch_size)
+      loss, grads = self.loss(X[batch_mask], y=y[batch_mask], reg=reg,
+                              dropout=dropout)
+      for prm_name in self.params.keys():
+        self.params[prm_name] -= epoch_learning_rate * grads[prm_name]
+      if verbose and it % 100 == 0:
+        print('iteration %d / %d: loss %f' % (it, num_iters, loss))
+      return loss
+
+    def end_of_epoch(epoch):
+      train_acc = (self.predict(X[-1000:]) == y[-1000:]).mean()
+      val_acc = (self.predict(X_val) == y_val).mean()
+      train_acc_history.append(train_acc)
+      val_acc_history.append(val_acc)
+      learning_rate_history.append(
+          learning_rate * learning_rate_decay ** (epoch + 1))
+
+    try:
+      loss_history = hogwild.hogwild_train(
+          step, num_iters, num_workers=num_workers,
+          iters_per_epoch=iterations_per_epoch, epoch_callback=end_of_epoch,
+          seed=seed)
+    finally:
+      # Detach the parameters from shared memory
+      for prm_name in self.params.keys():
+        self.params[prm_name] = np.array(self.params[prm_name])
+
+    return {
+      'loss_history': list(loss_history),
+      'train_acc_history': train_acc_history,
+      'val_acc_history': val_acc_history,
+      'learning_rate_history': learning_rate_history
+    }
+
   def predict(self, X):
     """
     Use the trained weights of this two-layer network to predict labels for
@@ -54,7 +54,16 @@ def softmax_loss_vectorized(W, X, y, reg):
   # here, it is easy to run into numeric instability. Don't forget the        #
   # regularization!                                                           #
   #############################################################################
-  pass
+  num_train = X.shape[0]
+  scores = X.dot(W) # NxC
+  scores -= np.max(scores, axis=1, keepdims=True)
+  log_probs = scores - np.log(np.sum(np.exp(scores), axis=1, keepdims=True))
+  loss = -np.sum(log_probs[np.arange(num_train), y]) / num_train
+  loss += reg * np.sum(W * W)
+
+  dscores = np.exp(log_probs) # NxC
+  dscores[np.arange(num_train), y] -= 1
+  dW = X.T.dot(dscores) / num_train + 2 * reg * W
   #############################################################################
   #                          END OF YOUR CODE                                 #
   #############################################################################
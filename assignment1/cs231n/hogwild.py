@@ -0,0 +1,210 @@
+from __future__ import print_function
+
+import ctypes
+import multiprocessing
+import time
+
+import numpy as np
+from past.builtins import xrange
+from six.moves import queue
+
+
+"""
+Lock-free asynchronous ("Hogwild") SGD.
+
+Several worker processes read and update a set of weight arrays that live in
+shared memory without taking any locks. Each worker samples its own
+minibatches, computes a gradient against whatever the weights currently are
+and subtracts its update in place; updates from different workers may
+interleave or overwrite each other, which for convex and sparse-ish problems
+costs very little accuracy while removing all synchronization from the inner
+loop (see Niu et al., "Hogwild!", 2011).
+
+Workers are forked from the training process, so models and data are
+inherited without pickling. This requires the 'fork' start method, which is
+available on Linux and OS X.
+"""
+
+
+def shared_array(shape, dtype=np.float64):
+  """
+  Allocate a zero-filled numpy array backed by shared memory and with no
+  lock. Arrays allocated before the workers are forked are shared with them.
+  """
+  dtype = np.dtype(dtype)
+  count = int(np.prod(shape))
+  raw = multiprocessing.RawArray(ctypes.c_char, max(count, 1) * dtype.itemsize)
+  return np.frombuffer(raw, dtype=dtype, count=count).reshape(shape)
+
+
+def to_shared(x):
+  """ Copy the numpy array x into a new shared-memory array. """
+  out = shared_array(x.shape, x.dtype)
+  out[...] = x
+  return out
+
+
+def _worker(worker_id, num_workers, step_fn, epochs, losses, commands, done,
+            seed):
+  """
+  Body of a worker process: run every num_workers-th iteration of each epoch,
+  waiting for the parent's go-ahead before starting the next epoch.
+  """
+  np.random.seed(seed)
+  for start, end in epochs:
+    if commands.get() is None:
+      return
+    for it in xrange(start + worker_id, end, num_workers):
+      losses[it] = step_fn(it)
+    done.put(worker_id)
+
+
+def _wait_for_workers(done, workers):
+  """
+  Wait until every worker has reported back, raising an error if a worker
+  died instead of hanging forever.
+  """
+  finished = 0
+  while finished < len(workers):
+    try:
+      done.get(timeout=1.0)
+      finished += 1
+    except queue.Empty:
+      for i, p in enumerate(workers):
+        if p.exitcode is not None and p.exitcode != 0:
+          raise RuntimeError('Hogwild worker %d exited with code %d'
+                             % (i, p.exitcode))
+
+
+def hogwild_train(step_fn, num_iters, num_workers=4, iters_per_epoch=None,
+                  epoch_callback=None, seed=None):
+  """
+  Run num_iters steps of step_fn spread over num_workers forked processes.
+
+  Inputs:
+  - step_fn: Function called as step_fn(it) for iteration index it. It should
+    sample a minibatch, compute the gradient and update the shared weights in
+    place (see shared_array), then return the minibatch loss.
+  - num_iters: Total number of steps, summed over all workers.
+  - num_workers: Number of worker processes.
+  - iters_per_epoch: If given, workers stop after every iters_per_epoch steps
+    until epoch_callback has run in the parent process.
+  - epoch_callback: Function called as epoch_callback(epoch) in the parent
+    process after each epoch, e.g. to check validation accuracy. The workers
+    are idle while it runs, so it sees a consistent set of weights.
+  - seed: If not None, worker i seeds its RNG with seed + i so that minibatch
+    sampling is reproducible; otherwise workers are seeded randomly.
+
+  Returns:
+  - loss_history: numpy array of shape (num_iters,) giving the loss of every
+    step, indexed by iteration.
+  """
+  if iters_per_epoch is None:
+    iters_per_epoch = num_iters
+  epochs = [(start, min(start + iters_per_epoch, num_iters))
+            for start in xrange(0, num_iters, iters_per_epoch)]
+  if seed is None:
+    seed = np.random.randint(2**31 - num_workers)
+
+  ctx = multiprocessing.get_context('fork')
+  losses = shared_array((num_iters,))
+  commands = [ctx.Queue() for _ in xrange(num_workers)]
+  done = ctx.Queue()
+  workers = [ctx.Process(target=_worker,
+                         args=(i, num_workers, step_fn, epochs, losses,
+                               commands[i], done, seed + i))
+             for i in xrange(num_workers)]
+  for p in workers:
+    p.daemon = True
+    p.start()
+
+  try:
+    for epoch in xrange(len(epochs)):
+      for q in commands:
+        q.put(True)
+      _wait_for_workers(done, workers)
+      if epoch_callback is not None:
+        epoch_callback(epoch)
+  finally:
+    for p, q in zip(workers, commands):
+      if p.is_alive():
+        q.put(None)
+    for p in workers:
+      p.join(timeout=5.0)
+      if p.is_alive():
+        p.terminate()
+
+  return np.array(losses)
+
+
+def make_synthetic_data(num_train=20000, num_val=2000, dim=500,
+                        num_classes=10, noise=3.0, seed=0):
+  """
+  Generate a linearly separable-ish classification problem: Gaussian clusters
+  around random class centers. Used by the benchmark so that it runs without
+  downloading a dataset.
+  """
+  rng = np.random.RandomState(seed)
+  centers = rng.randn(num_classes, dim)
+  N = num_train + num_val
+  y = rng.randint(num_classes, size=N)
+  X = centers[y] + noise * rng.randn(N, dim)
+  return X[:num_train], y[:num_train], X[num_train:], y[num_train:]
+
+
+def benchmark_hogwild(worker_counts=(1, 2, 4), num_iters=2000, batch_size=200,
+                      learning_rate=1e-3, reg=1e-5, classifiers=None,
+                      data=None, verbose=True):
+  """
+  Compare the sequential LinearClassifier.train() loop with train_async() for
+  several worker counts, reporting throughput and final validation accuracy.
+
+  Returns a list of dictionaries, one per (classifier, mode) run, with keys
+  'classifier', 'workers' (0 for the sequential loop), 'seconds',
+  'iters_per_sec', 'speedup' and 'val_acc'.
+  """
+  from cs231n.classifiers import LinearSVM, Softmax
+
+  if classifiers is None:
+    classifiers = [LinearSVM, Softmax]
+  if data is None:
+    data = make_synthetic_data()
+  X_train, y_train, X_val, y_val = data
+
+  results = []
+  for cls in classifiers:
+    runs = [0] + list(worker_counts)
+    baseline = None
+    for num_workers in runs:
+      np.random.seed(0)
+      clf = cls()
+      tic = time.time()
+      if num_workers == 0:
+        clf.train(X_train, y_train, learning_rate=learning_rate, reg=reg,
+                  num_iters=num_iters, batch_size=batch_size)
+      else:
+        clf.train_async(X_train, y_train, learning_rate=learning_rate,
+                        reg=reg, num_iters=num_iters, batch_size=batch_size,
+                        num_workers=num_workers, seed=0)
+      seconds = time.time() - tic
+      if baseline is None:
+        baseline = seconds
+      result = {
+        'classifier': cls.__name__,
+        'workers': num_workers,
+        'seconds': seconds,
+        'iters_per_sec': num_iters / seconds,
+        'speedup': baseline / seconds,
+        'val_acc': np.mean(clf.predict(X_val) == y_val),
+      }
+      results.append(result)
+      if verbose:
+        mode = 'sequential' if num_workers == 0 else '%d workers' % num_workers
+        print('%-10s %-12s %8.2fs %9.1f it/s  speedup %5.2fx  val acc %.4f' % (
+              result['classifier'], mode, seconds, result['iters_per_sec'],
+              result['speedup'], result['val_acc']))
+  return results
+
+
+if __name__ == '__main__':
+  benchmark_hogwild()
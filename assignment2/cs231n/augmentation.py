@@ -0,0 +1,143 @@
+from __future__ import print_function, division
+from builtins import object
+
+import numpy as np
+
+"""
+Vectorized data augmentation of whole minibatches.
+
+An Augmenter transforms a minibatch of images of shape (N, C, H, W) with a
+handful of array operations, however large N is:
+
+- random crops: every image is zero-padded by crop_padding pixels on each
+  side and an H x W window at a random offset is cut out of it;
+- horizontal flips: every image is mirrored with probability 1/2;
+- per-channel colour jitter: every channel of every image is multiplied by
+  a random factor in [1 - contrast, 1 + contrast] and shifted by a random
+  offset drawn from N(0, brightness^2), in the units of the data.
+
+Crops and flips are done together by a single gather (np.take) from a
+padded copy of the batch, with indices built by broadcasting; the jitter is
+two broadcast multiply-adds. The padded copy, the gather indices and by
+default the output live in buffers that are reused across calls, so
+augmenting a minibatch allocates almost nothing.
+
+Example usage:
+
+augment = Augmenter(crop_padding=4, flip=True, contrast=0.1, brightness=5.0)
+X_aug = augment(X_batch)
+solver = Solver(model, data, augment=augment, ...)
+"""
+
+
+class Augmenter(object):
+    """
+    Randomly crops, flips and colour-jitters minibatches of images; see the
+    module docstring. An Augmenter is not thread-safe, since it reuses its
+    buffers.
+    """
+
+    def __init__(self, crop_padding=4, flip=True, contrast=0.0,
+                 brightness=0.0, seed=None):
+        """
+        Inputs:
+        - crop_padding: Padding in pixels added on every side before random
+          cropping; 0 disables cropping.
+        - flip: Whether to flip images horizontally at random.
+        - contrast: Half-width of the range of per-channel scale factors;
+          0 disables scaling.
+        - brightness: Standard deviation of the per-channel shifts; 0
+          disables shifting.
+        - seed: If None, random numbers come from numpy's global random
+          number generator, which Solver checkpoints and restores; otherwise
+          from a RandomState seeded with seed.
+        """
+        self.crop_padding = crop_padding
+        self.flip = flip
+        self.contrast = contrast
+        self.brightness = brightness
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+        self._padded = None
+        self._padded_shape = None
+        self._index = None
+        self._out = None
+
+
+    def _buffer(self, name, shape, dtype):
+        """
+        Return a view of shape shape of the buffer called name, reallocating
+        it if it is too small or of another dtype.
+        """
+        buf = getattr(self, name)
+        size = int(np.prod(shape))
+        if buf is None or buf.size < size or buf.dtype != dtype:
+            buf = np.empty(size, dtype=dtype)
+            setattr(self, name, buf)
+        return buf[:size].reshape(shape)
+
+
+    def __call__(self, X, out=None, rng=None):
+        """
+        Augment a minibatch.
+
+        Inputs:
+        - X: Array of shape (N, C, H, W).
+        - out: Array of the shape and dtype of X to write the result into; if
+          None, the result is written into a buffer of the Augmenter that is
+          overwritten by the next call.
+        - rng: A RandomState or an integer seed for this call only; defaults
+          to the random number generator of the Augmenter.
+
+        Returns:
+        - out: The augmented minibatch.
+        """
+        if rng is None:
+            rng = self.rng
+        elif not isinstance(rng, np.random.RandomState):
+            rng = np.random.RandomState(rng)
+        N, C, H, W = X.shape
+        if out is None:
+            out = self._buffer('_out', X.shape, X.dtype)
+        p = self.crop_padding
+
+        if p > 0 or self.flip:
+            Hp, Wp = H + 2 * p, W + 2 * p
+            # Only the interior is ever written, so the border stays zero
+            # while the geometry of the images stays the same
+            new = self._padded is None or self._padded.dtype != X.dtype or \
+                self._padded.size < N * C * Hp * Wp or \
+                self._padded_shape != (C, Hp, Wp)
+            padded = self._buffer('_padded', (N, C, Hp, Wp), X.dtype)
+            if new:
+                self._padded.fill(0)
+                self._padded_shape = (C, Hp, Wp)
+            padded[:, :, p:p + H, p:p + W] = X
+
+            # Flat index of every output pixel in padded:
+            # n * C*Hp*Wp + c * Hp*Wp + (dy + h) * Wp + dx + (w or W-1-w)
+            dy = rng.randint(2 * p + 1, size=N) if p > 0 else np.zeros(N, int)
+            dx = rng.randint(2 * p + 1, size=N) if p > 0 else np.zeros(N, int)
+            cols = np.tile(np.arange(W), (N, 1))
+            if self.flip:
+                flipped = rng.rand(N) < 0.5
+                cols[flipped] = cols[flipped, ::-1]
+            cols += dx[:, None]
+            index = self._buffer('_index', (N, C, H, W), np.intp)
+            rows = np.arange(N) * (C * Hp * Wp) + dy * Wp
+            np.add(rows[:, None, None, None],
+                   (np.arange(C) * (Hp * Wp))[None, :, None, None],
+                   out=index)
+            index += (np.arange(H) * Wp)[None, None, :, None]
+            index += cols[:, None, None, :]
+            np.take(padded.reshape(-1), index, out=out)
+        elif out is not X:
+            out[...] = X
+
+        if self.contrast > 0:
+            scale = rng.uniform(1 - self.contrast, 1 + self.contrast,
+                                size=(N, C, 1, 1))
+            out *= scale.astype(out.dtype)
+        if self.brightness > 0:
+            shift = rng.normal(0, self.brightness, size=(N, C, 1, 1))
+            out += shift.astype(out.dtype)
+        return out
@@ -0,0 +1,404 @@
+from __future__ import print_function, division
+from builtins import range
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from cs231n import layers
+from cs231n import fast_layers
+from cs231n import optim
+from cs231n.profiler import estimate_flops
+
+"""
+Benchmarks for the layer kernels, the fast convolution and pooling kernels
+and the update rules.
+
+Every benchmark case runs one forward or backward kernel (or one update rule
+step) on synthetic data of a representative shape and dtype, and records the
+median and best wall time over several repeats, the throughput in examples
+(or parameters, for update rules) per second, the estimated GFLOP/s and the
+peak memory allocated during one call as measured by tracemalloc. Results can
+be written as JSON and compared with a JSON file from an earlier run to flag
+regressions.
+
+Run from the assignment2 directory:
+
+python -m cs231n.benchmarks --output results.json
+python -m cs231n.benchmarks --baseline results.json --filter conv
+
+The naive kernels (and batchnorm_backward, which loops over every element) are
+only run on the smallest shape.
+"""
+
+
+# Shapes swept for every kernel family, as (label, parameters) pairs
+AFFINE_SHAPES = [('N64_D512_M256', (64, 512, 256)),
+                 ('N256_D3072_M512', (256, 3072, 512))]
+ELEMENTWISE_SHAPES = [('N64_D512', (64, 512)),
+                      ('N256_D4096', (256, 4096))]
+CONV_SHAPES = [('N4_C3_16x16_F8_3x3', ((4, 3, 16, 16), (8, 3, 3, 3), 1, 1)),
+               ('N32_C3_32x32_F32_7x7', ((32, 3, 32, 32), (32, 3, 7, 7), 1, 3)),
+               ('N32_C32_16x16_F64_3x3', ((32, 32, 16, 16), (64, 32, 3, 3),
+                                          1, 1))]
+POOL_SHAPES = [('N4_C8_16x16_2x2', ((4, 8, 16, 16), 2, 2)),
+               ('N32_C32_32x32_2x2', ((32, 32, 32, 32), 2, 2))]
+SPATIAL_SHAPES = [('N32_C32_16x16', (32, 32, 16, 16))]
+LOSS_SHAPES = [('N256_C10', (256, 10)), ('N256_C1000', (256, 1000))]
+FUSED_LOSS_SHAPES = [('N256_D512_C10', (256, 512, 10)),
+                     ('N1024_D512_C200', (1024, 512, 200))]
+OPTIM_SHAPES = [('P100K', 100000), ('P4M', 4000000)]
+DTYPES = ('float32', 'float64')
+
+
+def _forward_backward_cases(forward, backward, shapes, make_inputs,
+                            naive=False, include_forward=True):
+    """
+    Build the cases for one forward/backward kernel pair, named after the
+    kernel functions. make_inputs is called as make_inputs(params, dtype, rng)
+    and returns the forward arguments; the backward kernel is benchmarked on
+    the cache of one forward call.
+    """
+    if naive:
+        shapes = shapes[:1]
+    cases = []
+    for label, params in shapes:
+        for dtype in DTYPES:
+            def setup_forward(params=params, dtype=dtype):
+                args = make_inputs(params, dtype, np.random.RandomState(0))
+                return forward, args, args[0].shape[0]
+
+            def setup_backward(params=params, dtype=dtype):
+                args = make_inputs(params, dtype, np.random.RandomState(0))
+                out, cache = forward(*args)
+                dout = np.random.RandomState(1).randn(*out.shape).astype(dtype)
+                return backward, (dout, cache), dout.shape[0]
+
+            if include_forward:
+                cases.append((forward.__name__, label, dtype, setup_forward))
+            cases.append((backward.__name__, label, dtype, setup_backward))
+    return cases
+
+
+def _affine_inputs(params, dtype, rng):
+    N, D, M = params
+    return (rng.randn(N, D).astype(dtype), rng.randn(D, M).astype(dtype),
+            rng.randn(M).astype(dtype))
+
+
+def _relu_inputs(params, dtype, rng):
+    return (rng.randn(*params).astype(dtype),)
+
+
+def _batchnorm_inputs(params, dtype, rng):
+    D = params[1]
+    return (rng.randn(*params).astype(dtype), np.ones(D, dtype=dtype),
+            np.zeros(D, dtype=dtype), {'mode': 'train'})
+
+
+def _dropout_inputs(params, dtype, rng):
+    return (rng.randn(*params).astype(dtype), {'mode': 'train', 'p': 0.5})
+
+
+def _conv_inputs(params, dtype, rng):
+    x_shape, w_shape, stride, pad = params
+    return (rng.randn(*x_shape).astype(dtype), rng.randn(*w_shape).astype(dtype),
+            rng.randn(w_shape[0]).astype(dtype), {'stride': stride, 'pad': pad})
+
+
+def _pool_inputs(params, dtype, rng):
+    x_shape, size, stride = params
+    return (rng.randn(*x_shape).astype(dtype),
+            {'pool_height': size, 'pool_width': size, 'stride': stride})
+
+
+def _loss_cases():
+    cases = []
+    for loss in (layers.svm_loss, layers.softmax_loss):
+        for label, (N, C) in LOSS_SHAPES:
+            for dtype in DTYPES:
+                def setup(loss=loss, N=N, C=C, dtype=dtype):
+                    rng = np.random.RandomState(0)
+                    return (loss, (rng.randn(N, C).astype(dtype),
+                                   rng.randint(C, size=N)), N)
+                cases.append((loss.__name__, label, dtype, setup))
+    return cases
+
+
+def affine_softmax_loss_unfused(x, w, b, y):
+    """ affine_softmax_loss computed by the unfused layers, for reference. """
+    scores, cache = layers.affine_forward(x, w, b)
+    loss, dscores = layers.softmax_loss(scores, y)
+    dx, dw, db = layers.affine_backward(dscores, cache)
+    return loss, dx, dw, db
+
+
+def _fused_loss_cases():
+    cases = []
+    for loss in (layers.affine_softmax_loss, affine_softmax_loss_unfused,
+                 layers.affine_svm_loss):
+        for label, (N, D, C) in FUSED_LOSS_SHAPES:
+            for dtype in DTYPES:
+                def setup(loss=loss, N=N, D=D, C=C, dtype=dtype):
+                    rng = np.random.RandomState(0)
+                    x, w, b = _affine_inputs((N, D, C), dtype, rng)
+                    return loss, (x, 0.01 * w, b, rng.randint(C, size=N)), N
+                cases.append((loss.__name__, label, dtype, setup))
+    return cases
+
+
+def _optim_cases():
+    cases = []
+    for name in ('sgd', 'sgd_momentum', 'rmsprop', 'adam'):
+        update_rule = getattr(optim, name)
+        for label, P in OPTIM_SHAPES:
+            for dtype in DTYPES:
+                def setup(update_rule=update_rule, P=P, dtype=dtype):
+                    rng = np.random.RandomState(0)
+                    w = rng.randn(P).astype(dtype)
+                    dw = rng.randn(P).astype(dtype)
+                    config = {'learning_rate': 1e-3}
+                    # Run one step so that the update rule creates its state
+                    update_rule(w, dw, config)
+                    return update_rule, (w, dw, config), P
+                cases.append((name, label, dtype, setup))
+    return cases
+
+
+def all_cases():
+    """
+    Return every benchmark case as a (kernel, shape, dtype, setup) tuple,
+    where setup() builds the inputs and returns a tuple of
+    (function, args, items) and items is the number of examples (or
+    parameters) processed by one call.
+    """
+    cases = []
+    cases += _forward_backward_cases(layers.affine_forward,
+                                     layers.affine_backward,
+                                     AFFINE_SHAPES, _affine_inputs)
+    cases += _forward_backward_cases(layers.relu_forward,
+                                     layers.relu_backward,
+                                     ELEMENTWISE_SHAPES, _relu_inputs)
+    cases += _forward_backward_cases(layers.batchnorm_forward,
+                                     layers.batchnorm_backward_alt,
+                                     ELEMENTWISE_SHAPES, _batchnorm_inputs)
+    # batchnorm_backward loops over every element, so treat it as naive
+    cases += _forward_backward_cases(layers.batchnorm_forward,
+                                     layers.batchnorm_backward,
+                                     ELEMENTWISE_SHAPES, _batchnorm_inputs,
+                                     naive=True, include_forward=False)
+    cases += _forward_backward_cases(layers.spatial_batchnorm_forward,
+                                     layers.spatial_batchnorm_backward,
+                                     SPATIAL_SHAPES, _batchnorm_inputs)
+    cases += _forward_backward_cases(layers.dropout_forward,
+                                     layers.dropout_backward,
+                                     ELEMENTWISE_SHAPES, _dropout_inputs)
+    cases += _forward_backward_cases(layers.conv_forward_naive,
+                                     layers.conv_backward_naive,
+                                     CONV_SHAPES, _conv_inputs, naive=True)
+    cases += _forward_backward_cases(fast_layers.conv_forward_im2col,
+                                     fast_layers.conv_backward_im2col,
+                                     CONV_SHAPES, _conv_inputs)
+    cases += _forward_backward_cases(fast_layers.conv_forward_strides,
+                                     fast_layers.conv_backward_strides,
+                                     CONV_SHAPES, _conv_inputs)
+    cases += _forward_backward_cases(layers.max_pool_forward_naive,
+                                     layers.max_pool_backward_naive,
+                                     POOL_SHAPES, _pool_inputs, naive=True)
+    cases += _forward_backward_cases(fast_layers.max_pool_forward_reshape,
+                                     fast_layers.max_pool_backward_reshape,
+                                     POOL_SHAPES, _pool_inputs)
+    cases += _forward_backward_cases(fast_layers.max_pool_forward_im2col,
+                                     fast_layers.max_pool_backward_im2col,
+                                     POOL_SHAPES, _pool_inputs)
+    cases += _loss_cases()
+    cases += _fused_loss_cases()
+    cases += _optim_cases()
+    return cases
+
+
+def case_key(kernel, shape, dtype):
+    return '%s/%s/%s' % (kernel, shape, dtype)
+
+
+def run_case(kernel, shape, dtype, setup, repeat=5, min_time=0.05):
+    """
+    Benchmark one case.
+
+    Inputs:
+    - kernel, shape, dtype, setup: A case as returned by all_cases().
+    - repeat: Number of timed measurements.
+    - min_time: Each measurement calls the kernel in a loop for at least this
+      many seconds and reports the time per call.
+
+    Returns a dictionary with keys 'key', 'kernel', 'shape', 'dtype', 'calls',
+    'median_time', 'best_time', 'items_per_s', 'gflops_per_s' and
+    'peak_bytes'.
+    """
+    fn, args, items = setup()
+
+    # One untimed call warms up caches; it also measures the peak memory
+    if tracemalloc.is_tracing():
+        out = fn(*args)
+        peak = None
+    else:
+        tracemalloc.start()
+        try:
+            out = fn(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    flops = estimate_flops(kernel, args, out)
+    del out
+
+    # Pick the number of calls per measurement from one timed call
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    calls = max(1, int(min_time / max(elapsed, 1e-9)))
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn(*args)
+        times.append((time.perf_counter() - start) / calls)
+    median_time = float(np.median(times))
+
+    return {
+        'key': case_key(kernel, shape, dtype),
+        'kernel': kernel,
+        'shape': shape,
+        'dtype': dtype,
+        'calls': calls * repeat,
+        'median_time': median_time,
+        'best_time': float(min(times)),
+        'items_per_s': items / median_time,
+        'gflops_per_s': flops / median_time / 1e9,
+        'peak_bytes': peak,
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance=0.1):
+    """
+    Flag the results whose median time is more than tolerance (a fraction)
+    slower than in baseline.
+
+    Inputs:
+    - results: List of dictionaries from run_case.
+    - baseline: Dictionary loaded from a JSON file written by run_benchmarks.
+    - tolerance: Allowed relative slowdown.
+
+    Returns:
+    - regressions: List of (key, baseline_time, time) tuples. Every result
+      also gets a 'baseline_ratio' entry (time / baseline time, or None if the
+      case is not in the baseline) and a boolean 'regression' entry.
+    """
+    baseline_times = dict((r['key'], r['median_time'])
+                          for r in baseline['results'] if 'error' not in r)
+    regressions = []
+    for r in results:
+        if 'error' in r:
+            continue
+        old = baseline_times.get(r['key'])
+        r['baseline_ratio'] = None if old is None else r['median_time'] / old
+        r['regression'] = old is not None and \
+            r['median_time'] > (1 + tolerance) * old
+        if r['regression']:
+            regressions.append((r['key'], old, r['median_time']))
+    return regressions
+
+
+def run_benchmarks(kernel_filter=None, dtypes=DTYPES, repeat=5, min_time=0.05,
+                   baseline=None, tolerance=0.1, verbose=True):
+    """
+    Run every benchmark case whose key contains kernel_filter.
+
+    Returns a JSON-serializable dictionary with keys 'machine' and 'results'
+    and, if a baseline was given, 'regressions'. Cases whose kernel raises an
+    exception get a result with an 'error' entry instead of timings.
+    """
+    results = []
+    for kernel, shape, dtype, setup in all_cases():
+        key = case_key(kernel, shape, dtype)
+        if kernel_filter is not None and kernel_filter not in key:
+            continue
+        if dtype not in dtypes:
+            continue
+        try:
+            r = run_case(kernel, shape, dtype, setup, repeat=repeat,
+                         min_time=min_time)
+        except Exception as e:
+            # Record broken kernels instead of aborting the whole run
+            results.append({'key': key, 'kernel': kernel, 'shape': shape,
+                            'dtype': dtype,
+                            'error': '%s: %s' % (type(e).__name__, e)})
+            if verbose:
+                print('%-60s ERROR %s' % (key, results[-1]['error']))
+            continue
+        results.append(r)
+        if verbose:
+            peak = '-' if r['peak_bytes'] is None else \
+                '%.2f' % (r['peak_bytes'] / 2**20)
+            print('%-60s %10.3f ms %12.0f items/s %8.2f GFLOP/s %8s MB' % (
+                  key, 1e3 * r['median_time'], r['items_per_s'],
+                  r['gflops_per_s'], peak))
+
+    report = {
+        'machine': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'results': results,
+    }
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline, tolerance)
+        report['regressions'] = [r[0] for r in regressions]
+        if verbose:
+            for key, old, new in regressions:
+                print('REGRESSION %s: %.3f ms -> %.3f ms (%+.0f%%)' % (
+                      key, 1e3 * old, 1e3 * new, 100 * (new / old - 1)))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the cs231n layer kernels and update rules.')
+    parser.add_argument('--filter', default=None,
+                        help='Only run cases whose key contains this string')
+    parser.add_argument('--dtype', action='append', choices=DTYPES,
+                        help='Only run this dtype; may be repeated')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='Seconds per timed measurement')
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='Compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    report = run_benchmarks(kernel_filter=args.filter,
+                            dtypes=args.dtype or DTYPES, repeat=args.repeat,
+                            min_time=args.min_time, baseline=baseline,
+                            tolerance=args.tolerance)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
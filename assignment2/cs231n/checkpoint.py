@@ -0,0 +1,381 @@
+from __future__ import print_function, division
+from builtins import object
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+from six.moves import queue
+
+"""
+Compact, asynchronous checkpoints for Solver.
+
+A checkpoint is a directory holding one .npy file per model parameter and per
+array of update rule state, which np.load can memory-map, plus a meta.json
+with everything else, including the iteration counter and the state of
+numpy's global random number generator:
+
+<checkpoint_name>_epoch_<epoch>/
+  meta.json
+  params/<param>.npy
+  optim/<param>/<key>.npy
+  best_params/<param>.npy
+  bn_params/<layer>/<key>.npy       running averages of batchnorm layers
+  eval/{train,val}_indices.npy      fixed accuracy-check subsets
+
+This is everything Solver.resume needs to continue a run exactly where it
+left off.
+
+The loss and accuracy histories grow by a bounded amount every epoch, so
+instead of being rewritten into every checkpoint they are appended to raw
+little-endian float64 files in a directory shared by all checkpoints of a
+run, and meta.json records the run and how many entries belong to each
+checkpoint:
+
+<checkpoint_name>_history/
+  <run>.loss_history.f8
+  <run>.train_acc_history.f8
+  <run>.val_acc_history.f8
+
+Every CheckpointWriter is a run of its own with a random run id, which
+starts its files with the full history of the Solver (so a resumed run
+does not depend on the files of the run it resumed) and only ever appends
+to them. A new Solver reusing a checkpoint_name, in this process or in
+another one, therefore never touches the history that existing checkpoints
+refer to.
+
+Checkpoints are written by a background thread from copies of the arrays
+taken when the checkpoint is requested, so training only pays for a memory
+copy. Each checkpoint is first written to a temporary directory that is then
+renamed into place, so a crash never leaves a half-written checkpoint behind;
+a checkpoint it replaces is first renamed to <path>.old and only deleted
+afterwards, and is loaded instead if a crash leaves it behind.
+<checkpoint_name>_latest names the newest complete checkpoint.
+"""
+
+FORMAT_VERSION = 2
+HISTORY_KEYS = ('loss_history', 'train_acc_history', 'val_acc_history')
+
+
+def _to_json(value):
+    """
+    Convert numpy scalars and arrays, also inside lists and tuples, to plain
+    Python values for json.
+    """
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    return value
+
+
+def _split_arrays(d):
+    """
+    Split a dictionary into the entries holding numpy arrays and the rest,
+    converting the rest to plain Python values.
+    """
+    arrays, scalars = {}, {}
+    for k, v in d.items():
+        if isinstance(v, np.ndarray):
+            arrays[k] = np.array(v)
+        else:
+            scalars[k] = _to_json(v)
+    return arrays, scalars
+
+
+def _atomic_write_text(filename, text):
+    tmp = '%s.tmp' % filename
+    with open(tmp, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, filename)
+
+
+class CheckpointWriter(object):
+    """
+    Writes Solver checkpoints in a background thread.
+
+    Example usage:
+
+    writer = CheckpointWriter('checkpoints/fc_net')
+    writer.save(solver)  # returns as soon as the state has been copied
+    writer.close()       # waits for all pending writes
+    """
+
+    def __init__(self, checkpoint_name, max_pending=2, verbose=False):
+        """
+        Inputs:
+        - checkpoint_name: Prefix of the checkpoint directories.
+        - max_pending: Maximum number of snapshots waiting to be written;
+          save() blocks when the writer falls this far behind.
+        - verbose: Boolean; if true print a line for every checkpoint.
+        """
+        self.checkpoint_name = checkpoint_name
+        self.history_dir = '%s_history' % checkpoint_name
+        self.run = uuid.uuid4().hex[:16]
+        self.verbose = verbose
+        self.error = None
+        # Number of history entries already handed to the writer thread
+        self._history_lengths = dict((k, 0) for k in HISTORY_KEYS)
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def snapshot(self, solver):
+        """
+        Copy everything a checkpoint of solver needs. This runs on the
+        training thread and only copies arrays; nothing is written to disk.
+        """
+        arrays = {}
+        for k, v in solver.model.params.items():
+            arrays['params/%s' % k] = np.array(v)
+        # With async_eval the evaluator thread may be updating the best model
+        with solver._best_lock:
+            best_params = dict(solver.best_params)
+            best_val_acc = solver.best_val_acc
+        for k, v in best_params.items():
+            arrays['best_params/%s' % k] = np.array(v)
+
+        optim_scalars = {}
+        for p, config in solver.optim_configs.items():
+            config_arrays, optim_scalars[p] = _split_arrays(config)
+            for k, v in config_arrays.items():
+                arrays['optim/%s/%s' % (p, k)] = v
+
+        bn_scalars = []
+        for i, bn_param in enumerate(getattr(solver.model, 'bn_params', [])):
+            bn_arrays, scalars = _split_arrays(bn_param)
+            bn_scalars.append(scalars)
+            for k, v in bn_arrays.items():
+                arrays['bn_params/%d/%s' % (i, k)] = v
+
+        if solver._evaluators is not None:
+            for split, evaluator in zip(('train', 'val'), solver._evaluators):
+                if evaluator.indices is not None:
+                    arrays['eval/%s_indices' % split] = np.array(
+                        evaluator.indices)
+
+        history_tails = {}
+        history_lengths = {}
+        for k in HISTORY_KEYS:
+            values = getattr(solver, k)
+            history_tails[k] = np.array(values[self._history_lengths[k]:],
+                                        dtype='<f8')
+            history_lengths[k] = self._history_lengths[k] = len(values)
+
+        rng_name, rng_keys, rng_pos, rng_has_gauss, rng_gauss = \
+            np.random.get_state()
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'model_class': type(solver.model).__name__,
+            'update_rule': solver.update_rule.__name__,
+            'lr_decay': solver.lr_decay,
+            'optim_config': dict((k, _to_json(v))
+                                 for k, v in solver.optim_config.items()),
+            'batch_size': solver.batch_size,
+            'num_train_samples': solver.num_train_samples,
+            'num_val_samples': solver.num_val_samples,
+            'epoch': solver.epoch,
+            'iteration': solver.iteration,
+            'best_val_acc': _to_json(best_val_acc),
+            'history_run': self.run,
+            'history_lengths': history_lengths,
+            'optim_scalars': optim_scalars,
+            'bn_scalars': bn_scalars,
+            'rng_state': [rng_name, [int(k) for k in rng_keys], int(rng_pos),
+                          int(rng_has_gauss), float(rng_gauss)],
+        }
+        return {
+            'meta': meta,
+            'arrays': arrays,
+            'history_tails': history_tails,
+        }
+
+
+    def save(self, solver):
+        """
+        Snapshot solver and queue the snapshot to be written in the
+        background. Returns the path the checkpoint will be written to.
+        """
+        if self.error is not None:
+            raise self.error
+        snapshot = self.snapshot(solver)
+        path = '%s_epoch_%d' % (self.checkpoint_name, solver.epoch)
+        self._jobs.put((path, snapshot))
+        return path
+
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                if self.error is None:
+                    self._write(*job)
+            except Exception as e:
+                self.error = e
+            finally:
+                self._jobs.task_done()
+
+
+    def _append_history(self, history_tails):
+        if not os.path.isdir(self.history_dir):
+            os.makedirs(self.history_dir)
+        for k, tail in history_tails.items():
+            filename = os.path.join(self.history_dir,
+                                    '%s.%s.f8' % (self.run, k))
+            with open(filename, 'ab') as f:
+                tail.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+    def _write(self, path, snapshot):
+        """ Write one snapshot to disk. Runs on the writer thread. """
+        self._append_history(snapshot['history_tails'])
+
+        tmp = '%s.tmp' % path
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        for name, v in snapshot['arrays'].items():
+            filename = os.path.join(tmp, '%s.npy' % name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            np.save(filename, v)
+        _atomic_write_text(os.path.join(tmp, 'meta.json'),
+                           json.dumps(snapshot['meta'], indent=2,
+                                      sort_keys=True))
+
+        # Swap the finished directory into place, keeping the checkpoint it
+        # replaces until the new one is there
+        old = '%s.old' % path
+        if os.path.exists(path):
+            if os.path.exists(old):
+                shutil.rmtree(old)
+            os.rename(path, old)
+        os.rename(tmp, path)
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        _atomic_write_text('%s_latest' % self.checkpoint_name,
+                           os.path.basename(path))
+        if self.verbose:
+            print('Saved checkpoint to "%s"' % path)
+
+
+    def wait(self):
+        """ Block until all queued checkpoints have been written. """
+        self._jobs.join()
+        if self.error is not None:
+            raise self.error
+
+
+    def close(self):
+        """ Write all queued checkpoints and stop the writer thread. """
+        self._jobs.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def latest_checkpoint(checkpoint_name):
+    """
+    Return the path of the newest complete checkpoint written under
+    checkpoint_name, or None if there is none.
+    """
+    pointer = '%s_latest' % checkpoint_name
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer, 'r') as f:
+        name = f.read().strip()
+    return _existing_checkpoint(
+        os.path.join(os.path.dirname(checkpoint_name), name))
+
+
+def _existing_checkpoint(path):
+    """
+    Return path, or the <path>.old left behind if CheckpointWriter crashed
+    while replacing the checkpoint at path.
+    """
+    path = os.path.normpath(path)
+    if not os.path.isdir(path) and os.path.isdir('%s.old' % path):
+        return '%s.old' % path
+    return path
+
+
+def _load_arrays(directory, mmap_mode):
+    """ Load every .npy file in directory into a dictionary. """
+    arrays = {}
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if filename.endswith('.npy'):
+                arrays[filename[:-len('.npy')]] = np.load(
+                    os.path.join(directory, filename), mmap_mode=mmap_mode)
+    return arrays
+
+
+def load_checkpoint(path, mmap_mode='r'):
+    """
+    Load a checkpoint directory written by CheckpointWriter.
+
+    Inputs:
+    - path: Path of the checkpoint directory.
+    - mmap_mode: Passed to np.load; the default memory-maps every array
+      read-only. Use None to read the arrays into memory.
+
+    Returns a dictionary with the keys of meta.json plus:
+    - params, best_params: Dictionaries mapping parameter names to arrays.
+    - optim_configs: Dictionary mapping parameter names to update rule
+      configs, including their cached arrays.
+    - bn_params: List with the batchnorm parameter dictionary of each layer.
+    - train_indices, val_indices: Fixed accuracy-check subsets, or None.
+    - loss_history, train_acc_history, val_acc_history: Lists of floats, as
+      they were when the checkpoint was taken.
+    """
+    path = _existing_checkpoint(path)
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint['format_version'] > FORMAT_VERSION:
+        raise ValueError('Checkpoint "%s" has unsupported format version %d'
+                         % (path, checkpoint['format_version']))
+
+    checkpoint['params'] = _load_arrays(os.path.join(path, 'params'),
+                                        mmap_mode)
+    checkpoint['best_params'] = _load_arrays(
+        os.path.join(path, 'best_params'), mmap_mode)
+
+    optim_configs = {}
+    for p, scalars in checkpoint.pop('optim_scalars').items():
+        optim_configs[p] = dict(scalars)
+        optim_configs[p].update(_load_arrays(os.path.join(path, 'optim', p),
+                                             mmap_mode))
+    checkpoint['optim_configs'] = optim_configs
+
+    bn_params = []
+    for i, scalars in enumerate(checkpoint.pop('bn_scalars')):
+        bn_params.append(dict(scalars))
+        bn_params[i].update(_load_arrays(
+            os.path.join(path, 'bn_params', str(i)), mmap_mode))
+    checkpoint['bn_params'] = bn_params
+
+    eval_arrays = _load_arrays(os.path.join(path, 'eval'), mmap_mode)
+    checkpoint['train_indices'] = eval_arrays.get('train_indices')
+    checkpoint['val_indices'] = eval_arrays.get('val_indices')
+
+    name = os.path.basename(os.path.normpath(path))
+    history_dir = os.path.join(os.path.dirname(os.path.normpath(path)),
+                               name[:name.rindex('_epoch_')] + '_history')
+    # Version 1 checkpoints share one set of history files per name
+    run = checkpoint.get('history_run')
+    for k, length in checkpoint['history_lengths'].items():
+        filename = '%s.f8' % k if run is None else '%s.%s.f8' % (run, k)
+        values = np.fromfile(os.path.join(history_dir, filename),
+                             dtype='<f8', count=length)
+        checkpoint[k] = values.tolist()
+    return checkpoint
@@ -0,0 +1,240 @@
+from __future__ import print_function, division
+from builtins import range
+import math
+
+import numpy as np
+
+"""
+Two-level class hierarchies for the hierarchical softmax of
+layers.hierarchical_softmax_loss.
+
+A hierarchy partitions the C classes into K clusters. With about sqrt(C)
+clusters of about sqrt(C) classes each, training an example and decoding its
+top-1 prediction costs O(sqrt(C)) scores instead of the C of a flat softmax.
+The clusters can come from:
+
+- the data: balanced_kmeans groups similar class vectors (such as class mean
+  images or the columns of the last weights of a trained flat classifier)
+  into clusters of at most ceil(C / K) classes; class_mean_clusters does
+  this with the mean training example of every class;
+- WordNet: wordnet_clusters cuts the WordNet is-a tree above the wnids of a
+  dataset such as TinyImageNet (see data_utils.load_tiny_imagenet, which
+  returns the wnids), so that every cluster holds semantically related
+  classes.
+
+make_hierarchy turns a list of clusters into the arrays used by the layers.
+
+Example usage:
+
+data = load_tiny_imagenet('cs231n/datasets/tiny-imagenet-200')
+is_a = load_wordnet_is_a('wordnet.is_a.txt')
+clusters = wordnet_clusters(data['wnids'], is_a)
+model = FullyConnectedNet([512], input_dim=3 * 64 * 64, num_classes=200,
+                          hierarchy=make_hierarchy(clusters))
+"""
+
+
+def make_hierarchy(clusters, num_classes=None):
+    """
+    Build the arrays describing a two-level hierarchy.
+
+    Inputs:
+    - clusters: List of K non-empty lists of class indices; every class in
+      range(num_classes) must appear in exactly one cluster.
+    - num_classes: Number of classes C; defaults to the number of classes in
+      clusters.
+
+    Returns a dictionary with integer arrays:
+    - order: Shape (C,), the classes cluster by cluster; column j of the
+      class weights of a hierarchical softmax belongs to class order[j].
+    - column: Shape (C,), the inverse of order.
+    - cluster: Shape (C,), the cluster of every class.
+    - offsets: Shape (K + 1,), the columns of cluster k are
+      offsets[k]:offsets[k + 1].
+    """
+    clusters = [list(c) for c in clusters]
+    if any(len(c) == 0 for c in clusters):
+        raise ValueError('Clusters must not be empty')
+    order = np.array([c for cluster in clusters for c in cluster], dtype=int)
+    if num_classes is None:
+        num_classes = len(order)
+    if len(order) != num_classes or \
+            not np.array_equal(np.sort(order), np.arange(num_classes)):
+        raise ValueError('Every class must be in exactly one cluster')
+    column = np.empty(num_classes, dtype=int)
+    column[order] = np.arange(num_classes)
+    sizes = [len(c) for c in clusters]
+    cluster = np.repeat(np.arange(len(clusters)), sizes)[column]
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+    return {'order': order, 'column': column, 'cluster': cluster,
+            'offsets': offsets}
+
+
+def hierarchy_clusters(hierarchy):
+    """ Return the list of clusters of a hierarchy from make_hierarchy. """
+    offsets = hierarchy['offsets']
+    return [hierarchy['order'][offsets[k]:offsets[k + 1]].tolist()
+            for k in range(len(offsets) - 1)]
+
+
+def default_num_clusters(num_classes):
+    """ Number of clusters that minimizes the cost of a hierarchy: sqrt(C). """
+    return max(1, int(round(math.sqrt(num_classes))))
+
+
+def balanced_kmeans(vectors, num_clusters=None, num_iters=20, seed=0):
+    """
+    Cluster vectors with k-means, constrained so that no cluster holds more
+    than ceil(C / K) vectors. Each assignment step visits all (vector,
+    centroid) pairs by increasing distance and assigns a vector to the
+    nearest centroid that still has room.
+
+    Inputs:
+    - vectors: Array of shape (C, F), one vector per class.
+    - num_clusters: Number of clusters K; defaults to
+      default_num_clusters(C).
+    - num_iters: Number of k-means iterations.
+    - seed: Seed of the random initial centroids.
+
+    Returns:
+    - clusters: List of K lists of class indices, for make_hierarchy.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(len(vectors), -1)
+    C = vectors.shape[0]
+    K = num_clusters or default_num_clusters(C)
+    K = min(K, C)
+    capacity = -(-C // K)
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(C, K, replace=False)]
+    assignment = None
+    for _ in range(num_iters):
+        dists = (np.sum(vectors ** 2, axis=1)[:, None] -
+                 2 * vectors.dot(centroids.T) +
+                 np.sum(centroids ** 2, axis=1)[None, :])
+        new_assignment = np.full(C, -1, dtype=int)
+        counts = np.zeros(K, dtype=int)
+        for flat in np.argsort(dists, axis=None, kind='mergesort'):
+            c, k = divmod(int(flat), K)
+            if new_assignment[c] < 0 and counts[k] < capacity:
+                new_assignment[c] = k
+                counts[k] += 1
+        if assignment is not None and \
+                np.array_equal(assignment, new_assignment):
+            break
+        assignment = new_assignment
+        for k in range(K):
+            if counts[k] > 0:
+                centroids[k] = vectors[assignment == k].mean(axis=0)
+    return [np.nonzero(assignment == k)[0].tolist() for k in range(K)
+            if np.any(assignment == k)]
+
+
+def class_mean_clusters(X, y, num_clusters=None, num_classes=None, **kwargs):
+    """
+    Cluster classes by the mean of their examples with balanced_kmeans.
+
+    Inputs:
+    - X: Array of shape (N, d_1, ..., d_k) of training examples.
+    - y: Array of shape (N,) of labels.
+    - num_clusters: Number of clusters, as for balanced_kmeans.
+    - num_classes: Number of classes; defaults to max(y) + 1.
+    - kwargs: Passed to balanced_kmeans.
+
+    Returns:
+    - clusters: List of lists of class indices, for make_hierarchy.
+    """
+    if num_classes is None:
+        num_classes = int(np.max(y)) + 1
+    X = X.reshape(X.shape[0], -1)
+    means = np.zeros((num_classes, X.shape[1]))
+    np.add.at(means, y, X)
+    means /= np.maximum(np.bincount(y, minlength=num_classes), 1)[:, None]
+    return balanced_kmeans(means, num_clusters, **kwargs)
+
+
+def load_wordnet_is_a(filename):
+    """
+    Load the WordNet is-a relation as distributed with ImageNet
+    (wordnet.is_a.txt): one "parent_wnid child_wnid" pair per line.
+
+    Returns:
+    - parents: Dictionary from wnid to the list of its parent wnids.
+    """
+    parents = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2:
+                parents.setdefault(fields[1], []).append(fields[0])
+    return parents
+
+
+def _wordnet_path(wnid, parents):
+    """ Path from a root of the is-a graph down to wnid, via first parents. """
+    path = [wnid]
+    seen = set(path)
+    while parents.get(path[-1]):
+        parent = parents[path[-1]][0]
+        if parent in seen:
+            break
+        path.append(parent)
+        seen.add(parent)
+    return path[::-1]
+
+
+def wordnet_clusters(wnids, parents, max_cluster_size=None):
+    """
+    Cluster classes by cutting the WordNet is-a tree.
+
+    The classes are split recursively by the synset below their common
+    ancestor until no group holds more than max_cluster_size classes; the
+    groups, in depth-first order of the tree, are then packed greedily into
+    clusters of at most max_cluster_size classes, so that small sibling
+    groups share a cluster.
+
+    Inputs:
+    - wnids: List of the C wnids of the classes, in label order.
+    - parents: Dictionary from wnid to the list of its parent wnids, as
+      returned by load_wordnet_is_a. Synsets with several parents are placed
+      under their first parent.
+    - max_cluster_size: Largest cluster; defaults to about sqrt(C).
+
+    Returns:
+    - clusters: List of lists of class indices, for make_hierarchy.
+    """
+    C = len(wnids)
+    if max_cluster_size is None:
+        max_cluster_size = -(-C // default_num_clusters(C))
+    paths = [_wordnet_path(wnid, parents) for wnid in wnids]
+
+    groups = []
+
+    def split(classes, depth):
+        if len(classes) <= max_cluster_size:
+            groups.append(classes)
+            return
+        children = {}
+        for c in classes:
+            key = paths[c][depth] if depth < len(paths[c]) else None
+            children.setdefault(key, []).append(c)
+        if len(children) == 1 and None not in children:
+            split(classes, depth + 1)
+            return
+        for key in sorted(children, key=lambda k: (k is not None, k)):
+            if key is None:
+                # Classes that are ancestors of others: chunk them
+                leftover = children[key]
+                for i in range(0, len(leftover), max_cluster_size):
+                    groups.append(leftover[i:i + max_cluster_size])
+            else:
+                split(children[key], depth + 1)
+
+    split(list(range(C)), 0)
+
+    clusters = []
+    for group in groups:
+        if clusters and len(clusters[-1]) + len(group) <= max_cluster_size:
+            clusters[-1].extend(group)
+        else:
+            clusters.append(list(group))
+    return clusters
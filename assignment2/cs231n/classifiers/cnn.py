@@ -70,7 +70,10 @@ class ThreeLayerConvNet(object):
         Input / output: Same API as TwoLayerNet in fc_net.py.
         """
         W1, b1 = self.params['W1'], self.params['b1']
-        W2, b2 = self.params['W2'], self.params['b2']
+        # After low-rank factorization W2 is replaced by W2_U.dot(W2_V)
+        low_rank = 'W2_U' in self.params
+        W2 = self.params['W2_V' if low_rank else 'W2']
+        b2 = self.params['b2']
         W3, b3 = self.params['W3'], self.params['b3']
 
         # pass conv_param to the forward pass for the convolutional layer
@@ -87,14 +90,15 @@ class ThreeLayerConvNet(object):
         # variable.                                                                #
         ############################################################################
         conv_out, conv_cache = conv_relu_pool_forward(X, W1, b1, conv_param, pool_param)
+        if low_rank:
+            conv_out, linear_cache = linear_forward(conv_out, self.params['W2_U'])
         affine1_out, affine1_cache = affine_relu_forward(conv_out, W2, b2)
-        affine2_out, affine2_cache = affine_forward(affine1_out, W3, b3)
-        scores = affine2_out
         ############################################################################
         #                             END OF YOUR CODE                             #
         ############################################################################
 
         if y is None:
+            scores, _ = affine_forward(affine1_out, W3, b3)
             return scores
 
         loss, grads = 0, {}
@@ -104,13 +108,15 @@ class ThreeLayerConvNet(object):
         # data loss using softmax, and make sure that grads[k] holds the gradients #
         # for self.params[k]. Don't forget to add L2 regularization!               #
         ############################################################################
-        loss, dx = softmax_loss(scores, y)
-        dx, dw_affine2, db_affine2 = affine_backward(dx, affine2_cache)
+        # The last affine layer is fused with the loss
+        loss, dx, dw_affine2, db_affine2 = affine_softmax_loss(affine1_out, W3, b3, y)
         dx, dw_affine1, db_affine1 = affine_relu_backward(dx, affine1_cache)
+        if low_rank:
+            dx, grads['W2_U'] = linear_backward(dx, linear_cache)
         dx, dw_conv, db_conv = conv_relu_pool_backward(dx, conv_cache)
         grads['W3'] = dw_affine2
         grads['b3'] = db_affine2
-        grads['W2'] = dw_affine1
+        grads['W2_V' if low_rank else 'W2'] = dw_affine1
         grads['b2'] = db_affine1
         grads['W1'] = dw_conv
         grads['b1'] = db_conv
@@ -94,14 +94,13 @@ class TwoLayerNet(object):
         # class scores for X and storing them in the scores variable.              #
         ############################################################################
         relu_1, relu_1_cache = affine_relu_forward(X, self.params['W1'], self.params['b1'])
-        fc_2, fc_2_cache = affine_forward(relu_1, self.params['W2'], self.params['b2'])
-        scores = fc_2
         ############################################################################
         #                             END OF YOUR CODE                             #
         ############################################################################
 
         # If y is None then we are in test mode so just return scores
         if y is None:
+            scores, _ = affine_forward(relu_1, self.params['W2'], self.params['b2'])
             return scores
 
         loss, grads = 0, {}
@@ -115,8 +114,9 @@ class TwoLayerNet(object):
         # automated tests, make sure that your L2 regularization includes a factor #
         # of 0.5 to simplify the expression for the gradient.                      #
         ############################################################################
-        loss, dscores = softmax_loss(scores, y)
-        drelu_1, grads['W2'], grads['b2'] = affine_backward(dscores, fc_2_cache)
+        # The last affine layer is fused with the loss
+        loss, drelu_1, grads['W2'], grads['b2'] = affine_softmax_loss(
+            relu_1, self.params['W2'], self.params['b2'], y)
         dx, grads['W1'], grads['b1'] = affine_relu_backward(drelu_1, relu_1_cache)
 
         # regularization
@@ -148,7 +148,9 @@ class FullyConnectedNet(object):
 
     def __init__(self, hidden_dims, input_dim=3*32*32, num_classes=10,
                  dropout=0, use_batchnorm=False, reg=0.0,
-                 weight_scale=1e-2, dtype=np.float32, seed=None):
+                 weight_scale=1e-2, dtype=np.float32, seed=None,
+                 hierarchy=None, hierarchy_beam=1, num_sampled=0,
+                 sampled_proposal=None):
         """
         Initialize a new FullyConnectedNet.
 
@@ -168,13 +170,31 @@ class FullyConnectedNet(object):
         - seed: If not None, then pass this random seed to the dropout layers. This
           will make the dropout layers deteriminstic so we can gradient check the
           model.
+        - hierarchy: If not None, a class hierarchy from
+          class_hierarchy.make_hierarchy; the final softmax is then replaced by
+          a two-level hierarchical softmax (see hierarchical_softmax_loss), with
+          cluster weights and biases W_cluster and b_cluster and the columns of
+          the last weights grouped by cluster.
+        - hierarchy_beam: Number of clusters searched per example at test time
+          with a hierarchy; the scores of classes of other clusters are -inf.
+        - num_sampled: If positive, train with a sampled softmax over the true
+          classes and num_sampled sampled classes (see
+          affine_sampled_softmax_loss); scores at test time use all classes.
+        - sampled_proposal: Array of shape (num_classes,) of probabilities to
+          sample classes from when num_sampled is positive; default is uniform.
         """
         self.use_batchnorm = use_batchnorm
         self.use_dropout = dropout > 0
         self.reg = reg
         self.num_layers = 1 + len(hidden_dims)
         self.dtype = dtype
+        self.hierarchy = hierarchy
+        self.hierarchy_beam = hierarchy_beam
+        self.num_sampled = num_sampled
+        self.sampled_proposal = sampled_proposal
         self.params = {}
+        if hierarchy is not None and num_sampled > 0:
+            raise ValueError('Use either a hierarchy or a sampled softmax')
 
         ############################################################################
         # TODO: Initialize the parameters of the network, storing all values in    #
@@ -197,6 +217,10 @@ class FullyConnectedNet(object):
             if self.use_batchnorm and l < self.num_layers - 1:
                 self.params['gamma' + str(l)] = np.ones((top_dim,))
                 self.params['beta' + str(l)] = np.zeros((top_dim,))
+        if hierarchy is not None:
+            num_clusters = len(hierarchy['offsets']) - 1
+            self.params['W_cluster'] = np.random.randn(layer_dims[-2], num_clusters) * weight_scale
+            self.params['b_cluster'] = np.zeros(num_clusters)
         ############################################################################
         #                             END OF YOUR CODE                             #
         ############################################################################
@@ -260,11 +284,25 @@ class FullyConnectedNet(object):
         ############################################################################
         blobs = [(-1, 'input', X, None)] # [(layer, type, activation, cache), ...]
         for b in range(self.num_layers):
-            weights = self.params['W' + str(b)]
+            if 'W%d_U' % b in self.params:
+                # Low-rank layer: x.dot(U) followed by an affine layer with
+                # weights V
+                blob, cache = linear_forward(blobs[-1][2], self.params['W%d_U' % b])
+                blobs.append((b, 'linear', blob, cache))
+                weights = self.params['W%d_V' % b]
+            else:
+                weights = self.params['W' + str(b)]
             biases = self.params['b' + str(b)]
             if b == self.num_layers - 1:
-                blob, cache = affine_forward(blobs[-1][2], weights, biases)
-                blobs.append((b, 'affine', blob, cache))
+                # In training the last affine layer is fused with the loss
+                if mode == 'test' and self.hierarchy is not None:
+                    blob = hierarchical_softmax_scores(
+                        blobs[-1][2], self.params['W_cluster'], self.params['b_cluster'],
+                        weights, biases, self.hierarchy, self.hierarchy_beam)
+                    blobs.append((b, 'hierarchical_softmax', blob, None))
+                elif mode == 'test':
+                    blob, cache = affine_forward(blobs[-1][2], weights, biases)
+                    blobs.append((b, 'affine', blob, cache))
             else:
                 if self.use_batchnorm:
                     gamma, beta = self.params['gamma' + str(b)], self.params['beta' + str(b)]
@@ -278,13 +316,13 @@ class FullyConnectedNet(object):
                     blob, cache = dropout_forward(blobs[-1][2], self.dropout_param)
                     blobs.append((b, 'dropout', blob, cache))
 
-        scores = blobs[-1][2]
         ############################################################################
         #                             END OF YOUR CODE                             #
         ############################################################################
 
         # If test mode return early
         if mode == 'test':
+            scores = blobs[-1][2]
             return scores
 
         loss, grads = 0.0, {}
@@ -301,23 +339,36 @@ class FullyConnectedNet(object):
         # automated tests, make sure that your L2 regularization includes a factor #
         # of 0.5 to simplify the expression for the gradient.                      #
         ############################################################################
-        loss, dblob = softmax_loss(scores, y)
+        last = self.num_layers - 1
+        w_key = 'W%d_V' % last if 'W%d_V' % last in self.params else 'W' + str(last)
+        if self.hierarchy is not None:
+            (loss, dblob, grads['W_cluster'], grads['b_cluster'], grads[w_key],
+             grads['b' + str(last)]) = hierarchical_softmax_loss(
+                blobs[-1][2], self.params['W_cluster'], self.params['b_cluster'],
+                weights, biases, y, self.hierarchy)
+        elif self.num_sampled > 0:
+            loss, dblob, grads[w_key], grads['b' + str(last)] = affine_sampled_softmax_loss(
+                blobs[-1][2], weights, biases, y, self.num_sampled, self.sampled_proposal)
+        else:
+            loss, dblob, grads[w_key], grads['b' + str(last)] = affine_softmax_loss(
+                blobs[-1][2], weights, biases, y)
         for b in range(len(blobs)-1, 0, -1):
             l, l_type, activation, cache = blobs[b]
-            if l_type == 'affine':
-                dblob, dW, db = affine_backward(dblob, cache)
-                grads['W' + str(l)] = dW
-                grads['b' + str(l)] = db
-            elif l_type == 'affine_bn_relu':
+            # The affine weights of a low-rank layer are its V factor
+            w_key = 'W%d_V' % l if 'W%d_V' % l in self.params else 'W' + str(l)
+            if l_type == 'affine_bn_relu':
                 dblob, dW, db, dgamma, dbeta = affine_bn_relu_backward(dblob, cache)
-                grads['W' + str(l)] = dW
+                grads[w_key] = dW
                 grads['b' + str(l)] = db
                 grads['gamma' + str(l)] = dgamma
                 grads['beta' + str(l)] = dbeta
             elif l_type == 'affine_relu':
                 dblob, dW, db = affine_relu_backward(dblob, cache)
-                grads['W' + str(l)] = dW
+                grads[w_key] = dW
                 grads['b' + str(l)] = db
+            elif l_type == 'linear':
+                dblob, dU = linear_backward(dblob, cache)
+                grads['W%d_U' % l] = dU
             elif l_type == 'dropout':
                 dblob = dropout_backward(dblob, cache)
 
@@ -0,0 +1,336 @@
+from builtins import range
+from builtins import object
+import numpy as np
+
+from cs231n.layers import *
+from cs231n.classifiers.fc_net import FullyConnectedNet
+
+"""
+K replicas of a FullyConnectedNet trained together on the same minibatches.
+
+The weights of layer l of all replicas are stored as one array W<l> of shape
+(K, D_in, D_out), and the biases as b<l> of shape (K, D_out). Activations
+have shape (K, N, D), and every affine layer is a single batched matrix
+product (np.matmul) over the K replicas, so one forward / backward pass
+trains all of them with one Python-level pass through the network instead
+of K.
+
+The replicas share nothing but the minibatches: the loss returned by loss()
+is the sum of the losses of the replicas, so the gradient of every replica
+is exactly its own. A Solver therefore trains the K replicas as it would
+train K separate nets; array-valued entries of its optim_config (for
+example one learning rate per replica) are broadcast along the first axis
+of the parameters, and reg and weight_scale may also be given per replica.
+Unlike FullyConnectedNet.loss, which ignores its reg, the loss includes the
+L2 penalty 0.5 * reg * ||W||^2 of every replica, so only replicas with
+reg = 0 train exactly like standalone FullyConnectedNets.
+
+Example usage:
+
+model = StackedFullyConnectedNet([100, 100], num_models=4,
+                                 reg=[0.0, 1e-3, 1e-2, 1e-1])
+solver = Solver(model, data, update_rule='adam',
+                optim_config={'learning_rate': [1e-3, 1e-3, 5e-4, 5e-4]})
+solver.train()
+print(model.check_accuracies(data['X_val'], data['y_val']))
+best = model.replica(np.argmax(model.check_accuracies(data['X_val'],
+                                                      data['y_val'])))
+"""
+
+
+def _per_model(value, num_models, name):
+    """ Return a scalar or a sequence of num_models values as a (K,) array. """
+    value = np.asarray(value, dtype=np.float64)
+    if value.ndim == 0:
+        return np.full(num_models, float(value))
+    if value.shape != (num_models,):
+        raise ValueError('%s must be a scalar or have one value per model' %
+                         name)
+    return value
+
+
+def stacked_affine_forward(x, w, b):
+    """
+    Computes the forward pass for K affine layers at once.
+
+    Inputs:
+    - x: Input of shape (K, N, D), or (N, D) if it is shared by all layers
+    - w: Weights, of shape (K, D, M)
+    - b: Biases, of shape (K, M)
+
+    Returns a tuple of:
+    - out: Output, of shape (K, N, M)
+    - cache: (x, w)
+    """
+    out = np.matmul(x, w) + b[:, np.newaxis, :]
+    return out, (x, w)
+
+
+def stacked_affine_backward(dout, cache):
+    """
+    Computes the backward pass for K affine layers at once.
+
+    Inputs:
+    - dout: Upstream derivative, of shape (K, N, M)
+    - cache: Tuple from stacked_affine_forward
+
+    Returns a tuple of:
+    - dx: Gradient with respect to x, of shape (K, N, D); None if x was
+      shared by all layers
+    - dw: Gradient with respect to w, of shape (K, D, M)
+    - db: Gradient with respect to b, of shape (K, M)
+    """
+    x, w = cache
+    dx = None
+    if x.ndim == 3:
+        dx = np.matmul(dout, w.transpose(0, 2, 1))
+        dw = np.matmul(x.transpose(0, 2, 1), dout)
+    else:
+        dw = np.matmul(x.T, dout)
+    db = np.sum(dout, axis=1)
+    return dx, dw, db
+
+
+def stacked_batchnorm_forward(x, gamma, beta, bn_param):
+    """
+    Batch normalization of K independent layers at once: the statistics of
+    x[k] are computed separately for every k. The running averages in
+    bn_param have shape (K * D,).
+
+    Inputs:
+    - x: Data of shape (K, N, D)
+    - gamma, beta: Scale and shift parameters of shape (K, D)
+    - bn_param: As for batchnorm_forward
+
+    Returns a tuple of:
+    - out: Output of shape (K, N, D)
+    - cache: Values needed by stacked_batchnorm_backward
+    """
+    K, N, D = x.shape
+    out, cache = batchnorm_forward(x.transpose(1, 0, 2).reshape(N, K * D),
+                                   gamma.reshape(-1), beta.reshape(-1),
+                                   bn_param)
+    return out.reshape(N, K, D).transpose(1, 0, 2), cache
+
+
+def stacked_batchnorm_backward(dout, cache):
+    """
+    Backward pass of stacked_batchnorm_forward.
+
+    Returns a tuple of:
+    - dx: Gradient with respect to x, of shape (K, N, D)
+    - dgamma, dbeta: Gradients with respect to gamma and beta, of shape (K, D)
+    """
+    K, N, D = dout.shape
+    dx, dgamma, dbeta = batchnorm_backward_alt(
+        dout.transpose(1, 0, 2).reshape(N, K * D), cache)
+    return (dx.reshape(N, K, D).transpose(1, 0, 2), dgamma.reshape(K, D),
+            dbeta.reshape(K, D))
+
+
+class StackedFullyConnectedNet(object):
+    """
+    num_models replicas of a FullyConnectedNet with the architecture
+
+    {affine - [batch norm] - relu - [dropout]} x (L - 1) - affine - softmax
+
+    stored and trained together; see the module docstring. Replica k has
+    weights W<l>[k] and biases b<l>[k].
+    """
+
+    def __init__(self, hidden_dims, num_models, input_dim=3*32*32,
+                 num_classes=10, dropout=0, use_batchnorm=False, reg=0.0,
+                 weight_scale=1e-2, dtype=np.float32, seed=None):
+        """
+        Initialize a new StackedFullyConnectedNet.
+
+        Inputs:
+        - hidden_dims: A list of integers giving the size of each hidden layer.
+        - num_models: Number of replicas K.
+        - input_dim: An integer giving the size of the input.
+        - num_classes: An integer giving the number of classes to classify.
+        - dropout: Scalar between 0 and 1 giving dropout strength, shared by
+          all replicas.
+        - use_batchnorm: Whether or not the replicas use batch normalization.
+        - reg: L2 regularization strength; a scalar or one value per replica.
+        - weight_scale: Standard deviation for random initialization of the
+          weights; a scalar or one value per replica.
+        - dtype: A numpy datatype object; all computations will be performed
+          using this datatype.
+        - seed: If not None, then pass this random seed to the dropout layers.
+        """
+        self.num_models = num_models
+        self.use_batchnorm = use_batchnorm
+        self.use_dropout = dropout > 0
+        self.reg = _per_model(reg, num_models, 'reg')
+        self.num_layers = 1 + len(hidden_dims)
+        self.dtype = dtype
+        self.params = {}
+
+        weight_scale = _per_model(weight_scale, num_models, 'weight_scale')
+        layer_dims = [input_dim] + hidden_dims + [num_classes]
+        for l in range(self.num_layers):
+            bottom_dim, top_dim = layer_dims[l], layer_dims[l + 1]
+            self.params['W%d' % l] = np.random.randn(num_models, bottom_dim, top_dim) * \
+                weight_scale[:, np.newaxis, np.newaxis]
+            self.params['b%d' % l] = np.zeros((num_models, top_dim))
+            if self.use_batchnorm and l < self.num_layers - 1:
+                self.params['gamma%d' % l] = np.ones((num_models, top_dim))
+                self.params['beta%d' % l] = np.zeros((num_models, top_dim))
+
+        self.dropout_param = {}
+        if self.use_dropout:
+            self.dropout_param = {'mode': 'train', 'p': dropout}
+            if seed is not None:
+                self.dropout_param['seed'] = seed
+
+        # The running averages of layer l of all replicas are stored together
+        # in self.bn_params[l], as arrays of shape (K * D,)
+        self.bn_params = []
+        if self.use_batchnorm:
+            self.bn_params = [{'mode': 'train'} for i in range(self.num_layers - 1)]
+
+        for k, v in self.params.items():
+            self.params[k] = v.astype(dtype)
+
+
+    def _forward(self, X, mode):
+        """ Compute the (K, N, C) scores of all replicas and the caches. """
+        X = X.astype(self.dtype).reshape(X.shape[0], -1)
+        if self.use_dropout:
+            self.dropout_param['mode'] = mode
+        if self.use_batchnorm:
+            for bn_param in self.bn_params:
+                bn_param['mode'] = mode
+
+        caches = []  # [(layer, type, cache), ...]
+        h = X
+        for l in range(self.num_layers):
+            h, cache = stacked_affine_forward(h, self.params['W%d' % l],
+                                              self.params['b%d' % l])
+            caches.append((l, 'affine', cache))
+            if l == self.num_layers - 1:
+                break
+            if self.use_batchnorm:
+                h, cache = stacked_batchnorm_forward(
+                    h, self.params['gamma%d' % l], self.params['beta%d' % l],
+                    self.bn_params[l])
+                caches.append((l, 'batchnorm', cache))
+            h, cache = relu_forward(h)
+            caches.append((l, 'relu', cache))
+            if self.use_dropout:
+                h, cache = dropout_forward(h, self.dropout_param)
+                caches.append((l, 'dropout', cache))
+        return h, caches
+
+
+    def model_scores(self, X):
+        """
+        Compute the test-time class scores of every replica.
+
+        Inputs:
+        - X: Array of input data of shape (N, d_1, ..., d_k)
+
+        Returns:
+        - scores: Array of shape (K, N, C)
+        """
+        return self._forward(X, 'test')[0]
+
+
+    def loss(self, X, y=None):
+        """
+        Compute loss and gradient for all replicas.
+
+        Inputs:
+        - X: Array of input data of shape (N, d_1, ..., d_k)
+        - y: Array of labels, of shape (N,). y[i] gives the label for X[i].
+
+        Returns:
+        If y is None, then run a test-time forward pass and return:
+        - scores: Array of shape (N, C) giving the class probabilities of the
+          ensemble of the replicas, the mean of their softmax probabilities.
+
+        If y is not None, then run a training-time forward and backward pass
+        and return a tuple of:
+        - loss: Sum of the losses of the replicas; the individual losses are
+          kept in self.model_losses.
+        - grads: Dictionary with the same keys as self.params, mapping
+          parameter names to gradients of the loss with respect to those
+          parameters.
+        """
+        mode = 'test' if y is None else 'train'
+        scores, caches = self._forward(X, mode)
+        scores -= np.max(scores, axis=2, keepdims=True)
+        exp_scores = np.exp(scores)
+        sums = np.sum(exp_scores, axis=2, keepdims=True)
+        if mode == 'test':
+            return np.mean(exp_scores / sums, axis=0)
+
+        N = scores.shape[1]
+        rows = np.arange(N)
+        losses = (np.sum(np.log(sums[:, :, 0]), axis=1) -
+                  np.sum(scores[:, rows, y], axis=1)) / N
+        dout = exp_scores / sums
+        dout[:, rows, y] -= 1
+        dout /= N
+
+        grads = {}
+        for l, l_type, cache in reversed(caches):
+            if l_type == 'affine':
+                dout, grads['W%d' % l], grads['b%d' % l] = \
+                    stacked_affine_backward(dout, cache)
+            elif l_type == 'batchnorm':
+                dout, grads['gamma%d' % l], grads['beta%d' % l] = \
+                    stacked_batchnorm_backward(dout, cache)
+            elif l_type == 'relu':
+                dout = relu_backward(dout, cache)
+            elif l_type == 'dropout':
+                dout = dropout_backward(dout, cache)
+
+        # Regularization, with one strength per replica
+        reg = self.reg.astype(self.dtype)[:, np.newaxis, np.newaxis]
+        for l in range(self.num_layers):
+            W = self.params['W%d' % l]
+            losses += 0.5 * self.reg * np.sum(W ** 2, axis=(1, 2))
+            grads['W%d' % l] += reg * W
+        self.model_losses = losses
+        return np.sum(losses), grads
+
+
+    def check_accuracies(self, X, y, batch_size=100):
+        """
+        Compute the accuracy of every replica on X, in batches of batch_size.
+
+        Returns:
+        - accs: Array of shape (K,) of accuracies.
+        """
+        correct = np.zeros(self.num_models)
+        for i in range(0, X.shape[0], batch_size):
+            scores = self.model_scores(X[i:i + batch_size])
+            correct += np.sum(np.argmax(scores, axis=2) == y[i:i + batch_size],
+                              axis=1)
+        return correct / X.shape[0]
+
+
+    def replica(self, k):
+        """
+        Return replica k as a standalone FullyConnectedNet, with copies of its
+        parameters and batchnorm running averages. It predicts exactly like
+        the replica, but FullyConnectedNet.loss applies no regularization, so
+        if the replica has reg != 0, training the returned net further
+        continues without the replica's L2 penalty.
+        """
+        dims = [self.params['W%d' % l].shape[1] for l in range(self.num_layers)]
+        model = FullyConnectedNet(dims[1:], input_dim=dims[0],
+                                  num_classes=self.params['W%d' % (self.num_layers - 1)].shape[2],
+                                  dropout=self.dropout_param.get('p', 0),
+                                  use_batchnorm=self.use_batchnorm,
+                                  reg=float(self.reg[k]), dtype=self.dtype)
+        for name, v in self.params.items():
+            model.params[name] = v[k].copy()
+        for bn_param, model_bn_param in zip(self.bn_params, model.bn_params):
+            for key, v in bn_param.items():
+                if key in ('running_mean', 'running_var'):
+                    v = v.reshape(self.num_models, -1)[k].copy()
+                model_bn_param[key] = v
+        return model
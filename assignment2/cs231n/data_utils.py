@@ -2,8 +2,12 @@ from __future__ import print_function
 
 from builtins import range
 from six.moves import cPickle as pickle
+import importlib
+import json
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import os
+import shutil
 from scipy.misc import imread
 import platform
 
@@ -97,6 +101,7 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
     Returns: A dictionary with the following entries:
     - class_names: A list where class_names[i] is a list of strings giving the
       WordNet names for class i in the loaded dataset.
+    - wnids: A list where wnids[i] is the WordNet id of class i.
     - X_train: (N_tr, 3, 64, 64) array of training images
     - y_train: (N_tr,) array of training labels
     - X_val: (N_val, 3, 64, 64) array of validation images
@@ -200,6 +205,7 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
 
     return {
       'class_names': class_names,
+      'wnids': wnids,
       'X_train': X_train,
       'y_train': y_train,
       'X_val': X_val,
@@ -211,27 +217,225 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
     }
 
 
-def load_models(models_dir):
+MODEL_FORMAT_VERSION = 1
+
+
+def _encode_attribute(value, arrays, key):
+    """
+    Convert an attribute of a model into a JSON-serializable value, moving
+    the numpy arrays it contains into the dictionary arrays under names
+    derived from key.
+    """
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise ValueError('Cannot save object array %s' % key)
+        arrays[key] = value
+        return {'__array__': key}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.dtype) or (isinstance(value, type) and
+                                       issubclass(value, np.generic)):
+        return {'__dtype__': np.dtype(value).name}
+    if isinstance(value, dict):
+        return dict((k, _encode_attribute(v, arrays, '%s/%s' % (key, k)))
+                    for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_encode_attribute(v, arrays, '%s/%d' % (key, i))
+                for i, v in enumerate(value)]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise ValueError('Cannot save attribute %s of type %s' % (
+                     key, type(value).__name__))
+
+
+def _decode_attribute(value, arrays):
+    """ Inverse of _encode_attribute. """
+    if isinstance(value, dict):
+        if '__array__' in value:
+            return arrays[value['__array__']]
+        if '__dtype__' in value:
+            return np.dtype(value['__dtype__']).type
+        return dict((k, _decode_attribute(v, arrays))
+                    for k, v in value.items())
+    if isinstance(value, list):
+        return [_decode_attribute(v, arrays) for v in value]
+    return value
+
+
+def save_model(model, path):
+    """
+    Save a model in a memory-mappable format. The model is stored as a
+    directory holding
+
+    - model.json: the format version, the class of the model and all of its
+      attributes, with every numpy array replaced by a reference to a blob;
+    - weights.bin: the arrays as raw little-endian C-ordered blobs, each
+      starting at a multiple of 64 bytes.
+
+    This works for any model whose attributes are numpy arrays, numbers,
+    strings, None, numpy dtypes and lists and dictionaries of these, which
+    includes all the classifiers in cs231n.classifiers. The directory is
+    written as <path>.tmp and then renamed into place; a model it replaces
+    is first renamed to <path>.old and only deleted afterwards, so that
+    after a crash at any point load_model finds a complete model.
+
+    Inputs:
+    - model: The model to save.
+    - path: String giving the path of the model directory.
+    """
+    arrays = {}
+    attributes = dict((k, _encode_attribute(v, arrays, k))
+                      for k, v in vars(model).items())
+    tmp_path = path.rstrip(os.sep) + '.tmp'
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    blobs = {}
+    offset = 0
+    with open(os.path.join(tmp_path, 'weights.bin'), 'wb') as f:
+        for key in sorted(arrays):
+            a = arrays[key]
+            a = np.ascontiguousarray(a, dtype=a.dtype.newbyteorder('<'))
+            padding = -offset % 64
+            f.write(b'\0' * padding)
+            offset += padding
+            blobs[key] = {'dtype': a.dtype.str, 'shape': list(a.shape),
+                          'offset': offset}
+            f.write(a.tobytes())
+            offset += a.nbytes
+
+    cls = type(model)
+    meta = {
+        'format_version': MODEL_FORMAT_VERSION,
+        'class': '%s.%s' % (cls.__module__, cls.__name__),
+        'attributes': attributes,
+        'arrays': blobs,
+    }
+    with open(os.path.join(tmp_path, 'model.json'), 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+
+    old_path = path.rstrip(os.sep) + '.old'
+    if os.path.isdir(path):
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    if os.path.isdir(old_path):
+        shutil.rmtree(old_path)
+
+
+def load_model(path, mmap_mode='r'):
+    """
+    Load a model saved by save_model. Only model.json is parsed; the arrays
+    are views of a memory map of weights.bin, so loading takes the same time
+    for any model size, weights are only read from disk when they are first
+    used, and all processes that load the same model share one physical copy
+    of its weights through the page cache.
+
+    Inputs:
+    - path: String giving the path of the model directory.
+    - mmap_mode: 'r' (the default) maps the weights read-only; 'c' maps them
+      copy-on-write, so they can be modified in memory; None reads them into
+      memory.
+
+    Returns:
+    - model: An instance of the saved class, with the saved attributes. Its
+      __init__ is not called.
+    """
+    old_path = path.rstrip(os.sep) + '.old'
+    if not os.path.isdir(path) and os.path.isdir(old_path):
+        # save_model was interrupted while replacing the model
+        path = old_path
+    with open(os.path.join(path, 'model.json'), 'r') as f:
+        meta = json.load(f)
+    if meta['format_version'] > MODEL_FORMAT_VERSION:
+        raise ValueError('Model "%s" has unsupported format version %d' % (
+                         path, meta['format_version']))
+    module_name, class_name = meta['class'].rsplit('.', 1)
+    if module_name.split('.')[0] != 'cs231n':
+        raise ValueError('Model "%s" has class %s outside of cs231n' % (
+                         path, meta['class']))
+    cls = getattr(importlib.import_module(module_name), class_name)
+
+    weights_file = os.path.join(path, 'weights.bin')
+    if os.path.getsize(weights_file) == 0:
+        buf = np.zeros(0, dtype=np.uint8)
+    elif mmap_mode is None:
+        buf = np.fromfile(weights_file, dtype=np.uint8)
+    else:
+        buf = np.memmap(weights_file, dtype=np.uint8, mode=mmap_mode)
+    arrays = {}
+    for key, blob in meta['arrays'].items():
+        dtype = np.dtype(blob['dtype'])
+        shape = tuple(blob['shape'])
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        offset = blob['offset']
+        arrays[key] = buf[offset:offset + nbytes].view(dtype).reshape(shape)
+
+    model = cls.__new__(cls)
+    model.__dict__.update(_decode_attribute(meta['attributes'], arrays))
+    return model
+
+
+def _load_model_file(filename, mmap_mode):
+    """ Load a model directory or pickled model file; None on failure. """
+    if not os.path.exists(filename) and os.path.isdir(filename + '.old'):
+        return load_model(filename, mmap_mode=mmap_mode)
+    if os.path.isdir(filename):
+        if not os.path.isfile(os.path.join(filename, 'model.json')):
+            return None
+        return load_model(filename, mmap_mode=mmap_mode)
+    with open(filename, 'rb') as f:
+        try:
+            return load_pickle(f)['model']
+        except (pickle.UnpicklingError, EOFError, KeyError, TypeError,
+                ValueError):
+            return None
+
+
+def load_models(models_dir, mmap_mode='r', num_workers=None):
     """
-    Load saved models from disk. This will attempt to unpickle all files in a
-    directory; any files that give errors on unpickling (such as README.txt)
-    will be skipped.
+    Load saved models from disk. Every directory written by save_model is
+    loaded with load_model, which memory-maps the weights instead of reading
+    them; for backwards compatibility, every other file is unpickled as a
+    dictionary with a 'model' field. Files that can be neither (such as
+    README.txt) are skipped, and so are the <name>.tmp and <name>.old
+    directories of save_model, except that <name>.old is loaded as <name>
+    when save_model was interrupted before <name> was renamed into place.
+    Models are loaded in parallel by a pool of threads.
 
     Inputs:
-    - models_dir: String giving the path to a directory containing model files.
-      Each model file is a pickled dictionary with a 'model' field.
+    - models_dir: String giving the path to a directory containing model
+      directories or files.
+    - mmap_mode: Passed to load_model.
+    - num_workers: Number of loader threads; defaults to one per model, up
+      to 8.
 
     Returns:
     A dictionary mapping model file names to models.
     """
-    models = {}
-    for model_file in os.listdir(models_dir):
-        with open(os.path.join(models_dir, model_file), 'rb') as f:
-            try:
-                models[model_file] = load_pickle(f)['model']
-            except pickle.UnpicklingError:
-                continue
-    return models
+    entries = set(os.listdir(models_dir))
+    names = set(name for name in entries
+                if not name.endswith(('.tmp', '.old')))
+    names.update(name[:-len('.old')] for name in entries
+                 if name.endswith('.old') and
+                 os.path.isdir(os.path.join(models_dir, name)))
+    names = sorted(names)
+    if not names:
+        return {}
+    if num_workers is None:
+        num_workers = min(8, len(names))
+    load = lambda name: _load_model_file(os.path.join(models_dir, name),
+                                         mmap_mode)
+    pool = ThreadPool(num_workers)
+    try:
+        loaded = pool.map(load, names)
+    finally:
+        pool.close()
+        pool.join()
+    return dict((name, model) for name, model in zip(names, loaded)
+                if model is not None)
 
 
 def load_imagenet_val(num=None):
@@ -0,0 +1,180 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import copy
+import threading
+import tracemalloc
+
+import numpy as np
+from six.moves import queue
+
+
+class Evaluator(object):
+    """
+    An Evaluator measures the classification accuracy of a model on a fixed
+    set of examples as fast as possible.
+
+    If only a subsample of the data should be used, the subsample is drawn
+    once (without replacement) when the Evaluator is built and copied into a
+    contiguous array, so every later call evaluates exactly the same examples
+    and no per-call gathering is needed. Inference runs in batches that are as
+    large as a memory budget allows and writes its argmax predictions into a
+    preallocated array.
+
+    Example usage:
+
+    evaluator = Evaluator(model, data['X_val'], data['y_val'])
+    val_acc = evaluator.accuracy()
+    """
+
+    def __init__(self, model, X, y, num_samples=None, batch_size=None,
+                 memory_budget=256 * 2**20, indices=None):
+        """
+        Construct a new Evaluator.
+
+        Inputs:
+        - model: A model object conforming to the Solver API.
+        - X: Array of data, of shape (N, d_1, ..., d_k)
+        - y: Array of labels, of shape (N,)
+        - num_samples: If not None, evaluate a fixed random subset of
+          num_samples datapoints instead of all of them.
+        - batch_size: Number of examples per forward pass. If None, use the
+          largest batch whose forward pass fits in memory_budget bytes.
+        - memory_budget: Memory budget in bytes used to pick batch_size.
+        - indices: If not None, evaluate exactly these examples instead of
+          drawing a subsample; used to restore an Evaluator from a checkpoint.
+        """
+        N = X.shape[0]
+        if indices is None and num_samples is not None and N > num_samples:
+            indices = np.sort(np.random.choice(N, num_samples, replace=False))
+        if indices is not None:
+            X = X[indices]
+            y = y[indices]
+        self.indices = indices
+        self.model = model
+        self.X = X
+        self.y = np.asarray(y)
+        self.y_pred = np.empty(self.X.shape[0], dtype=np.intp)
+        if batch_size is None:
+            batch_size = self._budget_batch_size(memory_budget)
+        self.batch_size = max(int(batch_size), 1)
+
+
+    def _budget_batch_size(self, memory_budget, probe_size=16):
+        """
+        Estimate the memory used per example by a test-time forward pass on a
+        small probe batch, and return the batch size that fits the budget.
+        """
+        N = self.X.shape[0]
+        probe = self.X[:min(probe_size, N)]
+        peak = 0
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            try:
+                self.model.loss(probe)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        # Older numpy versions do not report allocations to tracemalloc; fall
+        # back to a conservative multiple of the input size
+        per_example = max(peak / max(probe.shape[0], 1),
+                          16 * probe[:1].nbytes)
+        return min(N, int(memory_budget // per_example))
+
+
+    def predict(self, model=None):
+        """
+        Compute the predicted label of every example.
+
+        Inputs:
+        - model: Model to evaluate; defaults to the Evaluator's model. Passing
+          a snapshot of the model lets the Evaluator run in another thread.
+
+        Returns:
+        - y_pred: The Evaluator's preallocated array of shape (N,) holding the
+          predictions. It is overwritten by the next call.
+        """
+        if model is None:
+            model = self.model
+        N = self.X.shape[0]
+        for start in range(0, N, self.batch_size):
+            end = min(start + self.batch_size, N)
+            scores = model.loss(self.X[start:end])
+            np.argmax(scores, axis=1, out=self.y_pred[start:end])
+        return self.y_pred
+
+
+    def accuracy(self, model=None):
+        """
+        Return the fraction of examples that are classified correctly.
+        """
+        return np.mean(self.predict(model) == self.y)
+
+
+def snapshot_model(model):
+    """
+    Copy a model, including its parameters and its batchnorm and dropout
+    state, so that it can be evaluated in another thread while the original
+    keeps training.
+    """
+    return copy.deepcopy(model)
+
+
+class BackgroundEvaluator(object):
+    """
+    Run Evaluators in a background thread on snapshots of a model so that the
+    training loop does not wait for them.
+
+    Each call to submit() snapshots the model and queues a job that computes
+    the accuracy of the snapshot with each evaluator; when the job finishes,
+    callback(tag, snapshot, accuracies) is called from the background thread,
+    where tag is the value passed to submit(). Jobs run one at a time, in the
+    order they were submitted.
+    """
+
+    def __init__(self, evaluators, callback):
+        self.evaluators = evaluators
+        self.callback = callback
+        self.error = None
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                if self.error is None:
+                    tag, snapshot = job
+                    accs = [e.accuracy(snapshot) for e in self.evaluators]
+                    self.callback(tag, snapshot, accs)
+            except Exception as e:
+                self.error = e
+            finally:
+                self._jobs.task_done()
+
+
+    def submit(self, model, tag=None):
+        """ Snapshot model and queue it for evaluation. """
+        if self.error is not None:
+            raise self.error
+        self._jobs.put((tag, snapshot_model(model)))
+
+
+    def wait(self):
+        """ Block until all submitted jobs have finished. """
+        self._jobs.join()
+        if self.error is not None:
+            raise self.error
+
+
+    def close(self):
+        """ Finish all submitted jobs and stop the background thread. """
+        self._jobs.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
@@ -1,10 +1,12 @@
-from __future__ import print_function
+from __future__ import print_function, division
 from builtins import range
 from past.builtins import xrange
 
 import numpy as np
 from random import randrange
 
+from cs231n import resources
+
 def eval_numerical_gradient(f, x, verbose=True, h=0.00001):
     """
     a naive implementation of numerical gradient of f at x
@@ -127,3 +129,217 @@ def grad_check_sparse(f, x, analytic_grad, num_checks=10, h=1e-5):
                     (abs(grad_numerical) + abs(grad_analytic)))
         print('numerical: %f analytic: %f, relative error: %e'
               %(grad_numerical, grad_analytic, rel_error))
+
+
+# State inherited by forked gradient checking workers
+_check_f = None
+_check_x = None
+_check_df = None
+_check_h = None
+
+
+def _numerical_partials(f, x, indices, df=None, h=1e-5):
+    """
+    Compute the centered difference partial derivatives of f with respect to
+    the elements of x at the given flat indices, perturbing x in place.
+
+    If df is None, f must return a scalar; otherwise f returns an array and
+    the partials of np.sum(f(x) * df) are computed, as in
+    eval_numerical_gradient_array.
+    """
+    partials = np.zeros(len(indices))
+    for k, i in enumerate(indices):
+        ix = np.unravel_index(i, x.shape)
+        oldval = x[ix]
+        x[ix] = oldval + h
+        pos = f(x)
+        if df is not None:
+            pos = np.sum(pos * df)
+        x[ix] = oldval - h
+        neg = f(x)
+        if df is not None:
+            neg = np.sum(neg * df)
+        x[ix] = oldval
+        partials[k] = (pos - neg) / (2 * h)
+    return partials
+
+
+def _partials_worker(indices):
+    return _numerical_partials(_check_f, _check_x, indices, _check_df,
+                               _check_h)
+
+
+def _parallel_partials(f, x, indices, df=None, h=1e-5, num_workers=None):
+    """
+    Compute _numerical_partials for the given flat indices with a pool of
+    num_workers forked processes that share the available cores (see
+    resources.worker_pool); each worker perturbs its own copy of x, so f may
+    read x (or the model parameter x is) through a closure.
+    """
+    global _check_f, _check_x, _check_df, _check_h
+    indices = np.asarray(indices, dtype=np.intp)
+    if num_workers is None:
+        num_workers = len(resources.available_cores())
+    num_workers = min(num_workers, len(indices))
+    if num_workers <= 1:
+        return _numerical_partials(f, x, indices, df, h)
+
+    # A few chunks per worker even out the load
+    chunks = np.array_split(indices, 4 * num_workers)
+    _check_f, _check_x, _check_df, _check_h = f, x, df, h
+    try:
+        pool = resources.worker_pool(num_workers)
+        try:
+            partials = pool.map(_partials_worker, chunks)
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        _check_f = _check_x = _check_df = _check_h = None
+    return np.concatenate(partials)
+
+
+def eval_numerical_gradient_parallel(f, x, df=None, h=1e-5, num_workers=None):
+    """
+    Compute the full numerical gradient of f at x like
+    eval_numerical_gradient (if df is None) or eval_numerical_gradient_array
+    (if df is given), spreading the perturbed elements over a pool of forked
+    processes.
+
+    Inputs:
+    - f: Function taking x and returning a scalar, or an array if df is given.
+      It is called in the worker processes, so it may be a closure over a
+      model whose parameter x is perturbed in place.
+    - x: Numpy array to evaluate the gradient at.
+    - df: Upstream derivative of the output of f, or None.
+    - h: Step size.
+    - num_workers: Number of processes; defaults to the number of available
+      cores.
+
+    Returns:
+    - grad: Numerical gradient, of the same shape as x.
+    """
+    partials = _parallel_partials(f, x, np.arange(x.size), df, h, num_workers)
+    return partials.reshape(x.shape).astype(x.dtype)
+
+
+def grad_check_directional(f, x, analytic_grad, df=None, num_directions=5,
+                           h=1e-5, seed=None, verbose=True):
+    """
+    Check a whole gradient with a few forward passes by comparing numerical
+    and analytic directional derivatives along random unit directions v:
+    (f(x + h v) - f(x - h v)) / 2h against sum(analytic_grad * v).
+
+    Inputs:
+    - f, x, df, h: As for eval_numerical_gradient_parallel.
+    - analytic_grad: Analytic gradient of f at x.
+    - num_directions: Number of random directions; each costs two calls to f.
+    - seed: Seed for the random directions.
+    - verbose: If true, print the derivatives and the relative error of every
+      direction.
+
+    Returns:
+    - rel_errors: Array of shape (num_directions,) with the relative error of
+      every direction.
+    """
+    def f_scalar(x):
+        out = f(x)
+        return out if df is None else np.sum(out * df)
+
+    rng = np.random.RandomState(seed)
+    x0 = x.copy()
+    rel_errors = np.zeros(num_directions)
+    for i in range(num_directions):
+        v = rng.randn(*x.shape)
+        v /= np.linalg.norm(v)
+        x[...] = x0 + h * v
+        pos = f_scalar(x)
+        x[...] = x0 - h * v
+        neg = f_scalar(x)
+        x[...] = x0
+
+        numerical = (pos - neg) / (2 * h)
+        analytic = np.sum(analytic_grad * v)
+        rel_errors[i] = abs(numerical - analytic) / max(
+            abs(numerical) + abs(analytic), 1e-8)
+        if verbose:
+            print('numerical: %f analytic: %f, relative error: %e'
+                  % (numerical, analytic, rel_errors[i]))
+    return rel_errors
+
+
+def grad_check_directional_model(model, X, y, num_directions=5, h=1e-5,
+                                 seed=None, verbose=True):
+    """
+    Check every gradient of a model at once with grad_check_directional,
+    perturbing all parameters along random directions of their concatenation.
+
+    Inputs:
+    - model: A model conforming to the Solver API, ideally using float64.
+    - X, y: A minibatch of data and labels.
+    - num_directions, h, seed, verbose: As for grad_check_directional.
+
+    Returns:
+    - rel_errors: Array of shape (num_directions,).
+    """
+    _, grads = model.loss(X, y)
+    names = sorted(model.params)
+    sizes = [model.params[p].size for p in names]
+    offsets = np.cumsum([0] + sizes)
+    analytic = np.concatenate([grads[p].ravel() for p in names])
+    theta = np.concatenate([model.params[p].ravel() for p in names]).astype(
+        np.float64)
+
+    def f(theta):
+        for p, start, end in zip(names, offsets[:-1], offsets[1:]):
+            model.params[p][...] = theta[start:end].reshape(
+                model.params[p].shape)
+        return model.loss(X, y)[0]
+
+    try:
+        return grad_check_directional(f, theta, analytic,
+                                      num_directions=num_directions, h=h,
+                                      seed=seed, verbose=verbose)
+    finally:
+        f(theta)
+
+
+def grad_check_sparse_model(model, X, y, num_checks=5, h=1e-5, seed=None,
+                            num_workers=None, verbose=True):
+    """
+    A stratified version of grad_check_sparse for models: sample num_checks
+    random elements from every parameter tensor, so that small tensors such
+    as biases and batchnorm parameters are always checked, and compare their
+    numerical and analytic gradients. The samples are spread over a pool of
+    forked processes.
+
+    Inputs:
+    - model: A model conforming to the Solver API, ideally using float64.
+    - X, y: A minibatch of data and labels.
+    - num_checks: Number of elements checked per parameter (or all of them,
+      for parameters with fewer elements).
+    - h: Step size.
+    - seed: Seed used to pick the elements.
+    - num_workers: Number of processes; defaults to the number of available
+      cores.
+    - verbose: If true, print the largest relative error of every parameter.
+
+    Returns:
+    - rel_errors: Dictionary mapping parameter names to arrays with the
+      relative error of every checked element.
+    """
+    _, grads = model.loss(X, y)
+    f = lambda _: model.loss(X, y)[0]
+    rng = np.random.RandomState(seed)
+    rel_errors = {}
+    for p in sorted(model.params):
+        x = model.params[p]
+        indices = rng.choice(x.size, min(num_checks, x.size), replace=False)
+        numerical = _parallel_partials(f, x, indices, h=h,
+                                       num_workers=num_workers)
+        analytic = grads[p].ravel()[indices]
+        rel_errors[p] = np.abs(numerical - analytic) / np.maximum(
+            np.abs(numerical) + np.abs(analytic), 1e-8)
+        if verbose:
+            print('%s max relative error: %e' % (p, np.max(rel_errors[p])))
+    return rel_errors
@@ -0,0 +1,144 @@
+from __future__ import print_function, division
+from builtins import range
+import ctypes
+import multiprocessing
+
+import numpy as np
+from six.moves import queue
+
+from cs231n import resources
+
+"""
+Lock-free asynchronous ("Hogwild") SGD.
+
+Several worker processes read and update a set of weight arrays that live in
+shared memory without taking any locks. Each worker samples its own
+minibatches, computes a gradient against whatever the weights currently are
+and adds its update in place; updates from different workers may interleave
+or overwrite each other, which for convex and shallow problems costs very
+little accuracy while removing all synchronization from the inner loop (see
+Niu et al., "Hogwild!", 2011).
+
+Workers are forked from the training process, so models and data are
+inherited without pickling. This requires the 'fork' start method, which is
+available on Linux and OS X. Each worker is pinned to its own share of the
+cores and limits its BLAS threads to that share (see resources.py), so the
+workers do not oversubscribe the machine.
+"""
+
+
+def shared_array(shape, dtype=np.float64):
+    """
+    Allocate a zero-filled numpy array backed by shared memory and with no
+    lock. Arrays allocated before the workers are forked are shared with them.
+    """
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    raw = multiprocessing.RawArray(ctypes.c_char, max(count, 1) * dtype.itemsize)
+    return np.frombuffer(raw, dtype=dtype, count=count).reshape(shape)
+
+
+def to_shared(x):
+    """ Copy the numpy array x into a new shared-memory array. """
+    out = shared_array(x.shape, x.dtype)
+    out[...] = x
+    return out
+
+
+def _worker(worker_id, num_workers, step_fn, epochs, losses, commands, done,
+            seed, cores):
+    """
+    Body of a worker process: run every num_workers-th iteration of each
+    epoch on the given cores, waiting for the parent's go-ahead before
+    starting the next epoch.
+    """
+    resources.govern_worker(cores)
+    np.random.seed(seed)
+    for start, end in epochs:
+        if commands.get() is None:
+            return
+        for it in range(start + worker_id, end, num_workers):
+            losses[it] = step_fn(it)
+        done.put(worker_id)
+
+
+def _wait_for_workers(done, workers):
+    """
+    Wait until every worker has reported back, raising an error if a worker
+    died instead of hanging forever.
+    """
+    finished = 0
+    while finished < len(workers):
+        try:
+            done.get(timeout=1.0)
+            finished += 1
+        except queue.Empty:
+            for i, p in enumerate(workers):
+                if p.exitcode is not None and p.exitcode != 0:
+                    raise RuntimeError('Hogwild worker %d exited with code %d'
+                                       % (i, p.exitcode))
+
+
+def hogwild_train(step_fn, num_iters, num_workers=4, iters_per_epoch=None,
+                  epoch_callback=None, seed=None, threads_per_worker=None):
+    """
+    Run num_iters steps of step_fn spread over num_workers forked processes.
+
+    Inputs:
+    - step_fn: Function called as step_fn(it) for iteration index it. It should
+      sample a minibatch, compute the gradient and update the shared weights
+      in place (see shared_array), then return the minibatch loss.
+    - num_iters: Total number of steps, summed over all workers.
+    - num_workers: Number of worker processes.
+    - iters_per_epoch: If given, workers stop after every iters_per_epoch
+      steps until epoch_callback has run in the parent process.
+    - epoch_callback: Function called as epoch_callback(epoch) in the parent
+      process after each epoch, e.g. to check validation accuracy. The workers
+      are idle while it runs, so it sees a consistent set of weights.
+    - seed: If not None, worker i seeds its RNG with seed + i so that
+      minibatch sampling is reproducible; otherwise workers are seeded
+      randomly.
+    - threads_per_worker: Number of cores and BLAS threads of every worker;
+      defaults to an equal share of the available cores.
+
+    Returns:
+    - loss_history: Array of shape (num_iters,) giving the loss of every
+      step, indexed by iteration.
+    """
+    if iters_per_epoch is None:
+        iters_per_epoch = num_iters
+    epochs = [(start, min(start + iters_per_epoch, num_iters))
+              for start in range(0, num_iters, iters_per_epoch)]
+    if seed is None:
+        seed = np.random.randint(2**31 - num_workers)
+
+    ctx = multiprocessing.get_context('fork')
+    partition = resources.partition_cores(num_workers, threads_per_worker)
+    losses = shared_array((num_iters,))
+    commands = [ctx.Queue() for _ in range(num_workers)]
+    done = ctx.Queue()
+    workers = [ctx.Process(target=_worker,
+                           args=(i, num_workers, step_fn, epochs, losses,
+                                 commands[i], done, seed + i, partition[i]))
+               for i in range(num_workers)]
+    for p in workers:
+        p.daemon = True
+        p.start()
+
+    try:
+        for epoch in range(len(epochs)):
+            for q in commands:
+                q.put(True)
+            _wait_for_workers(done, workers)
+            if epoch_callback is not None:
+                epoch_callback(epoch)
+    finally:
+        for p, q in zip(workers, commands):
+            if p.is_alive():
+                q.put(None)
+        for p in workers:
+            p.join(timeout=5.0)
+            if p.is_alive():
+                p.terminate()
+
+    return np.array(losses)
@@ -0,0 +1,282 @@
+from __future__ import print_function, division
+from builtins import range
+import json
+import math
+import os
+import pickle
+
+import numpy as np
+
+from cs231n import resources
+from cs231n.solver import Solver
+
+"""
+Parallel hyperparameter search with successive halving.
+
+A search trains many configurations of a model concurrently in a pool of
+worker processes. Training data is written once to .npy files in the search
+directory and every worker memory-maps it, so all workers share one physical
+copy. Configurations are trained in rungs: every configuration gets a small
+budget of epochs, then only the best 1 / eta of them (ranked by the best
+val_acc_history value seen so far) are trained for eta times as many epochs,
+and so on. Survivors continue from the state saved at the end of the previous
+rung rather than starting over.
+
+Every finished rung of every trial is appended to results.jsonl in the search
+directory together with the trained state, so a search that is interrupted
+can be restarted with the same arguments and continues where it stopped.
+
+A search is described by a build function, which must be defined at the top
+level of a module:
+
+def build_fn(config):
+
+Inputs:
+  - config: A JSON-serializable dictionary of hyperparameters.
+
+Returns a tuple of:
+  - model: A model conforming to the Solver API.
+  - solver_kwargs: A dictionary of keyword arguments for Solver, such as
+    update_rule, optim_config, lr_decay and batch_size. num_epochs is set by
+    the search.
+"""
+
+
+# State inherited by forked worker processes
+_build_fn = None
+_data_dir = None
+_data = None
+
+
+def _save_data(data, data_dir):
+    """ Write each array in data to data_dir/<key>.npy unless it exists. """
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    for k in ('X_train', 'y_train', 'X_val', 'y_val'):
+        filename = os.path.join(data_dir, '%s.npy' % k)
+        if not os.path.exists(filename):
+            np.save(filename + '.tmp.npy', data[k])
+            os.rename(filename + '.tmp.npy', filename)
+
+
+def _init_worker():
+    """ Memory-map the training data once per worker process. """
+    global _data
+    _data = {}
+    for k in ('X_train', 'y_train', 'X_val', 'y_val'):
+        _data[k] = np.load(os.path.join(_data_dir, '%s.npy' % k),
+                           mmap_mode='r')
+
+
+def _run_trial(task):
+    """
+    Train one configuration up to the epoch budget of the current rung,
+    continuing from the state saved by the previous rung if there is one.
+    """
+    trial_id, config, rung, num_epochs, state_file, seed = task
+    np.random.seed(seed)
+
+    model, solver_kwargs = _build_fn(config)
+    solver_kwargs = dict(solver_kwargs)
+    solver_kwargs.setdefault('verbose', False)
+
+    state = None
+    if os.path.exists(state_file):
+        with open(state_file, 'rb') as f:
+            state = pickle.load(f)
+        model = state['model']
+        # The pickled model holds the best parameters; continue from the
+        # last iterate, which matches the saved update rule state
+        model.params = state.get('params', model.params)
+
+    solver = Solver(model, _data, num_epochs=num_epochs, **solver_kwargs)
+    if state is not None:
+        iterations_per_epoch = max(solver.X_train.shape[0] //
+                                   solver.batch_size, 1)
+        solver.epoch = state['epoch']
+        solver.iteration = state.get('iteration',
+                                     state['epoch'] * iterations_per_epoch)
+        solver.optim_configs = state['optim_configs']
+        solver.best_val_acc = state['best_val_acc']
+        solver.best_params = state['best_params']
+        solver.loss_history = state['loss_history']
+        solver.train_acc_history = state['train_acc_history']
+        solver.val_acc_history = state['val_acc_history']
+    solver.train()
+
+    state = {
+        'model': model,
+        'params': solver.last_params,
+        'epoch': solver.epoch,
+        'iteration': solver.iteration,
+        'optim_configs': solver.optim_configs,
+        'best_val_acc': solver.best_val_acc,
+        'best_params': solver.best_params,
+        'loss_history': solver.loss_history,
+        'train_acc_history': solver.train_acc_history,
+        'val_acc_history': solver.val_acc_history,
+    }
+    with open(state_file + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(state_file + '.tmp', state_file)
+
+    return {
+        'trial_id': trial_id,
+        'config': config,
+        'rung': rung,
+        'epochs': solver.epoch,
+        'best_val_acc': float(solver.best_val_acc),
+        'train_acc_history': [float(a) for a in solver.train_acc_history],
+        'val_acc_history': [float(a) for a in solver.val_acc_history],
+    }
+
+
+def _load_results(results_file):
+    """ Read the records of all finished (trial, rung) pairs. """
+    results = {}
+    if os.path.exists(results_file):
+        with open(results_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A partially written last line from an interrupted run
+                    continue
+                results[(record['trial_id'], record['rung'])] = record
+    return results
+
+
+def successive_halving(build_fn, configs, data, search_dir, min_epochs=1,
+                       eta=3, num_rungs=None, num_workers=None, seed=0,
+                       verbose=True, threads_per_worker=None):
+    """
+    Search over configs with successive halving.
+
+    Inputs:
+    - build_fn: Function mapping a config to (model, solver_kwargs); see the
+      top of this file.
+    - configs: List of JSON-serializable config dictionaries.
+    - data: Dictionary with keys 'X_train', 'y_train', 'X_val', 'y_val' as
+      for Solver.
+    - search_dir: Directory holding the memory-mapped data, the saved trial
+      states and results.jsonl. Rerunning with the same arguments resumes an
+      interrupted search.
+    - min_epochs: Number of epochs every config is trained for in the first
+      rung. Rung r trains for min_epochs * eta**r epochs in total.
+    - eta: After each rung only the best 1 / eta of the configs survive.
+    - num_rungs: Number of rungs; by default, rungs are added until a single
+      config is left.
+    - num_workers: Number of worker processes; defaults to the number of
+      available cores.
+    - seed: Base seed; each (trial, rung) gets its own deterministic seed.
+    - verbose: Boolean; if set to false then no output will be printed.
+    - threads_per_worker: Number of cores and BLAS threads of every worker;
+      defaults to an equal share of the available cores (see
+      resources.worker_pool).
+
+    Returns:
+    - results: List with one record per config, giving the last rung that
+      config reached, sorted from best to worst. Each record is a dictionary
+      with keys 'trial_id', 'config', 'rung', 'epochs', 'best_val_acc',
+      'train_acc_history' and 'val_acc_history'.
+    """
+    global _build_fn, _data_dir
+
+    if num_rungs is None:
+        num_rungs = 1 + int(math.floor(math.log(len(configs)) / math.log(eta)))
+    if num_workers is None:
+        num_workers = len(resources.available_cores())
+
+    trials_dir = os.path.join(search_dir, 'trials')
+    if not os.path.isdir(trials_dir):
+        os.makedirs(trials_dir)
+    _build_fn = build_fn
+    _data_dir = os.path.join(search_dir, 'data')
+    _save_data(data, _data_dir)
+
+    results_file = os.path.join(search_dir, 'results.jsonl')
+    finished = _load_results(results_file)
+    for (trial_id, _), record in finished.items():
+        if (trial_id >= len(configs) or
+                record['config'] != json.loads(json.dumps(configs[trial_id]))):
+            raise ValueError('Search directory "%s" belongs to a different set '
+                             'of configs' % search_dir)
+
+    pool = resources.worker_pool(num_workers, threads_per_worker,
+                                 initializer=_init_worker)
+    latest = {}
+    try:
+        survivors = list(range(len(configs)))
+        for rung in range(num_rungs):
+            num_epochs = min_epochs * eta**rung
+            tasks = []
+            for trial_id in survivors:
+                if (trial_id, rung) in finished:
+                    continue
+                state_file = os.path.join(trials_dir, '%d.pkl' % trial_id)
+                tasks.append((trial_id, configs[trial_id], rung, num_epochs,
+                              state_file, seed + 1000 * trial_id + rung))
+
+            if verbose:
+                print('(Rung %d / %d) %d configs, %d epochs, %d to run' % (
+                       rung + 1, num_rungs, len(survivors), num_epochs,
+                       len(tasks)))
+            with open(results_file, 'a') as f:
+                for record in pool.imap_unordered(_run_trial, tasks):
+                    finished[(record['trial_id'], rung)] = record
+                    f.write(json.dumps(record) + '\n')
+                    f.flush()
+                    if verbose:
+                        print('  trial %d: best val_acc %f' % (
+                               record['trial_id'], record['best_val_acc']))
+
+            for trial_id in survivors:
+                latest[trial_id] = finished[(trial_id, rung)]
+            survivors.sort(key=lambda i: -latest[i]['best_val_acc'])
+            survivors = survivors[:max(len(survivors) // eta, 1)]
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return sorted(latest.values(),
+                  key=lambda r: (-r['rung'], -r['best_val_acc']))
+
+
+def hyperband(build_fn, sample_config, data, search_dir, max_epochs=27, eta=3,
+              num_workers=None, seed=0, verbose=True, threads_per_worker=None):
+    """
+    Search with Hyperband: run several successive halving brackets that trade
+    off the number of configs against the epochs each one starts with.
+
+    Inputs:
+    - sample_config: Function called as sample_config(rng) with a
+      np.random.RandomState that returns a random config dictionary.
+    - max_epochs: Largest number of epochs any config is trained for.
+    - Other inputs are as for successive_halving; each bracket uses its own
+      subdirectory of search_dir.
+
+    Returns:
+    - results: List of records from all brackets, sorted from best to worst
+      by best_val_acc.
+    """
+    s_max = int(math.floor(math.log(max_epochs) / math.log(eta) + 1e-9))
+    rng = np.random.RandomState(seed)
+    results = []
+    for s in range(s_max, -1, -1):
+        num_configs = int(math.ceil((s_max + 1) / (s + 1) * eta**s))
+        min_epochs = max(max_epochs // eta**s, 1)
+        configs = [sample_config(rng) for _ in range(num_configs)]
+        if verbose:
+            print('Bracket %d: %d configs starting at %d epochs' % (
+                   s_max - s, num_configs, min_epochs))
+        results.extend(successive_halving(
+            build_fn, configs, data,
+            os.path.join(search_dir, 'bracket_%d' % (s_max - s)),
+            min_epochs=min_epochs, eta=eta, num_rungs=s + 1,
+            num_workers=num_workers, seed=seed, verbose=verbose,
+            threads_per_worker=threads_per_worker))
+    results.sort(key=lambda r: -r['best_val_acc'])
+    return results
@@ -0,0 +1,363 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import threading
+
+import numpy as np
+
+from cs231n.classifiers.fc_net import TwoLayerNet, FullyConnectedNet
+from cs231n.classifiers.cnn import ThreeLayerConvNet
+
+"""
+Static forward-only inference plans.
+
+A test-time call to model.loss(X) builds caches it never uses, casts X and
+allocates every intermediate activation. compile_model turns a trained model
+into an InferencePlan that does none of this:
+
+- Parameters are copied once, in the plan's dtype and in the layout the
+  forward pass wants. Batchnorm layers are folded into the weights and biases
+  of the affine layer before them, and dropout is dropped.
+- Activations live in two preallocated "ping-pong" buffers: every layer reads
+  its input from one and writes its output into the other with out=
+  arguments, so a call allocates no activation arrays. Convolutions use a
+  third buffer for their padded input, im2col matrix and output.
+- Buffers are sized for max_batch_size examples and viewed at the size of
+  each batch, so every batch size up to max_batch_size is served from the
+  same buffers; larger inputs are processed in chunks.
+- Every thread gets its own buffers, so one plan can serve many threads.
+
+Example usage:
+
+plan = compile_model(model, max_batch_size=128)
+scores = plan.predict(X)              # same as model.loss(X)
+plan.predict(X, out=scores)           # reuse the output array
+labels = plan.predict_labels(X)
+"""
+
+
+class _Affine(object):
+    """ out = x.dot(w) + b, optionally followed by a ReLU. """
+
+    def __init__(self, w, b, relu, dtype):
+        self.w = np.ascontiguousarray(w, dtype=dtype)
+        self.b = np.asarray(b, dtype=dtype)
+        self.relu = relu
+        self.in_size = self.w.shape[0]
+        self.out_size = self.w.shape[1]
+        self.work_size = 0
+
+
+    def forward(self, x, out, work):
+        np.dot(x, self.w, out=out)
+        out += self.b
+        if self.relu:
+            np.maximum(out, 0, out=out)
+
+
+class _ConvReluPool(object):
+    """
+    conv - relu - max pool on activations stored as (N, H, W, C) rows. The
+    convolution copies the strided patches of a zero-padded copy of its input
+    into a preallocated im2col buffer and multiplies that with the filters.
+    """
+
+    def __init__(self, w, b, input_shape, stride, pad, pool_size, pool_stride,
+                 dtype):
+        F, C, HH, WW = w.shape
+        H, W = input_shape
+        self.C, self.H, self.W = C, H, W
+        self.HH, self.WW, self.F = HH, WW, F
+        self.stride, self.pad = stride, pad
+        self.Ho = (H + 2 * pad - HH) // stride + 1
+        self.Wo = (W + 2 * pad - WW) // stride + 1
+        if pool_size != pool_stride or self.Ho % pool_size or \
+                self.Wo % pool_size:
+            raise ValueError('Only non-overlapping pooling that tiles the '
+                             'convolution output is supported')
+        self.pool = pool_size
+        # Filters as a (HH * WW * C, F) matrix matching the patch layout
+        self.w = np.ascontiguousarray(
+            w.transpose(2, 3, 1, 0).reshape(HH * WW * C, F), dtype=dtype)
+        self.b = np.asarray(b, dtype=dtype)
+        self.in_size = H * W * C
+        self.out_size = (self.Ho // pool_size) * (self.Wo // pool_size) * F
+        self.padded_size = (H + 2 * pad) * (W + 2 * pad) * C
+        self.cols_size = self.Ho * self.Wo * HH * WW * C
+        self.conv_size = self.Ho * self.Wo * F
+        self.work_size = self.padded_size + self.cols_size + self.conv_size
+
+
+    def forward(self, x, out, work):
+        N = x.shape[0]
+        p = self.pad
+        Hp, Wp = self.H + 2 * p, self.W + 2 * p
+        padded = work[:N * self.padded_size].reshape(N, Hp, Wp, self.C)
+        padded.fill(0)
+        padded[:, p:p + self.H, p:p + self.W, :] = x.reshape(
+            N, self.H, self.W, self.C)
+
+        s = self.stride
+        sN, sH, sW, sC = padded.strides
+        patches = np.lib.stride_tricks.as_strided(
+            padded, shape=(N, self.Ho, self.Wo, self.HH, self.WW, self.C),
+            strides=(sN, s * sH, s * sW, sH, sW, sC), writeable=False)
+        start = N * self.padded_size
+        cols = work[start:start + N * self.cols_size].reshape(
+            N, self.Ho, self.Wo, self.HH, self.WW, self.C)
+        cols[...] = patches
+
+        start = N * (self.padded_size + self.cols_size)
+        conv = work[start:start + N * self.conv_size].reshape(
+            N * self.Ho * self.Wo, self.F)
+        np.dot(cols.reshape(N * self.Ho * self.Wo, -1), self.w, out=conv)
+        conv += self.b
+        np.maximum(conv, 0, out=conv)
+
+        k = self.pool
+        np.max(conv.reshape(N, self.Ho // k, k, self.Wo // k, k, self.F),
+               axis=(2, 4),
+               out=out.reshape(N, self.Ho // k, self.Wo // k, self.F))
+
+
+class InferencePlan(object):
+    """
+    A compiled, forward-only version of a model; see compile_model.
+    """
+
+    def __init__(self, ops, input_shape, input_layout, num_classes, dtype,
+                 max_batch_size):
+        """
+        Inputs:
+        - ops: List of layer objects with in_size, out_size and work_size
+          attributes and a forward(x, out, work) method. work_size is the
+          size of the scratch space an op needs per example; an op may also
+          have a fixed_work_size attribute, the size of scratch space it
+          needs independently of the batch size, which it takes from the
+          end of work.
+        - input_shape: Shape of one input example. With the 'flat' layout,
+          any shape with the same number of elements is accepted.
+        - input_layout: 'flat' to flatten inputs as they are, or 'nhwc' to
+          transpose (C, H, W) images to (H, W, C) rows.
+        - num_classes: Number of scores per example.
+        - dtype: Data type of the computation.
+        - max_batch_size: Number of examples the buffers are sized for.
+        """
+        self.ops = ops
+        self.input_shape = tuple(input_shape)
+        self.input_layout = input_layout
+        self.num_classes = num_classes
+        self.dtype = np.dtype(dtype)
+        self.max_batch_size = max_batch_size
+        self.activation_size = max(max(op.in_size, op.out_size) for op in ops)
+        self.work_size = max(op.work_size for op in ops)
+        self.fixed_work_size = max(getattr(op, 'fixed_work_size', 0)
+                                   for op in ops)
+        self._local = threading.local()
+
+
+    @property
+    def buffer_bytes(self):
+        """ Bytes of buffers allocated by each thread that uses the plan. """
+        return self.dtype.itemsize * (self.max_batch_size * (
+            2 * self.activation_size + self.work_size) +
+            self.fixed_work_size)
+
+
+    def _buffers(self):
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            n = self.max_batch_size
+            buffers = self._local.buffers = (
+                np.empty(n * self.activation_size, dtype=self.dtype),
+                np.empty(n * self.activation_size, dtype=self.dtype),
+                np.empty(n * self.work_size + self.fixed_work_size,
+                         dtype=self.dtype),
+            )
+        return buffers
+
+
+    def _load_input(self, X, x):
+        """ Copy the images X into the rows x in the plan's layout. """
+        N = X.shape[0]
+        if self.input_layout == 'nhwc':
+            x.reshape((N,) + self.input_shape[1:] + self.input_shape[:1])[...] = \
+                X.transpose(0, 2, 3, 1)
+        else:
+            x[...] = X.reshape(N, -1)
+
+
+    def _forward(self, X, out):
+        N = X.shape[0]
+        ping, pong, work = self._buffers()
+        x = ping[:N * self.ops[0].in_size].reshape(N, self.ops[0].in_size)
+        self._load_input(X, x)
+
+        for i, op in enumerate(self.ops):
+            if i == len(self.ops) - 1:
+                y = out
+            else:
+                y = pong[:N * op.out_size].reshape(N, op.out_size)
+            op.forward(x, y, work)
+            x, ping, pong = y, pong, ping
+
+
+    def predict(self, X, out=None):
+        """
+        Compute class scores.
+
+        Inputs:
+        - X: Array of shape (N,) + input_shape.
+        - out: Optional array of shape (N, num_classes) and the plan's dtype
+          to write the scores into.
+
+        Returns:
+        - scores: Array of shape (N, num_classes); out if it was given.
+        """
+        N = X.shape[0]
+        if self.input_layout == 'flat':
+            valid = int(np.prod(X.shape[1:])) == self.ops[0].in_size
+        else:
+            valid = X.shape[1:] == self.input_shape
+        if not valid:
+            raise ValueError('Expected inputs of shape %s, got %s' % (
+                             self.input_shape, X.shape[1:]))
+        if out is None:
+            out = np.empty((N, self.num_classes), dtype=self.dtype)
+        elif out.shape != (N, self.num_classes) or out.dtype != self.dtype \
+                or not out.flags.c_contiguous:
+            raise ValueError('out must be a C-contiguous %s array of shape %s'
+                             % (self.dtype, (N, self.num_classes)))
+        for start in range(0, N, self.max_batch_size):
+            end = min(start + self.max_batch_size, N)
+            self._forward(X[start:end], out[start:end])
+        return out
+
+
+    def activations(self, X):
+        """
+        Run the plan on X without its buffers and return a list with the
+        input of every op, as (N, in_size) arrays in the plan's layout,
+        followed by the scores. Used to calibrate quantized plans.
+        """
+        N = X.shape[0]
+        x = np.empty((N, self.ops[0].in_size), dtype=self.dtype)
+        self._load_input(X, x)
+        activations = [x]
+        for op in self.ops:
+            work = np.empty(N * op.work_size +
+                            getattr(op, 'fixed_work_size', 0),
+                            dtype=self.dtype)
+            y = np.empty((N, op.out_size), dtype=self.dtype)
+            op.forward(x.copy(), y, work)
+            activations.append(y)
+            x = y
+        return activations
+
+
+    def predict_labels(self, X, out=None):
+        """
+        Compute the predicted label of every example, optionally writing them
+        into out, an integer array of shape (N,).
+        """
+        scores = self.predict(X)
+        if out is None:
+            out = np.empty(X.shape[0], dtype=np.intp)
+        return np.argmax(scores, axis=1, out=out)
+
+
+def _fold_batchnorm(w, b, gamma, beta, bn_param):
+    """
+    Return the weights and biases of an affine layer followed by a test-time
+    batchnorm layer with parameters gamma, beta and bn_param.
+    """
+    D = w.shape[1]
+    mean = bn_param.get('running_mean', np.zeros(D))
+    var = bn_param.get('running_var', np.zeros(D))
+    eps = bn_param.get('eps', 1e-5)
+    scale = gamma / np.sqrt(var + eps)
+    return w * scale, (b - mean) * scale + beta
+
+
+def compile_model(model, max_batch_size=128, dtype=None, input_shape=None):
+    """
+    Compile a trained model into an InferencePlan computing the same scores
+    as model.loss(X).
+
+    Inputs:
+    - model: A TwoLayerNet, FullyConnectedNet or ThreeLayerConvNet.
+    - max_batch_size: Number of examples the activation buffers hold; larger
+      inputs are processed in chunks of this size.
+    - dtype: Data type of the computation; defaults to the model's dtype, or
+      float64 for models without one.
+    - input_shape: (C, H, W) shape of the images of a ThreeLayerConvNet;
+      by default the images are assumed to be square.
+
+    Returns:
+    - plan: An InferencePlan.
+    """
+    if dtype is None:
+        dtype = getattr(model, 'dtype', np.float64)
+    params = dict((k, np.asarray(v, dtype=np.float64))
+                  for k, v in model.params.items())
+
+    if isinstance(model, TwoLayerNet):
+        ops = [_Affine(params['W1'], params['b1'], True, dtype),
+               _Affine(params['W2'], params['b2'], False, dtype)]
+        input_shape = (params['W1'].shape[0],)
+        input_layout = 'flat'
+
+    elif isinstance(model, FullyConnectedNet):
+        if getattr(model, 'hierarchy', None) is not None:
+            raise ValueError('Cannot compile a FullyConnectedNet with a '
+                             'hierarchical softmax')
+        ops = []
+        for l in range(model.num_layers):
+            # A low-rank layer U.dot(V) becomes two thin affine ops
+            u = params.get('W%d_U' % l)
+            w = params['W%d' % l] if u is None else params['W%d_V' % l]
+            b = params['b%d' % l]
+            last = l == model.num_layers - 1
+            if model.use_batchnorm and not last:
+                w, b = _fold_batchnorm(w, b, params['gamma%d' % l],
+                                       params['beta%d' % l],
+                                       model.bn_params[l])
+            if u is not None:
+                ops.append(_Affine(u, np.zeros(u.shape[1]), False, dtype))
+            ops.append(_Affine(w, b, not last, dtype))
+        input_shape = (ops[0].in_size,)
+        input_layout = 'flat'
+
+    elif isinstance(model, ThreeLayerConvNet):
+        W1 = params['W1']
+        F, C, HH, WW = W1.shape
+        # The hidden layer sees the pooled activations as rows of
+        # (H, W, F) instead of (F, H, W); permute its weights to match
+        # With a low-rank W2 = W2_U.dot(W2_V) the rows of W2_U are permuted
+        low_rank = 'W2_U' in params
+        W2 = params['W2_U' if low_rank else 'W2']
+        if input_shape is None:
+            H = W = int(round(np.sqrt(W2.shape[0] // F))) * 2
+        else:
+            _, H, W = input_shape
+        conv = _ConvReluPool(W1, params['b1'], (H, W), 1, (HH - 1) // 2, 2,
+                             2, dtype)
+        Hp, Wp = conv.Ho // 2, conv.Wo // 2
+        W2 = W2.reshape(F, Hp, Wp, -1).transpose(1, 2, 0, 3).reshape(
+            Hp * Wp * F, -1)
+        if low_rank:
+            hidden = [_Affine(W2, np.zeros(W2.shape[1]), False, dtype),
+                      _Affine(params['W2_V'], params['b2'], True, dtype)]
+        else:
+            hidden = [_Affine(W2, params['b2'], True, dtype)]
+        ops = [conv] + hidden + [_Affine(params['W3'], params['b3'], False,
+                                         dtype)]
+        input_shape = (C, H, W)
+        input_layout = 'nhwc'
+
+    else:
+        raise ValueError('Cannot compile a model of type %s' %
+                         type(model).__name__)
+
+    return InferencePlan(ops, input_shape, input_layout,
+                         ops[-1].out_size, dtype, max_batch_size)
@@ -83,6 +83,94 @@ def affine_backward(dout, cache):
     return dx, dw, db
 
 
+def affine_forward_into(x, w, b, out):
+    """
+    Computes the forward pass for an affine layer like affine_forward, but
+    writes the output into a preallocated array.
+
+    Inputs:
+    - x, w, b: As for affine_forward
+    - out: Array of shape (N, M) and of the result type of x and w
+
+    Returns a tuple of:
+    - out: The output array
+    - cache: (x, w, b)
+    """
+    N = x.shape[0]
+    np.dot(x.reshape(N, -1), w, out=out)
+    out += b
+    return out, (x, w, b)
+
+
+def affine_backward_into(dout, cache, dx=None, dw=None, db=None):
+    """
+    Computes the backward pass for an affine layer like affine_backward, but
+    writes the gradients into preallocated arrays. Gradients whose array is
+    None are not computed, which saves the gradient with respect to the
+    input of the first layer of a network.
+
+    Inputs:
+    - dout: Upstream derivative, of shape (N, M)
+    - cache: Tuple from affine_forward or affine_forward_into
+    - dx: None or array of shape (N, D) for the gradient with respect to x
+    - dw: None or array of shape (D, M) for the gradient with respect to w
+    - db: None or array of shape (M,) for the gradient with respect to b
+
+    Returns a tuple of:
+    - dx, dw, db: The arrays passed in, with the gradients written into them;
+      dx has the shape of x.
+    """
+    x, w, b = cache
+    N = dout.shape[0]
+    if dx is not None:
+        np.dot(dout, w.T, out=dx.reshape(N, -1))
+        dx = dx.reshape(x.shape)
+    if dw is not None:
+        np.dot(x.reshape(N, -1).T, dout, out=dw)
+    if db is not None:
+        np.sum(dout, axis=0, out=db)
+    return dx, dw, db
+
+
+def linear_forward(x, w):
+    """
+    Computes the forward pass for a linear layer, an affine layer without a
+    bias. A low-rank affine layer with weights U.dot(V) is computed as a
+    linear layer with weights U followed by an affine layer with weights V.
+
+    Inputs:
+    - x: A numpy array containing input data, of shape (N, d_1, ..., d_k)
+    - w: A numpy array of weights, of shape (D, M)
+
+    Returns a tuple of:
+    - out: output, of shape (N, M)
+    - cache: (x, w)
+    """
+    out = x.reshape(x.shape[0], -1).dot(w)
+    cache = (x, w)
+    return out, cache
+
+
+def linear_backward(dout, cache):
+    """
+    Computes the backward pass for a linear layer.
+
+    Inputs:
+    - dout: Upstream derivative, of shape (N, M)
+    - cache: Tuple of:
+      - x: Input data, of shape (N, d_1, ... d_k)
+      - w: Weights, of shape (D, M)
+
+    Returns a tuple of:
+    - dx: Gradient with respect to x, of shape (N, d1, ..., d_k)
+    - dw: Gradient with respect to w, of shape (D, M)
+    """
+    x, w = cache
+    dx = dout.dot(w.T).reshape(x.shape)
+    dw = x.reshape(x.shape[0], -1).T.dot(dout)
+    return dx, dw
+
+
 def relu_forward(x):
     """
     Computes the forward pass for a layer of rectified linear units (ReLUs).
@@ -128,6 +216,38 @@ def relu_backward(dout, cache):
     return dx
 
 
+def relu_forward_inplace(x):
+    """
+    Computes the forward pass for a layer of ReLUs in place, overwriting x.
+
+    Input:
+    - x: Inputs, of any shape
+
+    Returns a tuple of:
+    - out: x, holding the output
+    - cache: out; the units are active where out > 0, so the input does not
+      need to be kept
+    """
+    np.maximum(x, 0, out=x)
+    return x, x
+
+
+def relu_backward_inplace(dout, cache):
+    """
+    Computes the backward pass for a layer of ReLUs in place, overwriting
+    dout.
+
+    Input:
+    - dout: Upstream derivatives, of any shape
+    - cache: Output of relu_forward_inplace
+
+    Returns:
+    - dx: dout, holding the gradient with respect to x
+    """
+    np.multiply(dout, cache > 0, out=dout)
+    return dout
+
+
 def batchnorm_forward(x, gamma, beta, bn_param):
     """
     Forward pass for batch normalization.
@@ -398,6 +518,56 @@ def dropout_backward(dout, cache):
     return dx
 
 
+def dropout_forward_inplace(x, dropout_param, after_relu=False):
+    """
+    Performs the forward pass for (inverted) dropout in place, overwriting x.
+
+    Inputs:
+    - x: Input data, of any shape
+    - dropout_param: As for dropout_forward
+    - after_relu: Whether x is the output of a ReLU whose backward pass
+      masks the gradient where its output is zero (as relu_backward_inplace
+      does when given the output of this function). A dropped unit is then
+      also zero in that output, so the mask does not need to be kept.
+
+    Outputs:
+    - out: x, holding the output
+    - cache: tuple (dropout_param, mask); mask is None in test mode and if
+      after_relu is true.
+    """
+    p, mode = dropout_param['p'], dropout_param['mode']
+    if 'seed' in dropout_param:
+        np.random.seed(dropout_param['seed'])
+
+    mask = None
+    if mode == 'train':
+        mask = np.random.rand(*x.shape) > p
+        x *= mask
+        x /= 1. - p
+        if after_relu:
+            mask = None
+    return x, (dropout_param, mask)
+
+
+def dropout_backward_inplace(dout, cache):
+    """
+    Perform the backward pass for (inverted) dropout in place, overwriting
+    dout.
+
+    Inputs:
+    - dout: Upstream derivatives, of any shape
+    - cache: (dropout_param, mask) from dropout_forward_inplace; if mask is
+      None in train mode, the gradient is only rescaled and the dropped
+      units must be masked by the ReLU before the dropout.
+    """
+    dropout_param, mask = cache
+    if dropout_param['mode'] == 'train':
+        if mask is not None:
+            dout *= mask
+        dout /= 1. - dropout_param['p']
+    return dout
+
+
 def conv_forward_naive(x, w, b, conv_param):
     """
     A naive implementation of the forward pass for a convolutional layer.
@@ -738,6 +908,327 @@ def softmax_loss(x, y):
     return loss, dx
 
 
+# Largest size in bytes of the block of scores kept by the fused losses
+_LOSS_BLOCK_BYTES = 2 ** 20
+
+
+def _affine_loss(x, w, b, y, block_loss, block_size, dx=None):
+    """
+    Shared driver of the fused affine losses. The scores of block_size rows
+    at a time are computed into one reused buffer, turned into their
+    gradient in place by block_loss(scores, y) (which returns the summed loss
+    of the block), and immediately backpropagated into dx, dw and db. dx
+    is allocated unless an array of shape (N, D) is given.
+    """
+    N = x.shape[0]
+    x_flat = x.reshape(N, -1)
+    C = w.shape[1]
+    dtype = np.result_type(x_flat.dtype, w.dtype)
+    if block_size is None:
+        block_size = _LOSS_BLOCK_BYTES // (C * dtype.itemsize)
+    block_size = max(1, min(N, block_size))
+
+    if dx is None:
+        dx = np.empty(x_flat.shape, dtype=dtype)
+    dx = dx.reshape(x_flat.shape)
+    dw = np.zeros(w.shape, dtype=dtype)
+    db = np.zeros(C, dtype=dtype)
+    buf = np.empty((block_size, C), dtype=dtype)
+    loss = 0.0
+    for start in range(0, N, block_size):
+        end = min(start + block_size, N)
+        x_block = x_flat[start:end]
+        scores = buf[:end - start]
+        np.dot(x_block, w, out=scores)
+        scores += b
+        loss += block_loss(scores, y[start:end])
+        scores /= N
+        np.dot(scores, w.T, out=dx[start:end])
+        if start == 0:
+            np.dot(x_block.T, scores, out=dw)
+        else:
+            dw += x_block.T.dot(scores)
+        db += scores.sum(axis=0)
+    return loss / N, dx.reshape(x.shape), dw, db
+
+
+def _softmax_block(scores, y):
+    """ Replace scores by the gradient of the summed softmax loss. """
+    rows = np.arange(scores.shape[0])
+    scores -= np.max(scores, axis=1, keepdims=True)
+    correct = scores[rows, y]
+    np.exp(scores, out=scores)
+    Z = np.sum(scores, axis=1)
+    scores /= Z[:, np.newaxis]
+    scores[rows, y] -= 1
+    return np.sum(np.log(Z) - correct)
+
+
+def _svm_block(scores, y):
+    """ Replace scores by the gradient of the summed SVM loss. """
+    rows = np.arange(scores.shape[0])
+    scores -= scores[rows, y][:, np.newaxis] - 1.0
+    np.maximum(scores, 0, out=scores)
+    scores[rows, y] = 0
+    loss = np.sum(scores)
+    num_pos = np.count_nonzero(scores, axis=1)
+    np.sign(scores, out=scores)
+    scores[rows, y] = -num_pos
+    return loss
+
+
+def affine_softmax_loss(x, w, b, y, block_size=None, dx=None):
+    """
+    Computes an affine layer followed by a softmax loss, and the gradients
+    of the loss, in one pass. This gives the same results as affine_forward,
+    softmax_loss and affine_backward, but the scores are processed
+    block_size rows at a time in a single reused buffer, so no (N, C) array
+    of scores or probabilities is ever allocated.
+
+    Inputs:
+    - x: Input data, of shape (N, d_1, ..., d_k)
+    - w: Weights, of shape (D, C)
+    - b: Biases, of shape (C,)
+    - y: Vector of labels, of shape (N,) where 0 <= y[i] < C
+    - block_size: Number of rows of scores per block; default is as many
+      as fit in 1MB.
+    - dx: If not None, an array of shape (N, D) to write the gradient with
+      respect to x into.
+
+    Returns a tuple of:
+    - loss: Scalar giving the loss
+    - dx: Gradient with respect to x, of shape (N, d1, ..., d_k)
+    - dw: Gradient with respect to w, of shape (D, C)
+    - db: Gradient with respect to b, of shape (C,)
+    """
+    return _affine_loss(x, w, b, y, _softmax_block, block_size, dx)
+
+
+def affine_svm_loss(x, w, b, y, block_size=None, dx=None):
+    """
+    Computes an affine layer followed by a multiclass SVM loss, and the
+    gradients of the loss, in one pass; see affine_softmax_loss.
+
+    Inputs and returns are the same as for affine_softmax_loss.
+    """
+    return _affine_loss(x, w, b, y, _svm_block, block_size, dx)
+
+
+def _log_softmax(scores):
+    """ Replace scores by their log-softmax along axis 1, in place. """
+    scores -= np.max(scores, axis=1, keepdims=True)
+    scores -= np.log(np.sum(np.exp(scores), axis=1, keepdims=True))
+    return scores
+
+
+def hierarchical_softmax_loss(x, w_cluster, b_cluster, w, b, y, hierarchy):
+    """
+    Computes a two-level hierarchical softmax loss over the scores of affine
+    layers, and its gradients, in one pass.
+
+    The classes are partitioned into K clusters. The probability of class c
+    in cluster k is P(k | x) * P(c | k, x), where P(k | x) is a softmax over
+    the K cluster scores x.dot(w_cluster) + b_cluster and P(c | k, x) is a
+    softmax over the scores x.dot(w[:, cols]) + b[cols] of the classes of
+    cluster k only. Each example only needs the scores of the K clusters
+    and of the classes of its own cluster, so with clusters of about sqrt(C)
+    classes the cost grows with sqrt(C) rather than C.
+
+    Inputs:
+    - x: Input data, of shape (N, d_1, ..., d_k)
+    - w_cluster: Cluster weights, of shape (D, K)
+    - b_cluster: Cluster biases, of shape (K,)
+    - w: Class weights, of shape (D, C), with the columns grouped by cluster
+    - b: Class biases, of shape (C,), in the same order as the columns of w
+    - y: Vector of labels, of shape (N,) where 0 <= y[i] < C
+    - hierarchy: Dictionary with integer arrays describing the clusters:
+      'cluster' of shape (C,) giving the cluster of every class, 'column' of
+      shape (C,) giving the column of w of every class, 'order' of shape
+      (C,) giving the class of every column, and 'offsets' of shape (K + 1,)
+      such that the columns of cluster k are offsets[k]:offsets[k + 1].
+      See class_hierarchy.make_hierarchy.
+
+    Returns a tuple of:
+    - loss: Scalar giving the loss
+    - dx: Gradient with respect to x, of shape (N, d1, ..., d_k)
+    - dw_cluster: Gradient with respect to w_cluster, of shape (D, K)
+    - db_cluster: Gradient with respect to b_cluster, of shape (K,)
+    - dw: Gradient with respect to w, of shape (D, C)
+    - db: Gradient with respect to b, of shape (C,)
+    """
+    N = x.shape[0]
+    x_flat = x.reshape(N, -1)
+    offsets = hierarchy['offsets']
+    clusters = hierarchy['cluster'][y]
+    targets = hierarchy['column'][y] - offsets[clusters]
+
+    # Cluster level
+    rows = np.arange(N)
+    d_cluster = _log_softmax(x_flat.dot(w_cluster) + b_cluster)
+    loss = -np.sum(d_cluster[rows, clusters])
+    np.exp(d_cluster, out=d_cluster)
+    d_cluster[rows, clusters] -= 1
+    d_cluster /= N
+    dx = d_cluster.dot(w_cluster.T)
+    dw_cluster = x_flat.T.dot(d_cluster)
+    db_cluster = np.sum(d_cluster, axis=0)
+
+    # Class level, one matrix product per cluster for its examples
+    dw = np.zeros_like(w)
+    db = np.zeros_like(b)
+    by_cluster = np.argsort(clusters, kind='mergesort')
+    bounds = np.searchsorted(clusters[by_cluster],
+                             np.arange(len(offsets)))
+    for k in range(len(offsets) - 1):
+        idx = by_cluster[bounds[k]:bounds[k + 1]]
+        if len(idx) == 0:
+            continue
+        cols = slice(offsets[k], offsets[k + 1])
+        x_k = x_flat[idx]
+        d_class = _log_softmax(x_k.dot(w[:, cols]) + b[cols])
+        r = np.arange(len(idx))
+        loss -= np.sum(d_class[r, targets[idx]])
+        np.exp(d_class, out=d_class)
+        d_class[r, targets[idx]] -= 1
+        d_class /= N
+        dx[idx] += d_class.dot(w[:, cols].T)
+        dw[:, cols] += x_k.T.dot(d_class)
+        db[cols] += np.sum(d_class, axis=0)
+    return loss / N, dx.reshape(x.shape), dw_cluster, db_cluster, dw, db
+
+
+def hierarchical_softmax_scores(x, w_cluster, b_cluster, w, b, hierarchy,
+                                beam=1):
+    """
+    Decode a hierarchical softmax (see hierarchical_softmax_loss): compute
+    log-probabilities of the classes of the beam most likely clusters of
+    every example. Classes of other clusters get -inf, so the argmax of each
+    row is the top-1 prediction among the searched clusters. beam=1 costs
+    about as much as one training example; beam=K computes the exact
+    log-probabilities of all classes.
+
+    Inputs:
+    - x, w_cluster, b_cluster, w, b, hierarchy: As for
+      hierarchical_softmax_loss.
+    - beam: Number of clusters searched per example.
+
+    Returns:
+    - scores: Array of shape (N, C) with the log-probabilities, indexed by
+      class (not by column of w).
+    """
+    N = x.shape[0]
+    x_flat = x.reshape(N, -1)
+    offsets = hierarchy['offsets']
+    K = len(offsets) - 1
+    beam = min(beam, K)
+    log_p_cluster = _log_softmax(x_flat.dot(w_cluster) + b_cluster)
+    if beam == K:
+        best = np.tile(np.arange(K), (N, 1))
+    else:
+        best = np.argpartition(-log_p_cluster, beam - 1, axis=1)[:, :beam]
+
+    # Group the (example, cluster) pairs to search by cluster
+    rows = np.repeat(np.arange(N), beam)
+    best = best.reshape(-1)
+    by_cluster = np.argsort(best, kind='mergesort')
+    bounds = np.searchsorted(best[by_cluster], np.arange(K + 1))
+
+    scores = np.full((N, w.shape[1]), -np.inf, dtype=log_p_cluster.dtype)
+    order = hierarchy['order']
+    for k in range(K):
+        idx = rows[by_cluster[bounds[k]:bounds[k + 1]]]
+        if len(idx) == 0:
+            continue
+        cols = slice(offsets[k], offsets[k + 1])
+        log_p = _log_softmax(x_flat[idx].dot(w[:, cols]) + b[cols])
+        log_p += log_p_cluster[idx, k][:, np.newaxis]
+        scores[idx[:, np.newaxis], order[cols]] = log_p
+    return scores
+
+
+def affine_sampled_softmax_loss(x, w, b, y, num_sampled, proposal=None,
+                                rng=None):
+    """
+    Computes an affine layer followed by a sampled softmax loss, and its
+    gradients, in one pass.
+
+    Instead of scoring all C classes, each example scores its true class and
+    a set of num_sampled negative classes shared by the minibatch, drawn
+    with replacement from the proposal distribution q. As in Jean et al.,
+    "On Using Very Large Target Vocabulary for Neural Machine Translation",
+    the normalizer of the full softmax is replaced by an importance sampling
+    estimate: the exponentiated score of the true class plus those of the
+    sampled classes, each weighted by 1 / (num_sampled * q[c]). Sampled
+    classes that happen to be the true class of an example are left out of
+    its estimate, so the estimate is unbiased and the loss tends to the full
+    softmax loss as num_sampled grows. Only
+    the columns of w of the true and sampled classes are read, so apart
+    from allocating dw and db the cost does not depend on C.
+
+    Inputs:
+    - x: Input data, of shape (N, d_1, ..., d_k)
+    - w: Weights, of shape (D, C)
+    - b: Biases, of shape (C,)
+    - y: Vector of labels, of shape (N,) where 0 <= y[i] < C
+    - num_sampled: Number of negative classes to sample.
+    - proposal: Array of shape (C,) of sampling probabilities, such as the
+      class frequencies of the training labels; default is uniform.
+    - rng: RandomState used for sampling; default is numpy's global random
+      number generator.
+
+    Returns a tuple of:
+    - loss: Scalar giving the sampled loss
+    - dx: Gradient with respect to x, of shape (N, d1, ..., d_k)
+    - dw: Gradient with respect to w, of shape (D, C); only the columns of
+      the true and sampled classes are nonzero
+    - db: Gradient with respect to b, of shape (C,)
+    """
+    if rng is None:
+        rng = np.random
+    N = x.shape[0]
+    C = w.shape[1]
+    x_flat = x.reshape(N, -1)
+    if proposal is None:
+        sampled = rng.randint(C, size=num_sampled)
+        log_q = np.full(C, np.log(num_sampled / C))
+    else:
+        sampled = rng.choice(C, size=num_sampled, p=proposal)
+        with np.errstate(divide='ignore'):
+            log_q = np.log(num_sampled * np.asarray(proposal, dtype=np.float64))
+
+    # Score the distinct true and sampled classes once
+    classes, index = np.unique(np.concatenate([y, sampled]),
+                               return_inverse=True)
+    index = index.reshape(-1)
+    true_index, sampled_index = index[:N], index[N:]
+    scores = x_flat.dot(w[:, classes]) + b[classes]
+
+    # Column 0 holds the true class, columns 1: the sampled classes
+    rows = np.arange(N)
+    logits = np.empty((N, 1 + num_sampled), dtype=scores.dtype)
+    logits[:, 0] = scores[rows, true_index]
+    logits[:, 1:] = scores[:, sampled_index]
+    logits[:, 1:] -= log_q[sampled].astype(scores.dtype)
+    logits[:, 1:][sampled[np.newaxis, :] == y[:, np.newaxis]] = -np.inf
+    log_p = _log_softmax(logits)
+    loss = -np.sum(log_p[:, 0]) / N
+
+    dlogits = np.exp(log_p)
+    dlogits[:, 0] -= 1
+    dlogits /= N
+    # Gather the gradients of the logits back onto the distinct classes
+    dscores = np.zeros_like(scores)
+    dscores[rows, true_index] = dlogits[:, 0]
+    np.add.at(dscores.T, sampled_index, dlogits[:, 1:].T)
+
+    dx = dscores.dot(w[:, classes].T).reshape(x.shape)
+    dw = np.zeros_like(w)
+    dw[:, classes] = x_flat.T.dot(dscores)
+    db = np.zeros_like(b)
+    db[classes] = np.sum(dscores, axis=0)
+    return loss, dx, dw, db
+
+
 def softmax(x):
     shifted_logits = x - np.max(x, axis=1, keepdims=True)
     Z = np.sum(np.exp(shifted_logits), axis=1, keepdims=True)
@@ -0,0 +1,188 @@
+from __future__ import print_function, division
+from builtins import range
+import copy
+import time
+
+import numpy as np
+
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.classifiers.cnn import ThreeLayerConvNet
+from cs231n.inference import compile_model
+from cs231n.solver import Solver
+
+"""
+Low-rank factorization of affine layers.
+
+A (D, M) weight matrix W is replaced by the factors of its truncated SVD,
+U of shape (D, r) and V of shape (r, M) with W ~= U.dot(V), stored in the
+model's params as W<l>_U and W<l>_V in place of W<l>. A layer then costs
+r * (D + M) multiply-adds per example instead of D * M, a saving whenever r
+is below D * M / (D + M).
+
+FullyConnectedNet (any layer W<l>) and ThreeLayerConvNet (its hidden layer
+W2) compute factored layers as two thin matrix multiplies, x.dot(U) followed
+by the affine layer with weights V, both in loss() and in the plans of
+compile_model, so factored models can be trained further with Solver
+(fine-tuning U and V) and served like any other model.
+
+Example usage:
+
+small = factorize(model, ['W0'], energy=0.9)
+for row in low_rank_report(model, data, 'W0', ranks=[16, 32, 64],
+                           fine_tune=True, solver_kwargs={'num_epochs': 1}):
+    print(row)
+"""
+
+
+def factorable_layers(model):
+    """ Return the names of the weights of model that can be factorized. """
+    if isinstance(model, FullyConnectedNet):
+        return ['W%d' % l for l in range(model.num_layers)]
+    if isinstance(model, ThreeLayerConvNet):
+        return ['W2']
+    raise ValueError('Cannot factorize a model of type %s' %
+                     type(model).__name__)
+
+
+def choose_rank(s, rank=None, energy=None):
+    """
+    Choose the rank of a truncated SVD.
+
+    Inputs:
+    - s: Singular values in decreasing order.
+    - rank: If not None, use this rank (at most len(s)).
+    - energy: If rank is None, use the smallest rank whose singular values
+      hold at least this fraction of the sum of squares of s.
+    """
+    if rank is not None:
+        return max(1, min(rank, len(s)))
+    if energy is None:
+        raise ValueError('Give either a rank or an energy threshold')
+    cumulative = np.cumsum(s.astype(np.float64) ** 2)
+    return int(np.searchsorted(cumulative, energy * cumulative[-1]) + 1)
+
+
+def factorize_layer(model, key, rank=None, energy=None):
+    """
+    Replace the weights model.params[key] by truncated SVD factors, in place.
+    The singular values are split evenly between the factors, so that U and
+    V have similar scales.
+
+    Inputs:
+    - model: A FullyConnectedNet or ThreeLayerConvNet.
+    - key: Name of the weights, one of factorable_layers(model).
+    - rank, energy: Passed to choose_rank.
+
+    Returns:
+    - rank: The rank of the factorization.
+    """
+    if key not in factorable_layers(model):
+        raise ValueError('Cannot factorize %s' % key)
+    w = model.params.pop(key)
+    u, s, vt = np.linalg.svd(w.astype(np.float64), full_matrices=False)
+    r = choose_rank(s, rank, energy)
+    root = np.sqrt(s[:r])
+    model.params[key + '_U'] = (u[:, :r] * root).astype(w.dtype)
+    model.params[key + '_V'] = (root[:, None] * vt[:r]).astype(w.dtype)
+    return r
+
+
+def factorize(model, keys, rank=None, energy=None):
+    """
+    Return a copy of model with the weights named in keys factorized with
+    factorize_layer; rank and energy apply to every layer.
+    """
+    factored = copy.deepcopy(model)
+    for key in keys:
+        factorize_layer(factored, key, rank, energy)
+    return factored
+
+
+def _time_predict(predict_fn, X, batch_size, num_runs):
+    """ Best time over num_runs of predicting X in batches of batch_size. """
+    best = float('inf')
+    for _ in range(num_runs):
+        start = time.perf_counter()
+        for i in range(0, X.shape[0], batch_size):
+            predict_fn(X[i:i + batch_size])
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _evaluate(model, X_val, y_val, batch_size, num_runs):
+    """ Validation accuracy and prediction time of model. """
+    plan = compile_model(model, max_batch_size=batch_size,
+                         input_shape=X_val.shape[1:])
+    accuracy = np.mean(plan.predict_labels(X_val) == y_val)
+    return (float(accuracy),
+            _time_predict(plan.predict, X_val, batch_size, num_runs),
+            _time_predict(model.loss, X_val, batch_size, num_runs))
+
+
+def low_rank_report(model, data, key, ranks, fine_tune=False,
+                    solver_kwargs=None, batch_size=128, num_runs=3,
+                    verbose=True):
+    """
+    Measure the speed / accuracy trade-off of factorizing one layer of a
+    model at several ranks.
+
+    Inputs:
+    - model: A trained FullyConnectedNet or ThreeLayerConvNet.
+    - data: Dictionary with X_val and y_val, and X_train and y_train if
+      fine_tune is true.
+    - key: Name of the weights to factorize.
+    - ranks: List of ranks to try.
+    - fine_tune: If true, fine-tune every factored model with a Solver and
+      also report its accuracy after fine-tuning.
+    - solver_kwargs: Keyword arguments for the Solver.
+    - batch_size: Batch size used for timing predictions.
+    - num_runs: Predictions are timed num_runs times and the best is kept.
+    - verbose: If true, print a table of the results.
+
+    Returns:
+    - rows: List of dictionaries, the first for the original model (with
+      rank None) and then one per rank, with keys 'rank', 'num_params'
+      (parameters of the layer), 'val_acc', 'tuned_val_acc' (None unless
+      fine_tune), 'plan_time' and 'loss_time' (seconds to predict X_val
+      with a compiled plan and with model.loss), and 'speedup' (plan time
+      of the original model over that of the factored one).
+    """
+    X_val, y_val = data['X_val'], data['y_val']
+    w = model.params[key]
+    acc, plan_time, loss_time = _evaluate(model, X_val, y_val, batch_size,
+                                          num_runs)
+    rows = [{'rank': None, 'num_params': w.size, 'val_acc': acc,
+             'tuned_val_acc': None, 'plan_time': plan_time,
+             'loss_time': loss_time, 'speedup': 1.0}]
+    base_time = plan_time
+
+    for rank in ranks:
+        factored = factorize(model, [key], rank=rank)
+        r = factored.params[key + '_U'].shape[1]
+        acc, plan_time, loss_time = _evaluate(factored, X_val, y_val,
+                                              batch_size, num_runs)
+        tuned_acc = None
+        if fine_tune:
+            kwargs = dict(solver_kwargs or {})
+            kwargs.setdefault('verbose', False)
+            solver = Solver(factored, data, **kwargs)
+            solver.train()
+            tuned_acc = float(solver.best_val_acc)
+        rows.append({'rank': r, 'num_params': r * (w.shape[0] + w.shape[1]),
+                     'val_acc': acc, 'tuned_val_acc': tuned_acc,
+                     'plan_time': plan_time, 'loss_time': loss_time,
+                     'speedup': base_time / plan_time})
+
+    if verbose:
+        print('%8s %10s %8s %10s %10s %10s %8s' % (
+              'rank', 'params', 'val_acc', 'tuned_acc', 'plan ms',
+              'loss ms', 'speedup'))
+        for row in rows:
+            print('%8s %10d %8.4f %10s %10.2f %10.2f %8.2f' % (
+                  'full' if row['rank'] is None else row['rank'],
+                  row['num_params'], row['val_acc'],
+                  '-' if row['tuned_val_acc'] is None
+                  else '%.4f' % row['tuned_val_acc'],
+                  1e3 * row['plan_time'], 1e3 * row['loss_time'],
+                  row['speedup']))
+    return rows
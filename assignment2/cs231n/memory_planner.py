@@ -0,0 +1,312 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+
+import numpy as np
+
+from cs231n.layers import *
+
+"""
+Liveness-based memory planning for the forward and backward passes of a
+FullyConnectedNet.
+
+FullyConnectedNet.loss allocates a fresh array for every activation, cache
+and gradient and keeps all of them until it returns. Most of them are dead
+long before that: the input of a ReLU is not needed once the ReLU output
+exists (its output tells which units are active), dropout in test mode
+returns its input, and the gradient flowing into a layer is dead as soon as
+that layer has produced the gradient for the layer below.
+
+plan_buffers takes a list of tensors, each with a size and the steps of the
+schedule at which it is written and last read, and assigns them to a small
+number of shared buffers: tensors whose lifetimes do not overlap share a
+buffer, and a tensor computed in place shares the buffer of its input.
+MemoryPlannedNet wraps a FullyConnectedNet, plans its training and test
+schedules and runs them with the in-place layers of layers.py
+(affine_forward_into, relu_forward_inplace, dropout_forward_inplace, ...)
+writing into views of the shared buffers, which are kept and reused from
+one call to the next.
+
+Sizes are counted per example, so one plan serves every batch size; the
+buffers grow to the largest batch seen. Batch normalization layers allocate
+their own outputs and caches. Returned scores and gradients are always fresh
+arrays.
+
+Example usage:
+
+planned = MemoryPlannedNet(model)
+print(planned.memory_report(batch_size=200))
+solver = Solver(planned, data, ...)
+"""
+
+
+def plan_buffers(tensors):
+    """
+    Assign tensors to shared buffers by liveness.
+
+    Tensors are placed in the order in which they are written. When a tensor
+    is written, every buffer whose tensor was last read at an earlier step is
+    free; the tensor takes the smallest free buffer that is large enough, or
+    else grows the largest free buffer, or else gets a new buffer. A tensor
+    computed in place takes the buffer of its input, which must not be read
+    after that step.
+
+    Inputs:
+    - tensors: List of dictionaries with keys 'name', 'size' (number of
+      elements per example), 'first' (step at which the tensor is written),
+      'last' (last step at which it is read) and, for tensors computed in
+      place, 'inplace_of' (name of the input whose storage they overwrite).
+
+    Returns a tuple of:
+    - assignment: Dictionary from tensor name to buffer index.
+    - sizes: List giving the size of every buffer, in elements per example.
+    """
+    by_name = dict((t['name'], t) for t in tensors)
+    assignment = {}
+    sizes = []
+    owner = []  # Tensor currently held by every buffer
+    for t in sorted(tensors, key=lambda t: t['first']):
+        source = t.get('inplace_of')
+        if source is not None:
+            if by_name[source]['last'] > t['first']:
+                raise ValueError('%s overwrites %s, which is read later' %
+                                 (t['name'], source))
+            slot = assignment[source]
+        else:
+            free = [i for i in range(len(sizes))
+                    if by_name[owner[i]]['last'] < t['first']]
+            fits = [i for i in free if sizes[i] >= t['size']]
+            if fits:
+                slot = min(fits, key=lambda i: sizes[i])
+            elif free:
+                slot = max(free, key=lambda i: sizes[i])
+            else:
+                slot = len(sizes)
+                sizes.append(0)
+                owner.append(None)
+        sizes[slot] = max(sizes[slot], t['size'])
+        owner[slot] = t['name']
+        assignment[t['name']] = slot
+    return assignment, sizes
+
+
+def _schedule(model, train):
+    """
+    List the tensors of the forward (and in training, backward) pass of a
+    FullyConnectedNet as run by MemoryPlannedNet.loss, with their lifetimes.
+
+    Tensors are named a<l> (output of affine layer l), h<l> (output of the
+    ReLU and dropout of layer l, computed in place) and d<l> (gradient with
+    respect to h<l>, on which the dropout and ReLU backward passes run in
+    place). Inputs, batchnorm outputs and the returned scores and weight
+    gradients are not planned.
+    """
+    dims = [model.params['W0'].shape[0]]
+    dims += [model.params['W%d' % l].shape[1] for l in range(model.num_layers)]
+    tensors = {}
+    step = [0]
+
+    def write(name, size, inplace_of=None):
+        tensors[name] = {'name': name, 'size': size, 'first': step[0],
+                         'last': step[0], 'inplace_of': inplace_of}
+
+    def read(name):
+        if name in tensors:
+            tensors[name]['last'] = step[0]
+
+    h = None
+    for l in range(model.num_layers - 1):
+        step[0] += 1
+        read(h)
+        write('a%d' % l, dims[l + 1])
+        h = 'a%d' % l
+        if model.use_batchnorm:
+            # The batchnorm cache keeps its input until the backward pass
+            step[0] += 1
+            read(h)
+            h = None
+        else:
+            step[0] += 1
+            read(h)
+            write('h%d' % l, dims[l + 1], inplace_of=h)
+            h = 'h%d' % l
+
+    step[0] += 1
+    read(h)
+    if train and model.num_layers > 1:
+        write('d%d' % (model.num_layers - 2), dims[model.num_layers - 1])
+        for l in range(model.num_layers - 2, -1, -1):
+            # Dropout and ReLU backward, in place on d<l>, mask from h<l>
+            step[0] += 1
+            read('d%d' % l)
+            read('h%d' % l)
+            if model.use_batchnorm:
+                step[0] += 1
+                read('d%d' % l)
+                read('a%d' % l)
+            # Affine backward: dW from h<l-1>, d<l-1> from d<l>
+            step[0] += 1
+            read('d%d' % l)
+            read('h%d' % (l - 1))
+            if l > 0:
+                write('d%d' % (l - 1), dims[l])
+    return list(tensors.values())
+
+
+class MemoryPlan(object):
+    """
+    Tensors of a schedule, their assignment to shared buffers by
+    plan_buffers, and the buffers themselves.
+    """
+
+    def __init__(self, tensors):
+        self.tensors = tensors
+        self.sizes = dict((t['name'], t['size']) for t in tensors)
+        self.assignment, self.buffer_sizes = plan_buffers(tensors)
+        self._buffers = [None] * len(self.buffer_sizes)
+
+
+    def view(self, name, N, dtype):
+        """
+        Return an (N, size) array for tensor name, a view of its buffer,
+        which is reallocated if it is too small or of another dtype.
+        """
+        slot = self.assignment[name]
+        buf = self._buffers[slot]
+        if buf is None or buf.dtype != dtype or \
+                buf.size < N * self.buffer_sizes[slot]:
+            buf = np.empty(N * self.buffer_sizes[slot], dtype=dtype)
+            self._buffers[slot] = buf
+        size = self.sizes[name]
+        return buf[:N * size].reshape(N, size)
+
+
+    def planned_size(self):
+        """ Elements per example of all the buffers. """
+        return sum(self.buffer_sizes)
+
+
+    def unplanned_size(self):
+        """
+        Elements per example if every tensor had its own array, as in
+        FullyConnectedNet.loss.
+        """
+        return sum(self.sizes.values())
+
+
+class MemoryPlannedNet(object):
+    """
+    Wraps a FullyConnectedNet so that its loss is computed with planned,
+    reused activation and gradient buffers; see the module docstring. The
+    loss and gradients are those of the wrapped model, and its other
+    attributes (params, bn_params, ...) are those of the wrapped model.
+    Like an Augmenter, a MemoryPlannedNet is not thread-safe, since it
+    reuses its buffers.
+    """
+
+    def __init__(self, model):
+        """
+        Inputs:
+        - model: A FullyConnectedNet without low-rank layers, hierarchical
+          or sampled softmax.
+        """
+        if any(k.endswith('_U') for k in model.params) or \
+                getattr(model, 'hierarchy', None) is not None or \
+                getattr(model, 'num_sampled', 0) > 0:
+            raise ValueError('Cannot plan the memory of this model')
+        self.model = model
+        self.plans = {'train': MemoryPlan(_schedule(model, True)),
+                      'test': MemoryPlan(_schedule(model, False))}
+
+
+    def __getattr__(self, name):
+        if name in ('model', 'plans'):
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+
+    @property
+    def params(self):
+        return self.model.params
+
+
+    @params.setter
+    def params(self, params):
+        self.model.params = params
+
+
+    def memory_report(self, batch_size):
+        """
+        Return a dictionary with the bytes of planned and unplanned
+        activation and gradient buffers of a batch of batch_size examples,
+        for the 'train' and 'test' schedules.
+        """
+        itemsize = np.dtype(self.model.dtype).itemsize
+        report = {}
+        for mode, plan in self.plans.items():
+            report[mode] = {
+              'num_tensors': len(plan.tensors),
+              'num_buffers': len(plan.buffer_sizes),
+              'planned_bytes': batch_size * itemsize * plan.planned_size(),
+              'unplanned_bytes': batch_size * itemsize * plan.unplanned_size(),
+            }
+        return report
+
+
+    def loss(self, X, y=None):
+        """
+        Compute loss and gradient like FullyConnectedNet.loss, with the same
+        inputs and outputs.
+        """
+        model = self.model
+        mode = 'test' if y is None else 'train'
+        if model.use_dropout:
+            model.dropout_param['mode'] = mode
+        if model.use_batchnorm:
+            for bn_param in model.bn_params:
+                bn_param['mode'] = mode
+        plan = self.plans[mode]
+        dtype = np.dtype(model.dtype)
+        N = X.shape[0]
+        h = np.asarray(X, dtype=dtype).reshape(N, -1)
+        params = model.params
+        last = model.num_layers - 1
+
+        caches = []
+        for l in range(last):
+            a, affine_cache = affine_forward_into(
+                h, params['W%d' % l], params['b%d' % l],
+                plan.view('a%d' % l, N, dtype))
+            bn_cache = None
+            if model.use_batchnorm:
+                a, bn_cache = batchnorm_forward(
+                    a, params['gamma%d' % l], params['beta%d' % l],
+                    model.bn_params[l])
+            h, relu_cache = relu_forward_inplace(a)
+            dropout_cache = None
+            if model.use_dropout:
+                h, dropout_cache = dropout_forward_inplace(
+                    h, model.dropout_param, after_relu=True)
+            caches.append((affine_cache, bn_cache, relu_cache, dropout_cache))
+
+        if mode == 'test':
+            return affine_forward(h, params['W%d' % last], params['b%d' % last])[0]
+
+        grads = {}
+        dx = plan.view('d%d' % (last - 1), N, dtype) if last > 0 else None
+        loss, dh, grads['W%d' % last], grads['b%d' % last] = affine_softmax_loss(
+            h, params['W%d' % last], params['b%d' % last], y, dx=dx)
+        for l in range(last - 1, -1, -1):
+            affine_cache, bn_cache, relu_cache, dropout_cache = caches[l]
+            if dropout_cache is not None:
+                dh = dropout_backward_inplace(dh, dropout_cache)
+            dh = relu_backward_inplace(dh, relu_cache)
+            if bn_cache is not None:
+                dh, grads['gamma%d' % l], grads['beta%d' % l] = \
+                    batchnorm_backward_alt(dh, bn_cache)
+            w = params['W%d' % l]
+            dx = plan.view('d%d' % (l - 1), N, dtype) if l > 0 else None
+            dh, grads['W%d' % l], grads['b%d' % l] = affine_backward_into(
+                dh, affine_cache, dx, np.empty(w.shape, dtype=dtype),
+                np.empty(w.shape[1], dtype=dtype))
+        return loss, grads
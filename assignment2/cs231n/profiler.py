@@ -0,0 +1,376 @@
+from __future__ import print_function, division
+from builtins import object
+import functools
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+"""
+Opt-in per-layer profiling of models and Solver.
+
+While a Profiler is active, every layer function of the cs231n package (every
+function whose name contains _forward or _backward or ends in _loss, in
+every cs231n module that defines or imports one) is replaced by a wrapper that
+records the wall time of the call, an estimate of the floating point
+operations it performed and the number of bytes of the arrays it returned.
+Because the models call layer functions through their module globals, this
+covers FullyConnectedNet, ThreeLayerConvNet and anything built on layers.py,
+fast_layers.py and layer_utils.py without changing their code. When a Solver
+is given a profiler it also records its data fetches, update rule steps,
+training steps and accuracy checks.
+
+Nothing is patched while no Profiler is active, so there is no overhead at
+all when profiling is disabled. Layer functions imported into other namespaces
+(such as a notebook that ran "from cs231n.layers import *") are not patched.
+
+Events nest: the time of a composite function such as affine_relu_forward
+includes the time of the affine_forward and relu_forward calls it makes.
+Summaries report both the total time and the self time (excluding nested
+events) of every function; FLOPs are only attributed to calls that make no
+nested profiled calls, so that they are not counted twice.
+
+Example usage:
+
+profiler = Profiler()
+solver = Solver(model, data, profiler=profiler, ...)
+solver.train()
+print(profiler.format_summary(epoch=1))
+profiler.export_chrome_trace('trace.json')  # open in chrome://tracing
+"""
+
+
+# Floating point operations per element of the first input of elementwise
+# kernels, matched by name prefix
+_ELEMENTWISE_FLOPS = (
+    ('relu_', 1),
+    ('dropout_', 2),
+    ('batchnorm_forward', 8),
+    ('batchnorm_backward', 12),
+    ('spatial_batchnorm_forward', 8),
+    ('spatial_batchnorm_backward', 12),
+    ('max_pool_', 1),
+    ('svm_loss', 4),
+    ('softmax_loss', 6),
+)
+
+# Floating point operations per parameter of one step of each update rule
+_UPDATE_RULE_FLOPS = {
+    'sgd': 2,
+    'sgd_momentum': 4,
+    'rmsprop': 8,
+    'adam': 14,
+}
+
+
+def _is_layer_function(name):
+    return ('_forward' in name or '_backward' in name or
+            name.endswith('_loss'))
+
+
+def _layer_category(name):
+    if '_forward' in name:
+        return 'forward'
+    if '_backward' in name:
+        return 'backward'
+    return 'loss'
+
+
+def estimate_flops(name, args, out):
+    """
+    Estimate the number of floating point operations performed by a call to
+    the layer function or update rule called name with positional arguments
+    args that returned out. Composite and unknown functions count as 0.
+    """
+    if name in _UPDATE_RULE_FLOPS:
+        return _UPDATE_RULE_FLOPS[name] * args[0].size
+    if name.startswith('affine_forward') or name.startswith('linear_forward'):
+        x, w = args[0], args[1]
+        return 2 * x.shape[0] * w.size
+    if name.startswith('affine_backward') or \
+            name.startswith('linear_backward'):
+        dout, cache = args[0], args[1]
+        return 4 * dout.shape[0] * cache[1].size
+    if name.startswith('conv_forward'):
+        w = args[1]
+        return 2 * out[0].size * (w.size // w.shape[0])
+    if name.startswith('conv_backward'):
+        dout, cache = args[0], args[1]
+        w = cache[1]
+        return 4 * dout.size * (w.size // w.shape[0])
+    if name.startswith('affine_softmax_loss') or \
+            name.startswith('affine_svm_loss'):
+        x, w = args[0], args[1]
+        # Three matrix products plus the loss on the scores
+        return 6 * x.shape[0] * w.size + 6 * x.shape[0] * w.shape[1]
+    for prefix, per_element in _ELEMENTWISE_FLOPS:
+        if name.startswith(prefix) and isinstance(args[0], np.ndarray):
+            return per_element * args[0].size
+    return 0
+
+
+def _output_bytes(out):
+    """
+    Number of bytes of the arrays returned by a call. Arrays nested inside
+    the returned tuple, such as those in a cache, are not counted.
+    """
+    if isinstance(out, np.ndarray):
+        return out.nbytes
+    if isinstance(out, tuple):
+        return sum(v.nbytes for v in out if isinstance(v, np.ndarray))
+    return 0
+
+
+_active_profiler = None
+
+
+class Profiler(object):
+    """
+    Records a timed event for every layer function call, update rule step,
+    data fetch and accuracy check while it is active.
+
+    Every event is a tuple
+    (name, category, phase, epoch, thread, start, duration, self_duration,
+     flops, bytes)
+    where times are in seconds, category is one of 'forward', 'backward',
+    'loss', 'optim', 'data', 'step' and 'eval', and phase is 'eval' for
+    events that happen during an accuracy check and 'train' otherwise.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.epoch = 0
+        self._local = threading.local()
+        self._patched = []
+        self._depth = 0
+        self._t0 = time.perf_counter()
+
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+            self._local.phase = 'train'
+        return stack
+
+
+    def wrap(self, fn, category, name=None, flops_fn=None, phase=None):
+        """
+        Return a wrapper of fn that records an event for every call.
+
+        Inputs:
+        - fn: The function to wrap.
+        - category: Category of the events.
+        - name: Name of the events; defaults to fn.__name__.
+        - flops_fn: If not None, called as flops_fn(args, out) to estimate
+          the FLOPs of a call.
+        - phase: If not None, events nested inside calls of fn are recorded
+          with this phase.
+        """
+        if name is None:
+            name = fn.__name__
+        profiler = self
+        events = self.events
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            stack = profiler._stack()
+            local = profiler._local
+            outer_phase = local.phase
+            if phase is not None:
+                local.phase = phase
+            # [time spent in nested events, whether there were any]
+            frame = [0.0, False]
+            stack.append(frame)
+            start = time.perf_counter()
+            try:
+                out = fn(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                stack.pop()
+                if stack:
+                    stack[-1][0] += duration
+                    stack[-1][1] = True
+                local.phase = outer_phase
+            # Only leaf events are charged FLOPs
+            flops = 0
+            if flops_fn is not None and not frame[1]:
+                flops = flops_fn(args, out)
+            events.append((name, category, phase or outer_phase,
+                           profiler.epoch, threading.current_thread().ident,
+                           start - profiler._t0, duration,
+                           duration - frame[0], flops, _output_bytes(out)))
+            return out
+
+        wrapper._profiled = fn
+        return wrapper
+
+
+    def _wrap_layer(self, name, fn):
+        return self.wrap(fn, _layer_category(name), name,
+                         flops_fn=lambda args, out: estimate_flops(name, args,
+                                                                   out))
+
+
+    def activate(self):
+        """
+        Start recording: patch the layer functions of every imported cs231n
+        module. Calls may be nested; profiling stops after the matching
+        number of calls to deactivate().
+        """
+        global _active_profiler
+        if self._depth > 0:
+            self._depth += 1
+            return
+        if _active_profiler is not None:
+            raise RuntimeError('Another Profiler is already active')
+        _active_profiler = self
+        self._depth = 1
+
+        wrappers = {}
+        for module_name, module in list(sys.modules.items()):
+            if module is None or not (module_name == 'cs231n' or
+                                      module_name.startswith('cs231n.')):
+                continue
+            for name, fn in list(vars(module).items()):
+                if (not _is_layer_function(name) or
+                        not callable(fn) or hasattr(fn, '_profiled') or
+                        not getattr(fn, '__module__', '').startswith('cs231n')):
+                    continue
+                if fn not in wrappers:
+                    wrappers[fn] = self._wrap_layer(name, fn)
+                setattr(module, name, wrappers[fn])
+                self._patched.append((module, name, fn))
+
+        # Accuracy checks may run in a background thread, so mark their
+        # layer calls where they happen
+        from cs231n.evaluation import Evaluator
+        predict = Evaluator.predict
+        Evaluator.predict = self.wrap(predict, 'eval', 'predict',
+                                      phase='eval')
+        self._patched.append((Evaluator, 'predict', predict))
+
+
+    def deactivate(self):
+        """ Stop recording and restore the original layer functions. """
+        global _active_profiler
+        if self._depth == 0:
+            return
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        for owner, name, fn in reversed(self._patched):
+            setattr(owner, name, fn)
+        self._patched = []
+        _active_profiler = None
+
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.deactivate()
+
+
+    def set_epoch(self, epoch):
+        """ Label the events recorded from now on with epoch. """
+        self.epoch = epoch
+
+
+    def update_rule_flops(self, update_rule):
+        """
+        Return a flops_fn for wrapped functions called with a dictionary of
+        gradients, estimating the cost of update_rule on all of them.
+        """
+        per_param = _UPDATE_RULE_FLOPS.get(update_rule.__name__, 0)
+        return lambda args, out: per_param * sum(
+            dw.size for dw in args[0].values())
+
+
+    def summary(self, epoch=None, phase=None):
+        """
+        Aggregate the recorded events by name.
+
+        Inputs:
+        - epoch: If not None, only include events of this epoch.
+        - phase: If not None, only include events of this phase ('train' or
+          'eval').
+
+        Returns:
+        - rows: List of dictionaries, one per (category, name), with keys
+          'name', 'category', 'calls', 'total_time', 'self_time', 'flops',
+          'gflops_per_s' and 'bytes', sorted by decreasing self time.
+        """
+        rows = {}
+        for (name, category, event_phase, event_epoch, _, _, duration,
+             self_duration, flops, nbytes) in self.events:
+            if epoch is not None and event_epoch != epoch:
+                continue
+            if phase is not None and event_phase != phase:
+                continue
+            row = rows.get((category, name))
+            if row is None:
+                row = rows[(category, name)] = {
+                    'name': name, 'category': category, 'calls': 0,
+                    'total_time': 0.0, 'self_time': 0.0, 'flops': 0,
+                    'bytes': 0,
+                }
+            row['calls'] += 1
+            row['total_time'] += duration
+            row['self_time'] += self_duration
+            row['flops'] += flops
+            row['bytes'] += nbytes
+        rows = sorted(rows.values(), key=lambda r: -r['self_time'])
+        for row in rows:
+            row['gflops_per_s'] = (row['flops'] / row['self_time'] / 1e9
+                                   if row['self_time'] > 0 else 0.0)
+        return rows
+
+
+    def format_summary(self, epoch=None, phase=None):
+        """ Return summary(epoch, phase) formatted as a text table. """
+        rows = self.summary(epoch, phase)
+        total_self = sum(r['self_time'] for r in rows) or 1.0
+        lines = ['%-32s %-8s %8s %10s %10s %6s %9s %10s' % (
+                 'name', 'category', 'calls', 'total ms', 'self ms', 'self%',
+                 'GFLOP/s', 'MB out')]
+        for r in rows:
+            lines.append('%-32s %-8s %8d %10.2f %10.2f %5.1f%% %9.2f %10.2f' % (
+                         r['name'], r['category'], r['calls'],
+                         1e3 * r['total_time'], 1e3 * r['self_time'],
+                         100 * r['self_time'] / total_self,
+                         r['gflops_per_s'], r['bytes'] / 2**20))
+        return '\n'.join(lines)
+
+
+    def chrome_trace(self):
+        """
+        Return the recorded events in the Chrome trace event format, which
+        chrome://tracing and Perfetto can display.
+        """
+        trace = []
+        for (name, category, phase, epoch, thread, start, duration, _, flops,
+             nbytes) in self.events:
+            trace.append({
+                'name': name, 'cat': category, 'ph': 'X', 'pid': 0,
+                'tid': thread, 'ts': 1e6 * start, 'dur': 1e6 * duration,
+                'args': {'phase': phase, 'epoch': epoch, 'flops': flops,
+                         'bytes': nbytes},
+            })
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+    def export_chrome_trace(self, filename):
+        """ Write chrome_trace() to filename as JSON. """
+        with open(filename, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+    def reset(self):
+        """ Discard all recorded events. """
+        del self.events[:]
+        self.epoch = 0
@@ -0,0 +1,419 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import copy
+import time
+
+import numpy as np
+import scipy.sparse
+
+from cs231n.classifiers.fc_net import TwoLayerNet, FullyConnectedNet
+from cs231n.classifiers.cnn import ThreeLayerConvNet
+from cs231n.inference import InferencePlan, _Affine, compile_model
+from cs231n.solver import Solver
+
+"""
+Structured and unstructured pruning.
+
+Structured pruning physically removes whole hidden units and convolutional
+filters, so the pruned model is an ordinary, smaller model that is faster
+everywhere. The prunable layers of a model are named by prunable_layers:
+
+- FullyConnectedNet: the hidden layers 0, ..., num_layers - 2;
+- TwoLayerNet: 'hidden';
+- ThreeLayerConvNet: 'conv' (filters) and 'hidden'.
+
+Removing unit j of a layer removes column j of its weights, entry j of its
+bias and of its batchnorm parameters and running averages, and row j of the
+weights of the next layer (for a filter, all the rows of the next layer
+that read from its pooled activations). Units are ranked by unit_scores:
+
+- 'magnitude': the norm of the incoming weights of the unit, or |gamma| if
+  it is followed by batchnorm, times the norm of its outgoing weights;
+- 'activation': the mean activation of the unit on a sample of images times
+  the norm of its outgoing weights, an estimate of how much the unit
+  contributes to the next layer. Dead ReLU units score 0.
+
+Unstructured pruning zeroes the smallest weights of every weight matrix.
+MaskedModel keeps them zero while Solver fine-tunes the rest, and
+sparsify_plan replaces the affine layers of an InferencePlan whose weights
+are sparse enough by CSR matrix multiplies.
+
+Example usage:
+
+model, history = prune_and_fine_tune(model, data, amount=0.5, num_rounds=2,
+                                     solver_kwargs={'num_epochs': 1})
+model, masks = prune_unstructured(model, 0.9, data=data)
+plan = sparsify_plan(compile_model(model))
+"""
+
+
+def prunable_layers(model):
+    """
+    Return a list of (layer, num_units) pairs for the layers of model whose
+    units or filters can be removed.
+    """
+    p = model.params
+    if isinstance(model, FullyConnectedNet):
+        return [(l, p['W%d' % l].shape[1]) for l in range(model.num_layers - 1)]
+    if isinstance(model, TwoLayerNet):
+        return [('hidden', p['W1'].shape[1])]
+    if isinstance(model, ThreeLayerConvNet):
+        return [('conv', p['W1'].shape[0]), ('hidden', p['W2'].shape[1])]
+    raise ValueError('Cannot prune a model of type %s' % type(model).__name__)
+
+
+def _layer_weights(model, layer):
+    """
+    Return the incoming and outgoing weights of the units of layer, as
+    arrays of shape (num_units, fan_in) and (num_units, fan_out).
+    """
+    p = model.params
+    if isinstance(model, FullyConnectedNet):
+        return p['W%d' % layer].T, p['W%d' % (layer + 1)]
+    if isinstance(model, TwoLayerNet):
+        return p['W1'].T, p['W2']
+    if layer == 'conv':
+        F = p['W1'].shape[0]
+        return p['W1'].reshape(F, -1), p['W2'].reshape(F, -1)
+    return p['W2'].T, p['W3']
+
+
+def _mean_activations(model, X):
+    """
+    Return a dictionary mapping every prunable layer of model to the mean
+    activation of each of its units on the images X.
+    """
+    plan = compile_model(model, max_batch_size=X.shape[0],
+                         input_shape=X.shape[1:])
+    activations = plan.activations(X)
+    if isinstance(model, ThreeLayerConvNet):
+        # The pooled conv activations are (H, W, F) rows
+        F = model.params['W1'].shape[0]
+        conv = activations[1].reshape(X.shape[0], -1, F)
+        return {'conv': conv.mean(axis=(0, 1)),
+                'hidden': activations[2].mean(axis=0)}
+    layers = [layer for layer, _ in prunable_layers(model)]
+    return dict((layer, activations[i + 1].mean(axis=0))
+                for i, layer in enumerate(layers))
+
+
+def unit_scores(model, X=None, criterion='activation'):
+    """
+    Score the units of every prunable layer; units with the lowest scores
+    are pruned first.
+
+    Inputs:
+    - model: A FullyConnectedNet, TwoLayerNet or ThreeLayerConvNet.
+    - X: Sample of images, required by the 'activation' criterion.
+    - criterion: 'magnitude' or 'activation'; see the module docstring.
+
+    Returns:
+    - scores: Dictionary mapping every prunable layer to an array with the
+      score of each of its units.
+    """
+    if criterion == 'activation':
+        if X is None:
+            raise ValueError('The activation criterion needs a sample X')
+        activations = _mean_activations(model, X)
+    elif criterion != 'magnitude':
+        raise ValueError('Unknown pruning criterion "%s"' % criterion)
+
+    scores = {}
+    for layer, _ in prunable_layers(model):
+        w_in, w_out = _layer_weights(model, layer)
+        out_norm = np.sqrt(np.sum(np.square(w_out, dtype=np.float64), axis=1))
+        if criterion == 'activation':
+            scores[layer] = np.abs(activations[layer]) * out_norm
+        elif getattr(model, 'use_batchnorm', False):
+            scores[layer] = np.abs(model.params['gamma%d' % layer]) * out_norm
+        else:
+            in_norm = np.sqrt(np.sum(np.square(w_in, dtype=np.float64),
+                                     axis=1))
+            scores[layer] = in_norm * out_norm
+    return scores
+
+
+def remove_units(model, layer, keep):
+    """
+    Physically remove units from a layer of model, in place.
+
+    Inputs:
+    - model: A FullyConnectedNet, TwoLayerNet or ThreeLayerConvNet.
+    - layer: A layer returned by prunable_layers(model).
+    - keep: Sorted integer array with the indices of the units to keep.
+    """
+    p = model.params
+    if isinstance(model, FullyConnectedNet):
+        l = layer
+        p['W%d' % l] = p['W%d' % l][:, keep]
+        p['b%d' % l] = p['b%d' % l][keep]
+        p['W%d' % (l + 1)] = p['W%d' % (l + 1)][keep]
+        if l + 1 == model.num_layers - 1 and 'W_cluster' in p:
+            # The cluster weights of a hierarchical softmax read the same units
+            p['W_cluster'] = p['W_cluster'][keep]
+        if model.use_batchnorm:
+            p['gamma%d' % l] = p['gamma%d' % l][keep]
+            p['beta%d' % l] = p['beta%d' % l][keep]
+            bn_param = model.bn_params[l]
+            for k in ('running_mean', 'running_var'):
+                if k in bn_param:
+                    bn_param[k] = bn_param[k][keep]
+    elif isinstance(model, TwoLayerNet):
+        p['W1'] = p['W1'][:, keep]
+        p['b1'] = p['b1'][keep]
+        p['W2'] = p['W2'][keep]
+    elif layer == 'conv':
+        F, H2 = p['W1'].shape[0], p['W2'].shape[1]
+        p['W1'] = p['W1'][keep]
+        p['b1'] = p['b1'][keep]
+        # Rows of W2 are ordered (F, H, W) like the pooled activations
+        p['W2'] = p['W2'].reshape(F, -1, H2)[keep].reshape(-1, H2)
+    else:
+        p['W2'] = p['W2'][:, keep]
+        p['b2'] = p['b2'][keep]
+        p['W3'] = p['W3'][keep]
+
+
+def prune_structured(model, amount, X=None, criterion='activation',
+                     min_units=1):
+    """
+    Return a copy of model with the lowest scoring units of every prunable
+    layer removed.
+
+    Inputs:
+    - model: A FullyConnectedNet, TwoLayerNet or ThreeLayerConvNet.
+    - amount: Fraction of the units of every layer to remove, or a
+      dictionary mapping layers to fractions; layers missing from it are
+      not pruned.
+    - X: Sample of images for the 'activation' criterion.
+    - criterion: Passed to unit_scores.
+    - min_units: Every layer keeps at least this many units.
+
+    Returns a tuple of:
+    - pruned: The pruned copy of model.
+    - kept: Dictionary mapping every layer to the indices of the units of
+      model that were kept.
+    """
+    scores = unit_scores(model, X, criterion)
+    pruned = copy.deepcopy(model)
+    kept = {}
+    for layer, num_units in prunable_layers(model):
+        fraction = amount.get(layer, 0) if isinstance(amount, dict) \
+            else amount
+        num_keep = max(min_units, int(round(num_units * (1 - fraction))))
+        keep = np.sort(np.argsort(-scores[layer], kind='mergesort')[:num_keep])
+        remove_units(pruned, layer, keep)
+        kept[layer] = keep
+    return pruned, kept
+
+
+def prune_and_fine_tune(model, data, amount, num_rounds=1,
+                        criterion='activation', num_samples=1000,
+                        solver_kwargs=None, seed=0, verbose=True):
+    """
+    Prune a model gradually, fine-tuning it with a Solver after every round.
+
+    Inputs:
+    - model: A FullyConnectedNet, TwoLayerNet or ThreeLayerConvNet.
+    - data: Training and validation data in the format expected by Solver.
+    - amount: Total fraction of the units of every layer to remove; every
+      round removes the same fraction of the units that remain.
+    - num_rounds: Number of prune - fine-tune rounds.
+    - criterion: Passed to unit_scores.
+    - num_samples: Number of training images used for activation
+      statistics.
+    - solver_kwargs: Keyword arguments for the Solver used to fine-tune.
+    - seed: Seed for the sample of training images.
+    - verbose: If true, print the size and accuracy after every round.
+
+    Returns a tuple of:
+    - model: The pruned and fine-tuned model.
+    - history: List with a dictionary for every round, with keys
+      'units' (dictionary of the number of units of every layer),
+      'num_params' and 'val_acc' (best validation accuracy of the
+      fine-tuning run).
+    """
+    solver_kwargs = dict(solver_kwargs or {})
+    solver_kwargs.setdefault('verbose', False)
+    rng = np.random.RandomState(seed)
+    X_train = data['X_train']
+    idx = rng.choice(X_train.shape[0], min(num_samples, X_train.shape[0]),
+                     replace=False)
+    X_sample = X_train[np.sort(idx)]
+    per_round = 1 - (1 - amount) ** (1.0 / num_rounds)
+
+    history = []
+    for r in range(num_rounds):
+        model, _ = prune_structured(model, per_round, X_sample, criterion)
+        solver = Solver(model, data, **solver_kwargs)
+        solver.train()
+        entry = {
+            'units': dict(prunable_layers(model)),
+            'num_params': sum(v.size for v in model.params.values()),
+            'val_acc': solver.best_val_acc,
+        }
+        history.append(entry)
+        if verbose:
+            print('(Round %d / %d) units: %s; params: %d; val_acc: %f' % (
+                  r + 1, num_rounds, entry['units'], entry['num_params'],
+                  entry['val_acc']))
+    return model, history
+
+
+def magnitude_masks(model, sparsity, keys=None):
+    """
+    Return masks keeping the largest weights of every weight matrix.
+
+    Inputs:
+    - model: A model with a params dictionary.
+    - sparsity: Fraction of the entries of every matrix to zero.
+    - keys: Names of the parameters to mask; by default every parameter
+      whose name starts with 'W'.
+
+    Returns:
+    - masks: Dictionary mapping parameter names to boolean arrays that are
+      True for the weights to keep.
+    """
+    if keys is None:
+        keys = [k for k in model.params if k.startswith('W')]
+    masks = {}
+    for k in keys:
+        w = np.abs(model.params[k])
+        num_zero = int(round(sparsity * w.size))
+        mask = np.ones(w.size, dtype=bool)
+        if num_zero > 0:
+            mask[np.argpartition(w.ravel(), num_zero - 1)[:num_zero]] = False
+        masks[k] = mask.reshape(w.shape)
+    return masks
+
+
+class MaskedModel(object):
+    """
+    Wraps a model so that the weights zeroed by masks stay zero during
+    training: their gradients are zeroed, so every update rule in optim.py
+    leaves them at zero. Other attributes are those of the wrapped model.
+    """
+
+    def __init__(self, model, masks):
+        self.model = model
+        self.masks = masks
+        for k, mask in masks.items():
+            model.params[k] = model.params[k] * mask
+
+
+    def __getattr__(self, name):
+        if name in ('model', 'masks'):
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+
+    def loss(self, X, y=None):
+        out = self.model.loss(X, y)
+        if y is None:
+            return out
+        loss, grads = out
+        for k, mask in self.masks.items():
+            grads[k] = grads[k] * mask
+        return loss, grads
+
+
+def prune_unstructured(model, sparsity, data=None, solver_kwargs=None,
+                       keys=None):
+    """
+    Return a copy of model with the smallest weights of every weight matrix
+    zeroed, optionally fine-tuned with the zeros held fixed.
+
+    Inputs:
+    - model: A model with a params dictionary.
+    - sparsity: Fraction of the weights of every matrix to zero.
+    - data: If not None, fine-tune on this data with a Solver.
+    - solver_kwargs: Keyword arguments for the Solver.
+    - keys: Passed to magnitude_masks.
+
+    Returns a tuple of:
+    - pruned: The pruned copy of model.
+    - masks: The masks returned by magnitude_masks.
+    """
+    pruned = copy.deepcopy(model)
+    masks = magnitude_masks(pruned, sparsity, keys)
+    masked = MaskedModel(pruned, masks)
+    if data is not None:
+        solver_kwargs = dict(solver_kwargs or {})
+        solver_kwargs.setdefault('verbose', False)
+        Solver(masked, data, **solver_kwargs).train()
+    return pruned, masks
+
+
+class _SparseAffine(object):
+    """
+    An _Affine layer whose weights are stored as a CSR matrix. The product
+    is computed as w.T.dot(x.T), with the sparse matrix on the left.
+    """
+
+    def __init__(self, op):
+        self.w_t = scipy.sparse.csr_matrix(op.w.T)
+        self.b = op.b
+        self.relu = op.relu
+        self.in_size = op.in_size
+        self.out_size = op.out_size
+        self.work_size = 0
+
+
+    def forward(self, x, out, work):
+        out[...] = self.w_t.dot(x.T).T
+        out += self.b
+        if self.relu:
+            np.maximum(out, 0, out=out)
+
+
+def _time_op(op, x, out, work, num_runs):
+    best = float('inf')
+    for _ in range(num_runs):
+        start = time.perf_counter()
+        op.forward(x, out, work)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def sparsify_plan(plan, min_sparsity='auto', num_runs=5, seed=0):
+    """
+    Replace the affine layers of an InferencePlan by CSR matrix multiplies
+    where that is worthwhile.
+
+    Inputs:
+    - plan: An InferencePlan.
+    - min_sparsity: A layer is converted if the fraction of zeros in its
+      weights is at least this. If 'auto', every layer with any zeros is
+      timed both ways on a random batch of plan.max_batch_size rows and
+      converted if the sparse version is faster.
+    - num_runs: Number of timing runs of each version; the best is kept.
+    - seed: Seed for the random timing batch.
+
+    Returns:
+    - sparse_plan: A new InferencePlan sharing the unchanged ops of plan.
+    """
+    rng = np.random.RandomState(seed)
+    N = plan.max_batch_size
+    ops = []
+    for op in plan.ops:
+        if not isinstance(op, _Affine):
+            ops.append(op)
+            continue
+        sparsity = np.mean(op.w == 0)
+        if min_sparsity == 'auto':
+            if sparsity == 0:
+                ops.append(op)
+                continue
+            sparse_op = _SparseAffine(op)
+            x = rng.randn(N, op.in_size).astype(plan.dtype)
+            out = np.empty((N, op.out_size), dtype=plan.dtype)
+            dense_time = _time_op(op, x, out, None, num_runs)
+            sparse_time = _time_op(sparse_op, x, out, None, num_runs)
+            ops.append(sparse_op if sparse_time < dense_time else op)
+        elif sparsity >= min_sparsity:
+            ops.append(_SparseAffine(op))
+        else:
+            ops.append(op)
+    return InferencePlan(ops, plan.input_shape, plan.input_layout,
+                         plan.num_classes, plan.dtype, plan.max_batch_size)
@@ -0,0 +1,363 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import time
+
+import numpy as np
+
+from cs231n.inference import (InferencePlan, _Affine, _ConvReluPool,
+                              compile_model)
+
+"""
+Post-training int8 quantization of inference plans.
+
+quantize_model compiles a trained FullyConnectedNet, TwoLayerNet or
+ThreeLayerConvNet like compile_model, then quantizes it:
+
+- Weights are quantized symmetrically per output channel: column j of an
+  affine layer (filter j of a convolution) is stored as int8 codes
+  round(w / s_j) in [-127, 127] with s_j = max |w[:, j]| / 127.
+- The input of every layer gets one symmetric scale, calibrated from the
+  activations the float plan computes on a sample of images (such as a
+  sample of X_val): s = percentile(|a|, percentile) / 127.
+- Activations flow between layers as int8 codes. Every layer computes the
+  int32 product of its int8 inputs and int8 weights, then requantizes it
+  with the bias and ReLU folded in:
+      codes_out = clip(round(acc * s_in * s_j / s_out + b_j / s_out))
+  Max pooling commutes with this monotone mapping, so it is done on codes.
+  The last layer dequantizes its accumulator to float scores instead.
+
+numpy has no integer matrix multiply backed by BLAS, so int8 x int8 -> int32
+products are computed with float32 GEMMs on the integer codes. A product of
+two codes is at most 127 * 127 = 16129 in magnitude, so a float32 dot
+product of up to MAX_EXACT_K = 1040 of them stays below 2 ** 24 and is
+exact; longer dot products are split into chunks of MAX_EXACT_K whose exact
+results are summed in int32. Weights are kept as int8 and converted to
+float32 one chunk at a time, so they take a quarter of the memory of float32
+weights; the codes of activations live in the float32 buffers of the plan.
+The speed of a quantized plan is therefore close to that of the float32 plan
+it came from rather than faster, as it would be with true int8 kernels.
+
+Example usage:
+
+plan = quantize_model(model, data['X_val'][:500])
+scores = plan.predict(X)
+print(quantization_report(model, data['X_val'], data['y_val']))
+"""
+
+
+MAX_EXACT_K = 1040
+
+
+def quantize_weights(w):
+    """
+    Quantize the columns of a weight matrix symmetrically to int8.
+
+    Inputs:
+    - w: Array of shape (K, M).
+
+    Returns a tuple of:
+    - w_q: int8 array of shape (K, M).
+    - scales: float32 array of shape (M,) such that w ~= w_q * scales.
+    """
+    scales = np.abs(w).max(axis=0) / 127.0
+    scales[scales == 0] = 1.0
+    w_q = np.clip(np.rint(w / scales), -127, 127).astype(np.int8)
+    return w_q, scales.astype(np.float32)
+
+
+def _int8_gemm(x, w_q, acc, tmp, w_buf):
+    """
+    Compute acc = x.dot(w_q) exactly.
+
+    Inputs:
+    - x: float32 array of shape (N, K) holding int8 codes.
+    - w_q: int8 array of shape (K, M).
+    - acc: int32 array of shape (N, M) receiving the product.
+    - tmp: float32 array of shape (N, M) of scratch space.
+    - w_buf: float32 array of shape (min(K, MAX_EXACT_K), M) of scratch
+      space for the converted weights.
+    """
+    K = w_q.shape[0]
+    for k in range(0, K, MAX_EXACT_K):
+        k_end = min(k + MAX_EXACT_K, K)
+        w_f = w_buf[:k_end - k]
+        w_f[...] = w_q[k:k_end]
+        np.dot(x[:, k:k_end], w_f, out=tmp)
+        if k == 0:
+            acc[...] = tmp
+        else:
+            np.add(acc, tmp, out=acc, casting='unsafe')
+
+
+def int8_matmul(a, b):
+    """
+    Multiply int8 matrices with exact int32 accumulation.
+
+    Inputs:
+    - a: int8 array of shape (N, K).
+    - b: int8 array of shape (K, M).
+
+    Returns:
+    - out: int32 array of shape (N, M) equal to a.dot(b) computed in
+      integers.
+    """
+    N, M = a.shape[0], b.shape[1]
+    acc = np.empty((N, M), dtype=np.int32)
+    _int8_gemm(a.astype(np.float32), b, acc,
+               np.empty((N, M), dtype=np.float32),
+               np.empty((min(b.shape[0], MAX_EXACT_K), M), dtype=np.float32))
+    return acc
+
+
+def _quantize_input(x, scale):
+    """ Replace the float activations x by their int8 codes, in place. """
+    x *= 1.0 / scale
+    np.rint(x, out=x)
+    np.clip(x, -127, 127, out=x)
+
+
+class _Requantizer(object):
+    """
+    Maps int32 accumulators to the int8 codes of the next layer's input, or
+    to float scores if out_scale is None.
+    """
+
+    def __init__(self, w_scales, b, in_scale, out_scale, relu):
+        if out_scale is None:
+            self.multiplier = (in_scale * w_scales).astype(np.float32)
+            self.bias = np.asarray(b, dtype=np.float32)
+        else:
+            self.multiplier = (in_scale * w_scales / out_scale).astype(
+                np.float32)
+            self.bias = (np.asarray(b) / out_scale).astype(np.float32)
+        self.out_scale = out_scale
+        self.lower = 0 if relu else -127
+
+
+    def __call__(self, acc, out):
+        np.multiply(acc, self.multiplier, out=out, casting='unsafe')
+        out += self.bias
+        if self.out_scale is not None:
+            np.rint(out, out=out)
+            np.clip(out, self.lower, 127, out=out)
+        elif self.lower == 0:
+            np.maximum(out, 0, out=out)
+
+
+class _QuantizedAffine(object):
+    """ A quantized _Affine layer; see the module docstring. """
+
+    def __init__(self, op, in_scale, out_scale, quantize_input):
+        self.w_q, w_scales = quantize_weights(op.w)
+        self.requantize = _Requantizer(w_scales, op.b, in_scale, out_scale,
+                                       op.relu)
+        self.in_scale = in_scale
+        self.quantize_input = quantize_input
+        self.in_size = op.in_size
+        self.out_size = op.out_size
+        # int32 accumulator and float32 product of every example
+        self.work_size = 2 * self.out_size
+        self.fixed_work_size = min(self.in_size, MAX_EXACT_K) * self.out_size
+        self.weight_bytes = (self.w_q.nbytes + self.requantize.multiplier.nbytes
+                             + self.requantize.bias.nbytes)
+
+
+    def forward(self, x, out, work):
+        N, M = x.shape[0], self.out_size
+        if self.quantize_input:
+            _quantize_input(x, self.in_scale)
+        acc = work[:N * M].view(np.int32).reshape(N, M)
+        tmp = work[N * M:2 * N * M].reshape(N, M)
+        w_buf = work[work.size - self.fixed_work_size:].reshape(-1, M)
+        _int8_gemm(x, self.w_q, acc, tmp, w_buf)
+        self.requantize(acc, out)
+
+
+class _QuantizedConvReluPool(_ConvReluPool):
+    """ A quantized _ConvReluPool layer; see the module docstring. """
+
+    def __init__(self, op, in_scale, out_scale, quantize_input):
+        # Copy the geometry of op; its float filters are replaced
+        self.__dict__.update(op.__dict__)
+        self.w_q, w_scales = quantize_weights(op.w)
+        del self.w
+        self.requantize = _Requantizer(w_scales, op.b, in_scale, out_scale,
+                                       True)
+        self.in_scale = in_scale
+        self.quantize_input = quantize_input
+        K = self.w_q.shape[0]
+        # The convolution output is followed by its int32 accumulator
+        self.work_size = op.work_size + self.conv_size
+        self.fixed_work_size = min(K, MAX_EXACT_K) * self.F
+        self.weight_bytes = (self.w_q.nbytes + self.requantize.multiplier.nbytes
+                             + self.requantize.bias.nbytes)
+
+
+    def forward(self, x, out, work):
+        N = x.shape[0]
+        if self.quantize_input:
+            _quantize_input(x, self.in_scale)
+        p = self.pad
+        Hp, Wp = self.H + 2 * p, self.W + 2 * p
+        padded = work[:N * self.padded_size].reshape(N, Hp, Wp, self.C)
+        padded.fill(0)
+        padded[:, p:p + self.H, p:p + self.W, :] = x.reshape(
+            N, self.H, self.W, self.C)
+
+        s = self.stride
+        sN, sH, sW, sC = padded.strides
+        patches = np.lib.stride_tricks.as_strided(
+            padded, shape=(N, self.Ho, self.Wo, self.HH, self.WW, self.C),
+            strides=(sN, s * sH, s * sW, sH, sW, sC), writeable=False)
+        start = N * self.padded_size
+        cols = work[start:start + N * self.cols_size].reshape(
+            N, self.Ho, self.Wo, self.HH, self.WW, self.C)
+        cols[...] = patches
+
+        rows = N * self.Ho * self.Wo
+        start = N * (self.padded_size + self.cols_size)
+        conv = work[start:start + rows * self.F].reshape(rows, self.F)
+        start += rows * self.F
+        acc = work[start:start + rows * self.F].view(np.int32).reshape(
+            rows, self.F)
+        w_buf = work[work.size - self.fixed_work_size:].reshape(-1, self.F)
+        _int8_gemm(cols.reshape(rows, -1), self.w_q, acc, conv, w_buf)
+        self.requantize(acc, conv)
+
+        k = self.pool
+        np.max(conv.reshape(N, self.Ho // k, k, self.Wo // k, k, self.F),
+               axis=(2, 4),
+               out=out.reshape(N, self.Ho // k, self.Wo // k, self.F))
+
+
+def _calibration_scale(a, percentile):
+    """ Symmetric int8 scale covering percentile % of the magnitudes of a. """
+    scale = np.percentile(np.abs(a), percentile) / 127.0
+    return float(scale) if scale > 0 else 1.0
+
+
+def quantize_plan(plan, X_calib, percentile=99.99):
+    """
+    Quantize a float32 InferencePlan.
+
+    Inputs:
+    - plan: An InferencePlan made by compile_model with dtype float32.
+    - X_calib: Array of shape (N,) + plan.input_shape of calibration images.
+    - percentile: Percentile of the magnitudes of the calibration
+      activations of every layer that is mapped to the int8 code 127; larger
+      activations are clipped.
+
+    Returns:
+    - qplan: An InferencePlan computing int8 approximations of the scores.
+    """
+    if plan.dtype != np.float32:
+        raise ValueError('Only float32 plans can be quantized')
+    activations = plan.activations(X_calib)
+    scales = [_calibration_scale(a, percentile) for a in activations[:-1]]
+    ops = []
+    for i, op in enumerate(plan.ops):
+        out_scale = scales[i + 1] if i + 1 < len(plan.ops) else None
+        if isinstance(op, _Affine):
+            ops.append(_QuantizedAffine(op, scales[i], out_scale, i == 0))
+        elif isinstance(op, _ConvReluPool):
+            ops.append(_QuantizedConvReluPool(op, scales[i], out_scale,
+                                              i == 0))
+        else:
+            raise ValueError('Cannot quantize op of type %s' %
+                             type(op).__name__)
+    return InferencePlan(ops, plan.input_shape, plan.input_layout,
+                         plan.num_classes, plan.dtype, plan.max_batch_size)
+
+
+def quantize_model(model, X_calib, max_batch_size=128, percentile=99.99,
+                   input_shape=None):
+    """
+    Compile a model with compile_model and quantize it with quantize_plan.
+    """
+    plan = compile_model(model, max_batch_size=max_batch_size,
+                         dtype=np.float32, input_shape=input_shape)
+    return quantize_plan(plan, X_calib, percentile=percentile)
+
+
+def plan_weight_bytes(plan):
+    """ Number of bytes of the weights and biases held by a plan. """
+    total = 0
+    for op in plan.ops:
+        if hasattr(op, 'weight_bytes'):
+            total += op.weight_bytes
+        else:
+            total += op.w.nbytes + op.b.nbytes
+    return total
+
+
+def _time_predict(predict_fn, X, batch_size, num_runs):
+    """ Best time over num_runs of predicting X in batches of batch_size. """
+    best = float('inf')
+    for _ in range(num_runs):
+        start = time.perf_counter()
+        for i in range(0, X.shape[0], batch_size):
+            predict_fn(X[i:i + batch_size])
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def quantization_report(model, X_val, y_val, num_calibration=500,
+                        percentile=99.99, batch_size=128, num_runs=3,
+                        seed=0, input_shape=None):
+    """
+    Quantize a model and compare it with the float model on validation data.
+
+    Inputs:
+    - model: A trained TwoLayerNet, FullyConnectedNet or ThreeLayerConvNet.
+    - X_val, y_val: Validation images and labels.
+    - num_calibration: Number of validation images, sampled at random, used
+      to calibrate the activation scales.
+    - percentile: Passed to quantize_plan.
+    - batch_size: Batch size used to time predictions.
+    - num_runs: Predictions are timed num_runs times and the best is kept.
+    - seed: Seed for the calibration sample.
+    - input_shape: Passed to compile_model.
+
+    Returns a dictionary with keys:
+    - float_accuracy, int8_accuracy, accuracy_delta: Validation accuracy of
+      the float32 plan and of the quantized plan, and their difference.
+    - loss_time, float_time, int8_time: Seconds to predict X_val with
+      model.loss, with the float32 plan and with the quantized plan.
+    - plan_speedup: float_time / int8_time, what quantization itself
+      buys over the float32 plan; below 1 when int8 arithmetic is slower.
+    - speedup_vs_loss: loss_time / int8_time, which also credits the plan
+      compilation of compile_model and not just quantization.
+    - float_weight_bytes, int8_weight_bytes, memory_reduction: Bytes of the
+      weights of the float32 plan and of the quantized plan, and their
+      ratio.
+    """
+    rng = np.random.RandomState(seed)
+    num_calibration = min(num_calibration, X_val.shape[0])
+    X_calib = X_val[rng.choice(X_val.shape[0], num_calibration,
+                               replace=False)]
+    float_plan = compile_model(model, max_batch_size=batch_size,
+                               dtype=np.float32, input_shape=input_shape)
+    int8_plan = quantize_plan(float_plan, X_calib, percentile=percentile)
+
+    float_accuracy = np.mean(float_plan.predict_labels(X_val) == y_val)
+    int8_accuracy = np.mean(int8_plan.predict_labels(X_val) == y_val)
+    loss_time = _time_predict(model.loss, X_val, batch_size, num_runs)
+    float_time = _time_predict(float_plan.predict, X_val, batch_size,
+                               num_runs)
+    int8_time = _time_predict(int8_plan.predict, X_val, batch_size, num_runs)
+    float_bytes = plan_weight_bytes(float_plan)
+    int8_bytes = plan_weight_bytes(int8_plan)
+    return {
+        'float_accuracy': float(float_accuracy),
+        'int8_accuracy': float(int8_accuracy),
+        'accuracy_delta': float(int8_accuracy - float_accuracy),
+        'loss_time': loss_time,
+        'float_time': float_time,
+        'int8_time': int8_time,
+        'plan_speedup': float_time / int8_time,
+        'speedup_vs_loss': loss_time / int8_time,
+        'float_weight_bytes': float_bytes,
+        'int8_weight_bytes': int8_bytes,
+        'memory_reduction': float_bytes / int8_bytes,
+    }
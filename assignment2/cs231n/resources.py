@@ -0,0 +1,352 @@
+from __future__ import print_function, division
+from builtins import range
+import contextlib
+import ctypes
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from six.moves import queue
+
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+"""
+Sharing the cores of the machine between parallel workers.
+
+Every NumPy matrix product runs on a BLAS library (OpenBLAS, MKL, ...) that
+by default starts one thread per core. A single training process benefits
+from that, but several Solvers, hogwild workers or gradient check processes
+running at once each try to use every core, and the machine spends its time
+switching between far more threads than it has cores. This module lets the
+parallel paths of the project divide the cores instead:
+
+- limit_threads(n) is a context manager that sets the number of threads of
+  the BLAS and OpenMP libraries loaded in this process to n and restores it
+  on exit. It uses threadpoolctl if it is installed and otherwise calls the
+  thread control functions of the loaded libraries directly with ctypes. It
+  also sets OMP_NUM_THREADS, OPENBLAS_NUM_THREADS and MKL_NUM_THREADS, which
+  are read by programs started from this process.
+- partition_cores splits the cores this process may run on into one set
+  per worker; govern_worker pins a worker process to its set and limits its
+  threads to match. worker_pool starts a multiprocessing Pool whose workers
+  do this, and hogwild_train, Solver, the parallel gradient checks and the
+  hyperparameter search use it for their workers.
+- tune_threads measures the training throughput of a model for every way of
+  splitting the cores into workers x threads per worker.
+
+Example usage:
+
+with limit_threads(2):
+    solver.train()
+
+results = tune_threads(model, X_batch, y_batch)
+print('Best split: %(num_workers)d workers x %(threads_per_worker)d threads'
+      % results[0])
+"""
+
+
+# Environment variables read by BLAS and OpenMP libraries at startup
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'MKL_NUM_THREADS')
+
+# (library, getter, setter) names of the thread control functions of the
+# libraries NumPy may be linked against. OpenBLAS builds with 64-bit integers
+# (such as the one in NumPy wheels) add a prefix and a suffix to the names.
+_THREAD_API = [
+    ('openblas', prefix + 'openblas_get_num_threads' + suffix,
+     prefix + 'openblas_set_num_threads' + suffix)
+    for prefix in ('', 'scipy_') for suffix in ('', '64_')
+] + [
+    ('mkl', 'MKL_Get_Max_Threads', 'MKL_Set_Num_Threads'),
+    ('blis', 'bli_thread_get_num_threads', 'bli_thread_set_num_threads'),
+    ('openmp', 'omp_get_max_threads', 'omp_set_num_threads'),
+]
+
+
+def available_cores():
+    """ Return the sorted list of the cores this process may run on. """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def _loaded_libraries():
+    """ Paths of the shared libraries mapped into this process (Linux). """
+    paths = []
+    try:
+        with open('/proc/self/maps', 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 6 and '.so' in fields[-1] and \
+                        fields[-1] not in paths:
+                    paths.append(fields[-1])
+    except IOError:
+        pass
+    return paths
+
+
+def _native_controls():
+    """
+    Find the thread control functions of the loaded BLAS and OpenMP
+    libraries.
+
+    Returns:
+    - controls: List of (library, path, get, set) tuples, where get() returns
+      the number of threads and set(n) sets it.
+    """
+    controls = []
+    for path in _loaded_libraries():
+        name = os.path.basename(path).lower()
+        if not any(k in name for k in ('blas', 'mkl', 'blis', 'omp')):
+            continue
+        try:
+            lib = ctypes.CDLL(path)
+        except OSError:
+            continue
+        for library, get_name, set_name in _THREAD_API:
+            get_fn = getattr(lib, get_name, None)
+            set_fn = getattr(lib, set_name, None)
+            if get_fn is not None and set_fn is not None:
+                get_fn.restype = ctypes.c_int
+                set_fn.argtypes = [ctypes.c_int]
+                set_fn.restype = None
+                controls.append((library, path, get_fn, set_fn))
+                break
+    return controls
+
+
+def get_num_threads():
+    """
+    Return a dictionary mapping every loaded BLAS or OpenMP library found
+    ('openblas', 'mkl', 'blis' or 'openmp') to its number of threads.
+    """
+    if threadpoolctl is not None:
+        return dict((info['internal_api'], info['num_threads'])
+                    for info in threadpoolctl.threadpool_info())
+    return dict((library, get_fn())
+                for library, _, get_fn, _ in _native_controls())
+
+
+def set_num_threads(num_threads):
+    """
+    Set the number of threads of every loaded BLAS and OpenMP library, and
+    the environment variables in THREAD_ENV_VARS, to num_threads.
+
+    Returns:
+    - state: The previous settings, to pass to restore_num_threads.
+    """
+    num_threads = max(int(num_threads), 1)
+    env = dict((k, os.environ.get(k)) for k in THREAD_ENV_VARS)
+    for k in THREAD_ENV_VARS:
+        os.environ[k] = str(num_threads)
+    if threadpoolctl is not None:
+        return env, threadpoolctl.threadpool_limits(limits=num_threads)
+    previous = []
+    for _, _, get_fn, set_fn in _native_controls():
+        previous.append((set_fn, get_fn()))
+        set_fn(num_threads)
+    return env, previous
+
+
+def restore_num_threads(state):
+    """ Undo set_num_threads, given the state it returned. """
+    env, previous = state
+    for k, v in env.items():
+        if v is None:
+            os.environ.pop(k, None)
+        else:
+            os.environ[k] = v
+    if threadpoolctl is not None:
+        previous.restore_original_limits()
+    else:
+        for set_fn, num_threads in previous:
+            set_fn(num_threads)
+
+
+@contextlib.contextmanager
+def limit_threads(num_threads):
+    """
+    Context manager that runs its body with num_threads BLAS and OpenMP
+    threads; see set_num_threads. If num_threads is None, nothing is changed.
+    """
+    if num_threads is None:
+        yield
+        return
+    state = set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        restore_num_threads(state)
+
+
+def partition_cores(num_workers, threads_per_worker=None, cores=None):
+    """
+    Split cores between num_workers workers.
+
+    Inputs:
+    - num_workers: Number of workers.
+    - threads_per_worker: Number of cores given to every worker; defaults to
+      an equal share of the cores, and at least one.
+    - cores: List of core ids; defaults to available_cores().
+
+    Returns:
+    - partition: List of num_workers lists of core ids. Workers get disjoint
+      consecutive cores while there are enough of them; after that, cores
+      are handed out again from the first one.
+    """
+    if cores is None:
+        cores = available_cores()
+    if threads_per_worker is None:
+        threads_per_worker = max(len(cores) // num_workers, 1)
+    threads_per_worker = min(threads_per_worker, len(cores))
+    return [[cores[(i * threads_per_worker + j) % len(cores)]
+             for j in range(threads_per_worker)]
+            for i in range(num_workers)]
+
+
+def govern_worker(cores, num_threads=None):
+    """
+    Pin the calling process to cores, where the platform allows it, and
+    limit its BLAS and OpenMP threads to num_threads, by default one per
+    core. Meant to be called first thing in a worker process.
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    set_num_threads(len(cores) if num_threads is None else num_threads)
+
+
+def _init_pool_worker(counter, partition, initializer, initargs):
+    """ Pool initializer: take the next set of cores, then run initializer. """
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    govern_worker(partition[index % len(partition)])
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def worker_pool(num_workers, threads_per_worker=None, initializer=None,
+                initargs=(), context='fork'):
+    """
+    Start a multiprocessing Pool whose workers split the available cores
+    with partition_cores and govern_worker.
+
+    Inputs:
+    - num_workers: Number of worker processes.
+    - threads_per_worker: As for partition_cores.
+    - initializer, initargs: As for multiprocessing.Pool; initializer runs
+      after the worker has been given its cores.
+    - context: Start method of the workers.
+
+    Returns:
+    - pool: A multiprocessing Pool.
+    """
+    ctx = multiprocessing.get_context(context)
+    partition = partition_cores(num_workers, threads_per_worker)
+    counter = ctx.Value('i', 0)
+    return ctx.Pool(num_workers, initializer=_init_pool_worker,
+                    initargs=(counter, partition, initializer, initargs))
+
+
+# State inherited by the forked processes of tune_threads
+_tune_model = None
+_tune_X = None
+_tune_y = None
+
+
+def _tune_worker(cores, num_steps, barrier, times):
+    """
+    Run num_steps training steps of _tune_model and put their start and end
+    times.
+    """
+    govern_worker(cores)
+    _tune_model.loss(_tune_X, _tune_y)  # Warm up
+    barrier.wait()
+    start = time.time()
+    for _ in range(num_steps):
+        _tune_model.loss(_tune_X, _tune_y)
+    times.put((start, time.time()))
+
+
+def tune_threads(model, X, y, num_steps=10, splits=None, cores=None,
+                 verbose=True):
+    """
+    Find the split of the cores into worker processes and threads per
+    worker that trains model fastest.
+
+    For every split, each worker is forked, pinned to its own cores and runs
+    num_steps forward and backward passes of model.loss(X, y) at the same
+    time as the others. Only the loss and gradient are computed, so the
+    result applies to any update rule.
+
+    Inputs:
+    - model: A model conforming to the Solver API.
+    - X, y: A minibatch of data and labels, of the batch size of training.
+    - num_steps: Number of timed steps per worker.
+    - splits: List of (num_workers, threads_per_worker) pairs to try;
+      defaults to every pair whose product is the number of cores.
+    - cores: List of core ids to split; defaults to available_cores().
+    - verbose: If true, print the throughput of every split.
+
+    Returns:
+    - results: List with one dictionary per split, with keys 'num_workers',
+      'threads_per_worker', 'step_time' (median over the workers of the
+      seconds per step) and 'throughput' (examples processed by all workers
+      per second, from the first start to the last finish), sorted from the
+      highest throughput to the lowest.
+    """
+    global _tune_model, _tune_X, _tune_y
+    if cores is None:
+        cores = available_cores()
+    if splits is None:
+        splits = [(w, len(cores) // w) for w in range(1, len(cores) + 1)
+                  if len(cores) % w == 0]
+
+    ctx = multiprocessing.get_context('fork')
+    _tune_model, _tune_X, _tune_y = model, X, y
+    results = []
+    try:
+        for num_workers, threads_per_worker in splits:
+            partition = partition_cores(num_workers, threads_per_worker, cores)
+            barrier = ctx.Barrier(num_workers)
+            times = ctx.Queue()
+            workers = [ctx.Process(target=_tune_worker,
+                                   args=(partition[i], num_steps, barrier,
+                                         times))
+                       for i in range(num_workers)]
+            for p in workers:
+                p.daemon = True
+                p.start()
+            elapsed = []
+            try:
+                while len(elapsed) < num_workers:
+                    try:
+                        elapsed.append(times.get(timeout=1.0))
+                    except queue.Empty:
+                        if any(p.exitcode for p in workers):
+                            raise RuntimeError('A tune_threads worker died')
+            finally:
+                for p in workers:
+                    if p.is_alive():
+                        p.terminate()
+                    p.join()
+            starts, ends = np.array(elapsed).T
+            num_examples = num_workers * num_steps * X.shape[0]
+            wall_time = np.max(ends) - np.min(starts)
+            results.append({
+              'num_workers': num_workers,
+              'threads_per_worker': threads_per_worker,
+              'step_time': float(np.median(ends - starts) / num_steps),
+              'throughput': float(num_examples / wall_time),
+            })
+            if verbose:
+                print('%2d workers x %2d threads: %.1f examples / s' % (
+                       num_workers, threads_per_worker,
+                       results[-1]['throughput']))
+    finally:
+        _tune_model = _tune_X = _tune_y = None
+    return sorted(results, key=lambda r: -r['throughput'])
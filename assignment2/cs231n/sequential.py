@@ -0,0 +1,546 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+
+import numpy as np
+
+from cs231n.layers import *
+from cs231n.fast_layers import *
+
+"""
+A declarative container for feed-forward models built from the layers of
+layers.py and fast_layers.py.
+
+A Sequential model is a list of Layer objects ending with a loss layer.
+Every layer pairs a forward pass with its backward pass, so the model's
+loss() runs the chain generically, with the same params / loss(X, y)
+contract as the hand-written classifiers, and works with Solver unchanged.
+
+Parameters are named like those of FullyConnectedNet: the k-th layer with
+weights (Affine or Conv) owns W<k> and b<k>, and a BatchNorm layer after it
+owns gamma<k> and beta<k>. A Sequential MLP therefore has the same params
+as the equivalent FullyConnectedNet.
+
+A fusion pass (fuse_layers, applied by default) replaces runs of layers
+matching the patterns in FUSION_RULES by fused layers: conv-relu-pool,
+conv-relu, affine-batchnorm-relu, affine-relu, affine-softmax and
+affine-svm. Fused layers compute the same function with fused kernels:
+the ReLU runs in place on the output of the layer before it, and the last
+affine layer and the loss use affine_softmax_loss or affine_svm_loss.
+Fusion keeps the parameter names, so it can be applied to a trained model.
+New fusions are added by appending (pattern, fused_class) to FUSION_RULES.
+
+Example usage:
+
+model = Sequential([Conv(32, 7), ReLU(), MaxPool(2),
+                    Affine(100), BatchNorm(), ReLU(), Dropout(0.5),
+                    Affine(10), SoftmaxLoss()],
+                   input_dim=(3, 32, 32), weight_scale=1e-3, reg=1e-3)
+print(model)
+solver = Solver(model, data, ...)
+"""
+
+
+class Layer(object):
+    """
+    Base class of the layers of a Sequential model.
+
+    Subclasses define param_names, the local names of their parameters, and
+    implement init_params, forward and backward. self.names maps the local
+    names to the names of the parameters in the model's params; it is set
+    by Sequential.
+    """
+    param_names = ()
+    weight_names = ()
+
+    def __init__(self):
+        self.names = {}
+
+
+    def __repr__(self):
+        return type(self).__name__
+
+
+    def init_params(self, input_shape, weight_scale, index):
+        """
+        Initialize the parameters of the layer.
+
+        Inputs:
+        - input_shape: Shape of one input example.
+        - weight_scale: Standard deviation of the random initial weights.
+        - index: Index of the layer among the layers with weights so far;
+          Affine and Conv layers are given the index of the next weights.
+
+        Returns a tuple of:
+        - params: Dictionary from local names to initial values.
+        - output_shape: Shape of one output example.
+        """
+        return {}, input_shape
+
+
+    def forward(self, x, params, mode):
+        """
+        Inputs:
+        - x: Input minibatch
+        - params: Dictionary from local names to parameters
+        - mode: 'train' or 'test'
+
+        Returns a tuple of:
+        - out: Output minibatch
+        - cache: Object to give to the backward pass
+        """
+        raise NotImplementedError
+
+
+    def backward(self, dout, cache):
+        """
+        Returns a tuple of:
+        - dx: Gradient with respect to the input
+        - grads: Dictionary from local names to gradients
+        """
+        raise NotImplementedError
+
+
+class Affine(Layer):
+    """ Affine layer with num_outputs outputs; inputs are flattened. """
+    param_names = ('W', 'b')
+    weight_names = ('W',)
+
+    def __init__(self, num_outputs, weight_scale=None):
+        super(Affine, self).__init__()
+        self.num_outputs = num_outputs
+        self.weight_scale = weight_scale
+
+
+    def init_params(self, input_shape, weight_scale, index):
+        if self.weight_scale is not None:
+            weight_scale = self.weight_scale
+        D = int(np.prod(input_shape))
+        return ({'W': weight_scale * np.random.randn(D, self.num_outputs),
+                 'b': np.zeros(self.num_outputs)}, (self.num_outputs,))
+
+
+    def forward(self, x, params, mode):
+        return affine_forward(x, params['W'], params['b'])
+
+
+    def backward(self, dout, cache):
+        dx, dw, db = affine_backward(dout, cache)
+        return dx, {'W': dw, 'b': db}
+
+
+class Conv(Layer):
+    """
+    Convolutional layer with num_filters filters of size filter_size; the
+    padding defaults to (filter_size - 1) // 2, which preserves the size of
+    the input at stride 1.
+    """
+    param_names = ('W', 'b')
+    weight_names = ('W',)
+
+    def __init__(self, num_filters, filter_size=3, stride=1, pad=None,
+                 weight_scale=None):
+        super(Conv, self).__init__()
+        self.num_filters = num_filters
+        self.filter_size = filter_size
+        if pad is None:
+            pad = (filter_size - 1) // 2
+        self.conv_param = {'stride': stride, 'pad': pad}
+        self.weight_scale = weight_scale
+
+
+    def init_params(self, input_shape, weight_scale, index):
+        if self.weight_scale is not None:
+            weight_scale = self.weight_scale
+        C, H, W = input_shape
+        F, HH = self.num_filters, self.filter_size
+        stride, pad = self.conv_param['stride'], self.conv_param['pad']
+        H_out = (H + 2 * pad - HH) // stride + 1
+        W_out = (W + 2 * pad - HH) // stride + 1
+        return ({'W': weight_scale * np.random.randn(F, C, HH, HH),
+                 'b': np.zeros(F)}, (F, H_out, W_out))
+
+
+    def forward(self, x, params, mode):
+        return conv_forward_fast(x, params['W'], params['b'], self.conv_param)
+
+
+    def backward(self, dout, cache):
+        dx, dw, db = conv_backward_fast(dout, cache)
+        return dx, {'W': dw, 'b': db}
+
+
+class MaxPool(Layer):
+    """ Max pooling over pool_size x pool_size windows. """
+
+    def __init__(self, pool_size=2, stride=None):
+        super(MaxPool, self).__init__()
+        self.pool_param = {'pool_height': pool_size, 'pool_width': pool_size,
+                           'stride': stride or pool_size}
+
+
+    def init_params(self, input_shape, weight_scale, index):
+        C, H, W = input_shape
+        size, stride = self.pool_param['pool_height'], self.pool_param['stride']
+        return {}, (C, (H - size) // stride + 1, (W - size) // stride + 1)
+
+
+    def forward(self, x, params, mode):
+        return max_pool_forward_fast(x, self.pool_param)
+
+
+    def backward(self, dout, cache):
+        return max_pool_backward_fast(dout, cache), {}
+
+
+class ReLU(Layer):
+
+    def forward(self, x, params, mode):
+        return relu_forward(x)
+
+
+    def backward(self, dout, cache):
+        return relu_backward(dout, cache), {}
+
+
+class BatchNorm(Layer):
+    """
+    Batch normalization. For (N, C, H, W) inputs the statistics are those of
+    every channel over the minibatch and all positions, computed with
+    batchnorm_forward on an (N * H * W, C) view. The running averages are
+    kept in self.bn_param.
+    """
+    param_names = ('gamma', 'beta')
+
+    def __init__(self, eps=1e-5, momentum=0.9):
+        super(BatchNorm, self).__init__()
+        self.bn_param = {'mode': 'train', 'eps': eps, 'momentum': momentum}
+
+
+    def init_params(self, input_shape, weight_scale, index):
+        D = input_shape[0]
+        return {'gamma': np.ones(D), 'beta': np.zeros(D)}, input_shape
+
+
+    def forward(self, x, params, mode):
+        self.bn_param['mode'] = mode
+        shape = x.shape
+        if x.ndim == 4:
+            x = x.transpose(0, 2, 3, 1).reshape(-1, shape[1])
+        out, cache = batchnorm_forward(x, params['gamma'], params['beta'],
+                                       self.bn_param)
+        if len(shape) == 4:
+            out = out.reshape(shape[0], shape[2], shape[3], shape[1])
+            out = out.transpose(0, 3, 1, 2)
+        return out, (shape, cache)
+
+
+    def backward(self, dout, cache):
+        shape, cache = cache
+        if dout.ndim == 4:
+            dout = dout.transpose(0, 2, 3, 1).reshape(-1, shape[1])
+        dx, dgamma, dbeta = batchnorm_backward_alt(dout, cache)
+        if len(shape) == 4:
+            dx = dx.reshape(shape[0], shape[2], shape[3], shape[1])
+            dx = dx.transpose(0, 3, 1, 2)
+        return dx, {'gamma': dgamma, 'beta': dbeta}
+
+
+class Dropout(Layer):
+    """ Dropout dropping every unit with probability p. """
+
+    def __init__(self, p, seed=None):
+        super(Dropout, self).__init__()
+        self.dropout_param = {'mode': 'train', 'p': p}
+        if seed is not None:
+            self.dropout_param['seed'] = seed
+
+
+    def forward(self, x, params, mode):
+        self.dropout_param['mode'] = mode
+        return dropout_forward(x, self.dropout_param)
+
+
+    def backward(self, dout, cache):
+        return dropout_backward(dout, cache), {}
+
+
+class SoftmaxLoss(Layer):
+    """
+    Softmax loss. Loss layers end a Sequential model: forward returns the
+    scores at test time and loss(x, y, params) returns the loss, the
+    gradient with respect to x and the gradients of the parameters.
+    """
+
+    def forward(self, x, params, mode):
+        return x, None
+
+
+    def loss(self, x, y, params):
+        loss, dx = softmax_loss(x, y)
+        return loss, dx, {}
+
+
+class SVMLoss(SoftmaxLoss):
+    """ Multiclass SVM loss; see SoftmaxLoss. """
+
+    def loss(self, x, y, params):
+        loss, dx = svm_loss(x, y)
+        return loss, dx, {}
+
+
+class FusedLayer(Layer):
+    """
+    Base class of fused layers, built from the run of layers they replace;
+    their parameters keep the names of the parameters of those layers.
+    """
+
+    def __init__(self, *layers):
+        super(FusedLayer, self).__init__()
+        self.layers = layers
+        for layer in layers:
+            self.names.update(layer.names)
+        self.param_names = tuple(self.names)
+        self.weight_names = tuple(name for layer in layers
+                                  for name in layer.weight_names)
+
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join(repr(l) for l in self.layers))
+
+
+class AffineReLU(FusedLayer):
+    """ Affine - ReLU, with the ReLU in place on the affine output. """
+
+    def forward(self, x, params, mode):
+        a, fc_cache = affine_forward(x, params['W'], params['b'])
+        out, relu_cache = relu_forward_inplace(a)
+        return out, (fc_cache, relu_cache)
+
+
+    def backward(self, dout, cache):
+        fc_cache, relu_cache = cache
+        dx, dw, db = affine_backward(relu_backward_inplace(dout, relu_cache),
+                                     fc_cache)
+        return dx, {'W': dw, 'b': db}
+
+
+class AffineBatchNormReLU(FusedLayer):
+    """ Affine - BatchNorm - ReLU, with the ReLU in place. """
+
+    def forward(self, x, params, mode):
+        bn_param = self.layers[1].bn_param
+        bn_param['mode'] = mode
+        a, fc_cache = affine_forward(x, params['W'], params['b'])
+        a, bn_cache = batchnorm_forward(a, params['gamma'], params['beta'],
+                                        bn_param)
+        out, relu_cache = relu_forward_inplace(a)
+        return out, (fc_cache, bn_cache, relu_cache)
+
+
+    def backward(self, dout, cache):
+        fc_cache, bn_cache, relu_cache = cache
+        da, dgamma, dbeta = batchnorm_backward_alt(
+            relu_backward_inplace(dout, relu_cache), bn_cache)
+        dx, dw, db = affine_backward(da, fc_cache)
+        return dx, {'W': dw, 'b': db, 'gamma': dgamma, 'beta': dbeta}
+
+
+class ConvReLU(FusedLayer):
+    """ Conv - ReLU, with the ReLU in place on the convolution output. """
+
+    def forward(self, x, params, mode):
+        a, conv_cache = conv_forward_fast(x, params['W'], params['b'],
+                                          self.layers[0].conv_param)
+        out, relu_cache = relu_forward_inplace(a)
+        return out, (conv_cache, relu_cache)
+
+
+    def backward(self, dout, cache):
+        conv_cache, relu_cache = cache
+        dx, dw, db = conv_backward_fast(relu_backward_inplace(dout, relu_cache),
+                                        conv_cache)
+        return dx, {'W': dw, 'b': db}
+
+
+class ConvReLUPool(FusedLayer):
+    """ Conv - ReLU - MaxPool, with the ReLU in place. """
+
+    def forward(self, x, params, mode):
+        a, conv_cache = conv_forward_fast(x, params['W'], params['b'],
+                                          self.layers[0].conv_param)
+        s, relu_cache = relu_forward_inplace(a)
+        out, pool_cache = max_pool_forward_fast(s, self.layers[2].pool_param)
+        return out, (conv_cache, relu_cache, pool_cache)
+
+
+    def backward(self, dout, cache):
+        conv_cache, relu_cache, pool_cache = cache
+        ds = max_pool_backward_fast(dout, pool_cache)
+        dx, dw, db = conv_backward_fast(relu_backward_inplace(ds, relu_cache),
+                                        conv_cache)
+        return dx, {'W': dw, 'b': db}
+
+
+class AffineSoftmaxLoss(FusedLayer):
+    """ Affine - SoftmaxLoss, with the loss computed by affine_softmax_loss. """
+    loss_function = staticmethod(affine_softmax_loss)
+
+    def forward(self, x, params, mode):
+        return affine_forward(x, params['W'], params['b'])[0], None
+
+
+    def loss(self, x, y, params):
+        loss, dx, dw, db = self.loss_function(x, params['W'], params['b'], y)
+        return loss, dx, {'W': dw, 'b': db}
+
+
+class AffineSVMLoss(AffineSoftmaxLoss):
+    """ Affine - SVMLoss, with the loss computed by affine_svm_loss. """
+    loss_function = staticmethod(affine_svm_loss)
+
+
+# Fusion rules applied by fuse_layers, in order of priority: a run of layers
+# of exactly the classes of a pattern is replaced by fused_class(*run).
+FUSION_RULES = [
+    ((Conv, ReLU, MaxPool), ConvReLUPool),
+    ((Affine, BatchNorm, ReLU), AffineBatchNormReLU),
+    ((Conv, ReLU), ConvReLU),
+    ((Affine, ReLU), AffineReLU),
+    ((Affine, SoftmaxLoss), AffineSoftmaxLoss),
+    ((Affine, SVMLoss), AffineSVMLoss),
+]
+
+
+def fuse_layers(layers, rules=None):
+    """
+    Replace the runs of layers matching a fusion rule by fused layers.
+
+    Inputs:
+    - layers: List of layers.
+    - rules: List of (pattern, fused_class) pairs; defaults to FUSION_RULES.
+
+    Returns:
+    - fused: New list of layers.
+    """
+    if rules is None:
+        rules = FUSION_RULES
+    fused = []
+    i = 0
+    while i < len(layers):
+        for pattern, fused_class in rules:
+            run = layers[i:i + len(pattern)]
+            if len(run) == len(pattern) and \
+                    all(type(l) is cls for l, cls in zip(run, pattern)):
+                fused.append(fused_class(*run))
+                i += len(pattern)
+                break
+        else:
+            fused.append(layers[i])
+            i += 1
+    return fused
+
+
+class Sequential(object):
+    """
+    A model made of a list of layers ending with a loss layer, with the same
+    params / loss(X, y) contract as the other classifiers; see the module
+    docstring.
+    """
+
+    def __init__(self, layers, input_dim=3*32*32, weight_scale=1e-2, reg=0.0,
+                 dtype=np.float32, fuse=True):
+        """
+        Initialize a new Sequential model.
+
+        Inputs:
+        - layers: List of Layer objects; the last one must be a loss layer
+          (SoftmaxLoss or SVMLoss).
+        - input_dim: Integer or tuple giving the shape of one input example.
+        - weight_scale: Standard deviation of the random initial weights of
+          layers that do not set their own.
+        - reg: Scalar giving L2 regularization strength of the weights.
+        - dtype: A numpy datatype object; all computations will be performed
+          using this datatype.
+        - fuse: Whether to apply fuse_layers.
+        """
+        if not hasattr(layers[-1], 'loss'):
+            raise ValueError('The last layer must be a loss layer')
+        self.reg = reg
+        self.dtype = dtype
+        self.params = {}
+
+        shape = input_dim if isinstance(input_dim, tuple) else (input_dim,)
+        index = -1
+        for layer in layers:
+            if layer.weight_names:
+                index += 1
+            params, shape = layer.init_params(shape, weight_scale, index)
+            layer.names = dict((name, '%s%d' % (name, index))
+                               for name in layer.param_names)
+            for name, value in params.items():
+                self.params[layer.names[name]] = value.astype(dtype)
+        self.layers = list(layers)
+        if fuse:
+            self.fuse()
+
+
+    def __repr__(self):
+        return 'Sequential(%s)' % ', '.join(repr(l) for l in self.layers)
+
+
+    def fuse(self, rules=None):
+        """ Apply fuse_layers to the layers of the model; returns self. """
+        self.layers = fuse_layers(self.layers, rules)
+        return self
+
+
+    @property
+    def bn_params(self):
+        """ The bn_param dictionaries of the batch normalization layers. """
+        bn_params = []
+        for layer in self.layers:
+            for l in getattr(layer, 'layers', [layer]):
+                if isinstance(l, BatchNorm):
+                    bn_params.append(l.bn_param)
+        return bn_params
+
+
+    def loss(self, X, y=None):
+        """
+        Compute loss and gradient for a minibatch of data.
+
+        Input / output: Same API as TwoLayerNet in fc_net.py.
+        """
+        X = X.astype(self.dtype)
+        mode = 'test' if y is None else 'train'
+
+        caches = []
+        out = X
+        for layer in self.layers:
+            params = dict((name, self.params[key])
+                          for name, key in layer.names.items())
+            if layer is self.layers[-1]:
+                if mode == 'test':
+                    return layer.forward(out, params, mode)[0]
+                loss, dout, local_grads = layer.loss(out, y, params)
+            else:
+                out, cache = layer.forward(out, params, mode)
+                caches.append(cache)
+
+        grads = {}
+        for name, grad in local_grads.items():
+            grads[self.layers[-1].names[name]] = grad
+        for layer, cache in zip(self.layers[-2::-1], caches[::-1]):
+            dout, local_grads = layer.backward(dout, cache)
+            for name, grad in local_grads.items():
+                grads[layer.names[name]] = grad
+
+        for layer in self.layers:
+            for name in layer.weight_names:
+                key = layer.names[name]
+                W = self.params[key]
+                loss += 0.5 * self.reg * np.sum(W ** 2)
+                grads[key] += self.reg * W
+        return loss, grads
@@ -0,0 +1,497 @@
+from __future__ import print_function, division
+from future import standard_library
+standard_library.install_aliases()
+from builtins import range
+from builtins import object
+import collections
+import io
+import json
+import os
+import socket
+import stat
+import threading
+import time
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+import numpy as np
+from six.moves import queue
+
+"""
+A local inference server with dynamic batching.
+
+Classifying one example at a time wastes most of the speed of the matrix
+multiplies in a forward pass. A DynamicBatcher collects the requests that
+arrive concurrently into micro-batches: a batch is run as soon as it holds
+max_batch_size examples, or max_latency seconds after its first request
+arrived, whichever comes first. Every request then gets back the rows of the
+scores that belong to it.
+
+InferenceServer puts a DynamicBatcher behind a small threaded HTTP server
+listening on localhost or on a Unix socket:
+
+POST /predict   body: an .npy array of shape (N, d_1, ..., d_k)
+                (Content-Type application/x-npy) or JSON {"inputs": [...]};
+                answers with scores in the same format
+GET /metrics    JSON with request, batch, queueing and latency statistics
+GET /health     200 OK
+
+Example usage:
+
+server = InferenceServer(compile_model(model), max_batch_size=64,
+                         max_latency=0.005)
+server.start()
+client = InferenceClient(server.address)
+scores = client.predict(X)
+print(client.metrics())
+server.stop()
+
+Running python -m cs231n.serving starts a server for a random model, sends
+it concurrent requests from several client threads and prints the metrics.
+"""
+
+
+# Queued by DynamicBatcher.close to stop the batching thread
+_STOP = object()
+
+
+class _Request(object):
+
+    def __init__(self, X):
+        self.X = X
+        self.scores = None
+        self.error = None
+        self.arrival = time.monotonic()
+        self.done = threading.Event()
+
+
+    def result(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise RuntimeError('Timed out waiting for the inference result')
+        if self.error is not None:
+            raise self.error
+        return self.scores
+
+
+class DynamicBatcher(object):
+    """
+    Coalesces concurrent prediction requests into micro-batches that are run
+    by a single background thread.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_latency=0.005,
+                 history_size=10000):
+        """
+        Inputs:
+        - predict_fn: Function mapping an array X of shape (N, ...) to scores
+          of shape (N, C), such as model.loss or InferencePlan.predict. It is
+          only ever called from the batching thread.
+        - max_batch_size: Largest number of examples in a batch. A single
+          request with more examples is run as a batch of its own.
+        - max_latency: Longest time in seconds a request waits for other
+          requests to join its batch.
+        - history_size: Number of recent requests and batches kept for the
+          latency and batch size statistics.
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        self._pending = None
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()
+        self._latencies = collections.deque(maxlen=history_size)
+        self._queue_waits = collections.deque(maxlen=history_size)
+        self._batch_sizes = collections.deque(maxlen=history_size)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def submit(self, X):
+        """ Queue X for prediction; returns a request with a result method. """
+        request = _Request(X)
+        self._queue.put(request)
+        return request
+
+
+    def predict(self, X, timeout=None):
+        """ Predict the scores of X, blocking until they are ready. """
+        return self.submit(X).result(timeout)
+
+
+    def _next_batch(self):
+        """
+        Wait for a request, then collect more until the batch is full or the
+        first request has waited max_latency seconds.
+        """
+        if self._pending is not None:
+            first = self._pending
+        else:
+            first = self._queue.get()
+        self._pending = None
+        if first is _STOP:
+            return None
+        batch = [first]
+        size = first.X.shape[0]
+        deadline = first.arrival + self.max_latency
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    request = self._queue.get(timeout=timeout)
+                else:
+                    request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP or size + request.X.shape[0] > \
+                    self.max_batch_size:
+                # Start the next batch with it, or stop after this batch
+                self._pending = request
+                break
+            batch.append(request)
+            size += request.X.shape[0]
+        return batch
+
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            start = time.monotonic()
+            try:
+                if len(batch) == 1:
+                    scores = self.predict_fn(batch[0].X)
+                else:
+                    scores = self.predict_fn(
+                        np.concatenate([r.X for r in batch]))
+                offset = 0
+                for r in batch:
+                    n = r.X.shape[0]
+                    r.scores = scores[offset:offset + n]
+                    offset += n
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0].error = e
+                else:
+                    # Run the requests one by one so that a malformed
+                    # request only fails itself
+                    for r in batch:
+                        try:
+                            r.scores = self.predict_fn(r.X)
+                        except Exception as e:
+                            r.error = e
+            end = time.monotonic()
+
+            with self._lock:
+                self._counts['batches'] += 1
+                self._counts['requests'] += len(batch)
+                self._counts['examples'] += sum(r.X.shape[0] for r in batch)
+                self._counts['errors'] += sum(r.error is not None
+                                              for r in batch)
+                self._batch_sizes.append(sum(r.X.shape[0] for r in batch))
+                for r in batch:
+                    self._queue_waits.append(start - r.arrival)
+                    self._latencies.append(end - r.arrival)
+            for r in batch:
+                r.done.set()
+
+
+    def metrics(self):
+        """
+        Return a dictionary of statistics: counts of requests, batches,
+        examples and errors, the current queue depth, the mean batch size,
+        and percentiles (in milliseconds) of the time requests spent queued
+        and of their end-to-end latency, over the recent history.
+        """
+        def percentiles(values):
+            if not values:
+                return {}
+            values = 1e3 * np.array(values)
+            return dict(('p%d' % q, float(np.percentile(values, q)))
+                        for q in (50, 90, 99))
+
+        with self._lock:
+            batch_sizes = list(self._batch_sizes)
+            metrics = {
+                'requests': self._counts['requests'],
+                'batches': self._counts['batches'],
+                'examples': self._counts['examples'],
+                'errors': self._counts['errors'],
+                'queue_depth': self._queue.qsize(),
+                'mean_batch_size': float(np.mean(batch_sizes))
+                                   if batch_sizes else 0.0,
+                'max_batch_size': self.max_batch_size,
+                'max_latency_ms': 1e3 * self.max_latency,
+                'queue_wait_ms': percentiles(list(self._queue_waits)),
+                'latency_ms': percentiles(list(self._latencies)),
+            }
+        return metrics
+
+
+    def close(self):
+        """ Finish the queued requests and stop the batching thread. """
+        self._queue.put(_STOP)
+        self._thread.join()
+
+
+def _encode_array(x):
+    f = io.BytesIO()
+    np.save(f, x, allow_pickle=False)
+    return f.getvalue()
+
+
+def _decode_array(data):
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _send_json(self, code, value):
+        self._send(code, json.dumps(value).encode('utf-8'), 'application/json')
+
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.server.batcher.metrics())
+        elif self.path == '/health':
+            self._send(200, b'OK', 'text/plain')
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        npy = self.headers.get('Content-Type') == 'application/x-npy'
+        try:
+            if npy:
+                X = _decode_array(body)
+            else:
+                X = np.array(json.loads(body.decode('utf-8'))['inputs'])
+            if X.shape[1:] != self.server.input_shape and \
+                    self.server.input_shape is not None:
+                raise ValueError('Expected inputs of shape %s, got %s' % (
+                                 self.server.input_shape, X.shape[1:]))
+            X = X.astype(self.server.dtype, copy=False)
+        except Exception as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            scores = self.server.batcher.predict(X)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        if npy:
+            self._send(200, _encode_array(scores), 'application/x-npy')
+        else:
+            self._send_json(200, {'scores': scores.tolist()})
+
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class InferenceServer(object):
+    """
+    Serve a model over HTTP on localhost or a Unix socket, batching
+    concurrent requests with a DynamicBatcher.
+    """
+
+    def __init__(self, model, address=('127.0.0.1', 0), max_batch_size=64,
+                 max_latency=0.005, input_shape=None, dtype=np.float32,
+                 verbose=False):
+        """
+        Inputs:
+        - model: Either an object with a predict(X) method returning scores,
+          such as an InferencePlan, or a model conforming to the Solver API,
+          whose loss(X) is used.
+        - address: (host, port) to listen on, where port 0 picks a free port,
+          or the path of a Unix socket. An existing socket at that path is
+          replaced; any other existing file raises a ValueError.
+        - max_batch_size, max_latency: Batching policy; see DynamicBatcher.
+        - input_shape: If not None, reject requests whose examples do not
+          have this shape.
+        - dtype: Inputs are converted to this dtype.
+        - verbose: If true, log every HTTP request.
+        """
+        if not isinstance(address, tuple) and os.path.exists(address):
+            # Replace a socket left behind by an earlier server, but never
+            # delete anything else
+            if not stat.S_ISSOCK(os.stat(address).st_mode):
+                raise ValueError('"%s" exists and is not a socket' % address)
+            os.remove(address)
+        predict_fn = model.predict if hasattr(model, 'predict') else model.loss
+        self.batcher = DynamicBatcher(predict_fn, max_batch_size=max_batch_size,
+                                      max_latency=max_latency)
+        if isinstance(address, tuple):
+            self._server = _ThreadingHTTPServer(address, _Handler)
+        else:
+            self._server = _ThreadingUnixHTTPServer(address, _Handler)
+        self._server.batcher = self.batcher
+        self._server.input_shape = None if input_shape is None else \
+            tuple(input_shape)
+        self._server.dtype = dtype
+        self._server.verbose = verbose
+        self.address = self._server.server_address
+        self._thread = None
+
+
+    def start(self):
+        """ Start serving in a background thread. """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        """ Stop serving and shut down the batcher. """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self.batcher.close()
+        if not isinstance(self.address, tuple) and \
+                os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class _UnixHTTPConnection(HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class InferenceClient(object):
+    """
+    A client for InferenceServer. Each client keeps one connection open, so
+    use one client per thread.
+    """
+
+    def __init__(self, address, timeout=60.0):
+        """
+        Inputs:
+        - address: The server's address: a (host, port) tuple or the path of
+          a Unix socket.
+        - timeout: Socket timeout in seconds.
+        """
+        if isinstance(address, tuple):
+            self._conn = HTTPConnection(address[0], address[1],
+                                        timeout=timeout)
+        else:
+            self._conn = _UnixHTTPConnection(address, timeout=timeout)
+
+
+    def _request(self, method, path, body=None, headers=None):
+        self._conn.request(method, path, body=body, headers=headers or {})
+        response = self._conn.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise RuntimeError('Server returned %d: %s' % (
+                               response.status, data.decode('utf-8')))
+        return data
+
+
+    def predict(self, X):
+        """ Return the scores the server computes for X. """
+        data = self._request('POST', '/predict', _encode_array(X),
+                             {'Content-Type': 'application/x-npy'})
+        return _decode_array(data)
+
+
+    def metrics(self):
+        return json.loads(self._request('GET', '/metrics').decode('utf-8'))
+
+
+    def close(self):
+        self._conn.close()
+
+
+def _demo(num_clients=8, requests_per_client=50):
+    """
+    Serve a random FullyConnectedNet, send it single-example requests from
+    num_clients threads and print the metrics.
+    """
+    from cs231n.classifiers.fc_net import FullyConnectedNet
+    from cs231n.inference import compile_model
+
+    model = FullyConnectedNet([512, 256], input_dim=3 * 32 * 32,
+                              num_classes=10)
+    server = InferenceServer(compile_model(model), input_shape=(3, 32, 32))
+    server.start()
+    rng = np.random.RandomState(0)
+    X = rng.randn(requests_per_client, 1, 3, 32, 32).astype(np.float32)
+
+    def client_thread():
+        client = InferenceClient(server.address)
+        for i in range(requests_per_client):
+            client.predict(X[i])
+        client.close()
+
+    threads = [threading.Thread(target=client_thread)
+               for _ in range(num_clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    metrics = InferenceClient(server.address).metrics()
+    server.stop()
+    print('%d requests in %.2f s (%.0f requests/s)' % (
+          metrics['requests'], elapsed, metrics['requests'] / elapsed))
+    print(json.dumps(metrics, indent=2, sort_keys=True))
+
+    # Closing a batcher while a batch is still forming must run that batch
+    # and return
+    batcher = DynamicBatcher(lambda X: X * 2, max_latency=0.5)
+    request = batcher.submit(np.ones((1, 3)))
+    closer = threading.Thread(target=batcher.close)
+    closer.daemon = True
+    closer.start()
+    closer.join(timeout=5.0)
+    if closer.is_alive() or not request.done.is_set() or \
+            not np.array_equal(request.scores, 2 * np.ones((1, 3))):
+        raise RuntimeError('Closing a batcher while batching failed')
+    print('Close while batching: OK')
+
+
+if __name__ == '__main__':
+    _demo()
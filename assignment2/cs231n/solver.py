@@ -5,10 +5,16 @@ from builtins import range
 from builtins import object
 import os
 import pickle as pickle
+import threading
 
 import numpy as np
 
 from cs231n import optim
+from cs231n import hogwild
+from cs231n import resources
+from cs231n.evaluation import Evaluator, BackgroundEvaluator
+from cs231n.checkpoint import CheckpointWriter, latest_checkpoint, \
+    load_checkpoint
 
 
 class Solver(object):
@@ -52,6 +58,10 @@ class Solver(object):
                     print_every=100)
     solver.train()
 
+    Training that was interrupted can be continued from a checkpoint by
+    constructing a Solver with the same arguments, calling
+    solver.resume(checkpoint) and then solver.train().
+
 
     A Solver works on a model object that must conform to the following API:
 
@@ -98,6 +108,9 @@ class Solver(object):
           passed to the chosen update rule. Each update rule requires different
           hyperparameters (see optim.py) but all update rules require a
           'learning_rate' parameter so that should always be present.
+          Hyperparameters given as sequences hold one value per replica of
+          a stacked model (see StackedFullyConnectedNet) and are broadcast
+          along the first axis of every parameter.
         - lr_decay: A scalar for learning rate decay; after each epoch the
           learning rate is multiplied by this value.
         - batch_size: Size of minibatches used to compute loss and gradient
@@ -111,8 +124,45 @@ class Solver(object):
           accuracy; default is 1000; set to None to use entire training set.
         - num_val_samples: Number of validation samples to use to check val
           accuracy; default is None, which uses the entire validation set.
+          The training and validation subsets are drawn once and reused for
+          every accuracy check.
+        - eval_batch_size: Batch size used to check accuracy; default is None,
+          which picks the largest batch that fits in eval_memory_budget.
+        - eval_memory_budget: Memory budget in bytes for a single test-time
+          forward pass when checking accuracy; default is 256MB.
+        - async_eval: Boolean; if set to true then accuracy is checked in a
+          background thread on a snapshot of the model so that training does
+          not wait for it. The accuracy histories then lag training by up to
+          one check, and train() waits for the last check before returning.
         - checkpoint_name: If not None, then save model checkpoints here every
           epoch.
+        - checkpoint_format: 'npy' (default) writes each checkpoint in a
+          background thread as a directory of .npy arrays (see checkpoint.py);
+          'pickle' synchronously pickles the whole model into a single file.
+        - num_workers: Number of processes to train with. If greater than 1,
+          train with lock-free asynchronous SGD (Hogwild): the workers share
+          model.params in shared memory and apply their updates without any
+          synchronization except at epoch boundaries, where training and
+          validation accuracy are checked. Each worker keeps its own update
+          rule state. Default is 1, which trains synchronously. The update
+          rule state and loss history of the workers never reach this
+          process while they train, so resumable ('npy') checkpoints are
+          not supported with num_workers > 1; use checkpoint_format='pickle'
+          to save model snapshots instead.
+        - num_threads: Number of BLAS threads to train with (see
+          resources.py). With num_workers > 1 this is the number of cores and
+          threads of every worker, which defaults to an equal share of the
+          available cores; otherwise the default None leaves the number of
+          threads of the process as it is.
+        - augment: If not None, a function applied to every training
+          minibatch X_batch before it is passed to the model, such as an
+          Augmenter (see augmentation.py). Accuracy checks are done on the
+          unaugmented data.
+        - profiler: If not None, a Profiler (see profiler.py) that is active
+          during train() and records every layer call, data fetch, update rule
+          step and accuracy check, labelled by epoch. Only this process is
+          profiled, so with num_workers > 1 the steps of the workers are not
+          recorded.
         """
         self.model = model
         self.X_train = data['X_train']
@@ -128,10 +178,18 @@ class Solver(object):
         self.num_epochs = kwargs.pop('num_epochs', 10)
         self.num_train_samples = kwargs.pop('num_train_samples', 1000)
         self.num_val_samples = kwargs.pop('num_val_samples', None)
+        self.eval_batch_size = kwargs.pop('eval_batch_size', None)
+        self.eval_memory_budget = kwargs.pop('eval_memory_budget', 256 * 2**20)
+        self.async_eval = kwargs.pop('async_eval', False)
 
         self.checkpoint_name = kwargs.pop('checkpoint_name', None)
+        self.checkpoint_format = kwargs.pop('checkpoint_format', 'npy')
         self.print_every = kwargs.pop('print_every', 10)
         self.verbose = kwargs.pop('verbose', True)
+        self.num_workers = kwargs.pop('num_workers', 1)
+        self.num_threads = kwargs.pop('num_threads', None)
+        self.profiler = kwargs.pop('profiler', None)
+        self.augment = kwargs.pop('augment', None)
 
         # Throw an error if there are extra keyword arguments
         if len(kwargs) > 0:
@@ -144,6 +202,16 @@ class Solver(object):
             raise ValueError('Invalid update_rule "%s"' % self.update_rule)
         self.update_rule = getattr(optim, self.update_rule)
 
+        if self.checkpoint_format not in ('npy', 'pickle'):
+            raise ValueError('Invalid checkpoint_format "%s"' %
+                             self.checkpoint_format)
+        if self.num_workers > 1 and self.checkpoint_name is not None and \
+                self.checkpoint_format == 'npy':
+            raise ValueError('Resumable checkpoints are not supported with '
+                             'num_workers > 1, since the update rule state of '
+                             'the workers is not shared; use '
+                             'checkpoint_format="pickle"')
+
         self._reset()
 
 
@@ -154,16 +222,29 @@ class Solver(object):
         """
         # Set up some variables for book-keeping
         self.epoch = 0
+        self.iteration = 0
         self.best_val_acc = 0
         self.best_params = {}
         self.loss_history = []
         self.train_acc_history = []
         self.val_acc_history = []
 
+        # Evaluators for the fixed train / val subsets are built on first use
+        self._evaluators = None
+        self._background_evaluator = None
+        self._best_lock = threading.Lock()
+        self._checkpoint_writer = None
+
         # Make a deep copy of the optim_config for each parameter
         self.optim_configs = {}
-        for p in self.model.params:
-            d = {k: v for k, v in self.optim_config.items()}
+        for p, w in self.model.params.items():
+            d = {}
+            for k, v in self.optim_config.items():
+                if isinstance(v, (list, tuple, np.ndarray)):
+                    # One value per replica of a stacked model, broadcast
+                    # along the first axis of the parameter
+                    v = np.array(v, dtype=w.dtype).reshape((-1,) + (1,) * (w.ndim - 1))
+                d[k] = v
             self.optim_configs[p] = d
 
 
@@ -173,16 +254,28 @@ class Solver(object):
         be called manually.
         """
         # Make a minibatch of training data
-        num_train = self.X_train.shape[0]
-        batch_mask = np.random.choice(num_train, self.batch_size)
-        X_batch = self.X_train[batch_mask]
-        y_batch = self.y_train[batch_mask]
+        X_batch, y_batch = self._sample_batch()
 
         # Compute loss and gradient
         loss, grads = self.model.loss(X_batch, y_batch)
         self.loss_history.append(loss)
 
         # Perform a parameter update
+        self._update_params(grads)
+
+
+    def _sample_batch(self):
+        """ Sample a random minibatch of training data. """
+        num_train = self.X_train.shape[0]
+        batch_mask = np.random.choice(num_train, self.batch_size)
+        X_batch = self.X_train[batch_mask]
+        if self.augment is not None:
+            X_batch = self.augment(X_batch)
+        return X_batch, self.y_train[batch_mask]
+
+
+    def _update_params(self, grads):
+        """ Apply the update rule to every parameter. """
         for p, w in self.model.params.items():
             dw = grads[p]
             config = self.optim_configs[p]
@@ -193,6 +286,14 @@ class Solver(object):
 
     def _save_checkpoint(self):
         if self.checkpoint_name is None: return
+        if self.checkpoint_format == 'npy':
+            if self._checkpoint_writer is None:
+                self._checkpoint_writer = CheckpointWriter(self.checkpoint_name)
+            filename = self._checkpoint_writer.save(self)
+            if self.verbose:
+                print('Saving checkpoint to "%s"' % filename)
+            return
+
         checkpoint = {
           'model': self.model,
           'update_rule': self.update_rule,
@@ -213,7 +314,84 @@ class Solver(object):
             pickle.dump(checkpoint, f)
 
 
-    def check_accuracy(self, X, y, num_samples=None, batch_size=100):
+    def resume(self, path):
+        """
+        Restore the state of training from a checkpoint written with
+        checkpoint_format='npy', so that the next call to train() continues
+        exactly where the checkpointed run left off. This restores the model
+        parameters, the update rule state of every parameter, the batchnorm
+        running averages, the epoch and iteration counters, the histories, the
+        best model so far, the fixed accuracy-check subsets and the state of
+        numpy's global random number generator; a synchronous run resumed this
+        way computes the same losses and parameters as one that was never
+        interrupted. The Solver must have been constructed with the same
+        model architecture, data and arguments as the checkpointed run, except
+        that num_epochs may be increased to train for longer.
+
+        With async_eval, a checkpoint may not yet include the accuracy check
+        that was running when it was taken. Checkpoints are only written by
+        synchronous runs, but one may be resumed with num_workers > 1; every
+        worker then starts from the restored update rule state.
+
+        Inputs:
+        - path: Either a checkpoint directory, or a checkpoint_name prefix, in
+          which case the newest complete checkpoint under it is used.
+        """
+        if not os.path.isdir(path) and not os.path.isdir(path + '.old'):
+            checkpoint_dir = latest_checkpoint(path)
+            if checkpoint_dir is None:
+                raise ValueError('No checkpoint found at "%s"' % path)
+            path = checkpoint_dir
+        checkpoint = load_checkpoint(path, mmap_mode=None)
+
+        if set(checkpoint['params']) != set(self.model.params):
+            raise ValueError('Checkpoint "%s" has parameters %s but the model '
+                             'has %s' % (path, sorted(checkpoint['params']),
+                                         sorted(self.model.params)))
+        bn_params = getattr(self.model, 'bn_params', [])
+        if len(checkpoint['bn_params']) != len(bn_params):
+            raise ValueError('Checkpoint "%s" has %d batchnorm layers but the '
+                             'model has %d' % (path,
+                                               len(checkpoint['bn_params']),
+                                               len(bn_params)))
+
+        self._reset()
+        for k, v in checkpoint['params'].items():
+            self.model.params[k] = v
+        self.optim_configs = checkpoint['optim_configs']
+        for bn_param, saved in zip(bn_params, checkpoint['bn_params']):
+            bn_param.update(saved)
+        self.best_params = checkpoint['best_params']
+        self.best_val_acc = checkpoint['best_val_acc']
+        self.epoch = checkpoint['epoch']
+        self.iteration = checkpoint['iteration']
+        self.loss_history = checkpoint['loss_history']
+        self.train_acc_history = checkpoint['train_acc_history']
+        self.val_acc_history = checkpoint['val_acc_history']
+
+        self._evaluators = [
+            Evaluator(self.model, self.X_train, self.y_train,
+                      num_samples=self.num_train_samples,
+                      batch_size=self.eval_batch_size,
+                      memory_budget=self.eval_memory_budget,
+                      indices=checkpoint['train_indices']),
+            Evaluator(self.model, self.X_val, self.y_val,
+                      num_samples=self.num_val_samples,
+                      batch_size=self.eval_batch_size,
+                      memory_budget=self.eval_memory_budget,
+                      indices=checkpoint['val_indices']),
+        ]
+
+        # Restore the random state last so nothing above can consume from it
+        name, keys, pos, has_gauss, cached_gaussian = checkpoint['rng_state']
+        np.random.set_state((name, np.array(keys, dtype=np.uint32), pos,
+                             has_gauss, cached_gaussian))
+        if self.verbose:
+            print('Resumed from "%s" at epoch %d, iteration %d' % (
+                   path, self.epoch, self.iteration))
+
+
+    def check_accuracy(self, X, y, num_samples=None, batch_size=None):
         """
         Check accuracy of the model on the provided data.
 
@@ -223,47 +401,216 @@ class Solver(object):
         - num_samples: If not None, subsample the data and only test the model
           on num_samples datapoints.
         - batch_size: Split X and y into batches of this size to avoid using
-          too much memory.
+          too much memory. If None, use the largest batch size that fits in
+          eval_memory_budget.
 
         Returns:
         - acc: Scalar giving the fraction of instances that were correctly
           classified by the model.
         """
+        evaluator = Evaluator(self.model, X, y, num_samples=num_samples,
+                              batch_size=batch_size,
+                              memory_budget=self.eval_memory_budget)
+        return evaluator.accuracy()
 
-        # Maybe subsample the data
-        N = X.shape[0]
-        if num_samples is not None and N > num_samples:
-            mask = np.random.choice(N, num_samples)
-            N = num_samples
-            X = X[mask]
-            y = y[mask]
-
-        # Compute predictions in batches
-        num_batches = N // batch_size
-        if N % batch_size != 0:
-            num_batches += 1
-        y_pred = []
-        for i in range(num_batches):
-            start = i * batch_size
-            end = (i + 1) * batch_size
-            scores = self.model.loss(X[start:end])
-            y_pred.append(np.argmax(scores, axis=1))
-        y_pred = np.hstack(y_pred)
-        acc = np.mean(y_pred == y)
-
-        return acc
 
+    def _async_step(self, t, iterations_per_epoch):
+        """
+        Make a single asynchronous gradient update inside a Hogwild worker.
+        model.params live in shared memory; rather than replacing them, the
+        step computed by the update rule is added to them in place so that
+        concurrent updates from other workers are not overwritten.
+        """
+        # Workers decay their own learning rate at the end of every epoch
+        epoch = t // iterations_per_epoch
+        if epoch > self.epoch:
+            for k in self.optim_configs:
+                if 'learning_rate' in self.optim_configs[k]:
+                    self.optim_configs[k]['learning_rate'] *= \
+                        self.lr_decay ** (epoch - self.epoch)
+            self.epoch = epoch
+
+        X_batch, y_batch = self._sample_batch()
+        loss, grads = self.model.loss(X_batch, y_batch)
 
-    def train(self):
+        for p, w in self.model.params.items():
+            w_snapshot = np.array(w)
+            next_w, next_config = self.update_rule(w_snapshot.copy(), grads[p],
+                                                   self.optim_configs[p])
+            w += next_w - w_snapshot
+            self.optim_configs[p] = next_config
+
+        # Publish batchnorm running averages to the shared copies
+        for bn_param, shared in zip(self._bn_params, self._shared_bn_stats):
+            for k, v in shared.items():
+                v[...] = bn_param[k]
+                bn_param[k] = v
+
+        if self.verbose and t % self.print_every == 0:
+            print('(Iteration %d / %d) loss: %f' % (
+                   t + 1, self._num_iterations, loss))
+        return loss
+
+
+    def _get_evaluators(self):
         """
-        Run optimization to train the model.
+        Build the evaluators for the fixed train and val subsets on first use,
+        and the background thread that runs them if async_eval is set.
         """
-        num_train = self.X_train.shape[0]
-        iterations_per_epoch = max(num_train // self.batch_size, 1)
-        num_iterations = self.num_epochs * iterations_per_epoch
+        if self._evaluators is None:
+            self._evaluators = [
+                Evaluator(self.model, self.X_train, self.y_train,
+                          num_samples=self.num_train_samples,
+                          batch_size=self.eval_batch_size,
+                          memory_budget=self.eval_memory_budget),
+                Evaluator(self.model, self.X_val, self.y_val,
+                          num_samples=self.num_val_samples,
+                          batch_size=self.eval_batch_size,
+                          memory_budget=self.eval_memory_budget),
+            ]
+        if self.async_eval and self._background_evaluator is None:
+            self._background_evaluator = BackgroundEvaluator(
+                self._evaluators, self._record_accuracy)
+        return self._evaluators
+
+
+    def _record_accuracy(self, epoch, model, accs):
+        """
+        Record the train and val accuracy of model, a snapshot of self.model
+        taken at the given epoch, and keep track of the best model.
+        """
+        train_acc, val_acc = accs
+        self.train_acc_history.append(train_acc)
+        self.val_acc_history.append(val_acc)
+
+        if self.verbose:
+            print('(Epoch %d / %d) train acc: %f; val_acc: %f' % (
+                   epoch, self.num_epochs, train_acc, val_acc))
+
+        # Keep track of the best model. best_params is replaced in one step
+        # so that readers never see it half filled
+        with self._best_lock:
+            if val_acc > self.best_val_acc:
+                best_params = {}
+                for k, v in model.params.items():
+                    best_params[k] = v.copy()
+                self.best_val_acc = val_acc
+                self.best_params = best_params
+
+
+    def _check_and_record_accuracy(self):
+        """
+        Check train and val accuracy, save a checkpoint and keep track of the
+        best model. This is called by train() and should not be called
+        manually.
+        """
+        if self.profiler is not None:
+            self.profiler.set_epoch(self.epoch)
+        evaluators = self._get_evaluators()
+        if self.async_eval:
+            self._background_evaluator.submit(self.model, self.epoch)
+        else:
+            accs = [e.accuracy() for e in evaluators]
+            self._record_accuracy(self.epoch, self.model, accs)
+        self._save_checkpoint()
+
+
+    def _wait_for_background_work(self):
+        """
+        Wait for accuracy checks and checkpoint writes running in the
+        background to finish.
+        """
+        if self._background_evaluator is not None:
+            self._background_evaluator.close()
+            self._background_evaluator = None
+        if self._checkpoint_writer is not None:
+            self._checkpoint_writer.close()
+            self._checkpoint_writer = None
+
+
+    def _instrument(self):
+        """
+        Activate the profiler and shadow the methods it times with
+        instance attributes wrapping them.
+        """
+        profiler = self.profiler
+        profiler.activate()
+        self._step = profiler.wrap(self._step, 'step', 'train_step')
+        self._sample_batch = profiler.wrap(self._sample_batch, 'data',
+                                           'data_fetch')
+        self._update_params = profiler.wrap(
+            self._update_params, 'optim', self.update_rule.__name__,
+            flops_fn=profiler.update_rule_flops(self.update_rule))
+        self._check_and_record_accuracy = profiler.wrap(
+            self._check_and_record_accuracy, 'eval', 'check_accuracy',
+            phase='eval')
+
+
+    def _uninstrument(self):
+        for name in ('_step', '_sample_batch', '_update_params',
+                     '_check_and_record_accuracy'):
+            self.__dict__.pop(name, None)
+        self.profiler.deactivate()
+
+
+    def _train_async(self, num_iterations, iterations_per_epoch):
+        """
+        Run optimization with num_workers Hogwild workers. This is called by
+        train() and should not be called manually.
+        """
+        self._num_iterations = num_iterations
+        start = self.iteration
+        start_epoch = self.epoch
+
+        # Run a tiny test-time forward pass so that batchnorm layers create
+        # their running averages, then move those into shared memory as well
+        self._bn_params = list(getattr(self.model, 'bn_params', []))
+        self._shared_bn_stats = []
+        if self._bn_params:
+            self.model.loss(self.X_train[:1])
+        for bn_param in self._bn_params:
+            shared = {}
+            for k in ('running_mean', 'running_var'):
+                if k in bn_param:
+                    bn_param[k] = shared[k] = hogwild.to_shared(bn_param[k])
+            self._shared_bn_stats.append(shared)
 
-        for t in range(num_iterations):
+        for p in self.model.params:
+            self.model.params[p] = hogwild.to_shared(self.model.params[p])
+
+        def end_of_epoch(epoch):
+            self.epoch = start_epoch + epoch + 1
+            self.iteration = min(start + (epoch + 1) * iterations_per_epoch,
+                                 num_iterations)
+            self._check_and_record_accuracy()
+
+        try:
+            if start == 0:
+                self._check_and_record_accuracy()
+            losses = hogwild.hogwild_train(
+                lambda t: self._async_step(start + t, iterations_per_epoch),
+                num_iterations - start, num_workers=self.num_workers,
+                iters_per_epoch=iterations_per_epoch,
+                epoch_callback=end_of_epoch,
+                threads_per_worker=self.num_threads)
+            self.loss_history.extend(losses.tolist())
+        finally:
+            # Detach parameters and running averages from shared memory
+            for p in self.model.params:
+                self.model.params[p] = np.array(self.model.params[p])
+            for bn_param, shared in zip(self._bn_params, self._shared_bn_stats):
+                for k in shared:
+                    bn_param[k] = np.array(bn_param[k])
+
+
+    def _train_sync(self, num_iterations, iterations_per_epoch):
+        """
+        Run synchronous optimization in this process. This is called by
+        train() and should not be called manually.
+        """
+        for t in range(self.iteration, num_iterations):
             self._step()
+            self.iteration = t + 1
 
             # Maybe print training loss
             if self.verbose and t % self.print_every == 0:
@@ -283,24 +630,33 @@ class Solver(object):
             first_it = (t == 0)
             last_it = (t == num_iterations - 1)
             if first_it or last_it or epoch_end:
-                train_acc = self.check_accuracy(self.X_train, self.y_train,
-                    num_samples=self.num_train_samples)
-                val_acc = self.check_accuracy(self.X_val, self.y_val,
-                    num_samples=self.num_val_samples)
-                self.train_acc_history.append(train_acc)
-                self.val_acc_history.append(val_acc)
-                self._save_checkpoint()
-
-                if self.verbose:
-                    print('(Epoch %d / %d) train acc: %f; val_acc: %f' % (
-                           self.epoch, self.num_epochs, train_acc, val_acc))
-
-                # Keep track of the best model
-                if val_acc > self.best_val_acc:
-                    self.best_val_acc = val_acc
-                    self.best_params = {}
-                    for k, v in self.model.params.items():
-                        self.best_params[k] = v.copy()
+                self._check_and_record_accuracy()
+
+
+    def train(self):
+        """
+        Run optimization to train the model. At the end the model holds the
+        best parameters seen; the parameters of the last iteration, which
+        match self.optim_configs, are kept in self.last_params.
+        """
+        num_train = self.X_train.shape[0]
+        iterations_per_epoch = max(num_train // self.batch_size, 1)
+        num_iterations = self.num_epochs * iterations_per_epoch
+
+        if self.profiler is not None:
+            self._instrument()
+        try:
+            if self.num_workers > 1:
+                self._train_async(num_iterations, iterations_per_epoch)
+            else:
+                with resources.limit_threads(self.num_threads):
+                    self._train_sync(num_iterations, iterations_per_epoch)
+
+            self._wait_for_background_work()
+        finally:
+            if self.profiler is not None:
+                self._uninstrument()
 
         # At the end of training swap the best params into the model
+        self.last_params = self.model.params
         self.model.params = self.best_params
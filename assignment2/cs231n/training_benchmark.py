@@ -0,0 +1,242 @@
+from __future__ import print_function, division
+from builtins import range
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from cs231n.solver import Solver
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.classifiers.cnn import ThreeLayerConvNet
+from cs231n.benchmarks import compare_to_baseline
+
+"""
+End-to-end training throughput benchmark.
+
+Every configuration trains a model with Solver.train() for a fixed number of
+iterations (one epoch over a synthetic CIFAR-10 shaped dataset of
+iterations * batch_size random images generated in memory) and reports:
+
+- steady-state throughput in images per second, measured over the training
+  steps after the first warmup steps;
+- the median, 90th and 99th percentile latency of a training step;
+- the wall time of the whole train() call, including accuracy checks;
+- the peak resident set size of the process.
+
+Each configuration runs in its own forked process so that its peak RSS is
+not hidden by the configurations run before it. Results can be written as
+JSON and compared with an earlier run like those of benchmarks.py.
+
+Run from the assignment2 directory:
+
+python -m cs231n.training_benchmark --output training.json
+python -m cs231n.training_benchmark --baseline training.json --models fc_net
+"""
+
+
+INPUT_DIM = (3, 32, 32)
+NUM_CLASSES = 10
+
+# Model configurations, as (name, function building the model)
+MODELS = [
+    ('fc_net', lambda: FullyConnectedNet(
+        [100, 100, 100], input_dim=int(np.prod(INPUT_DIM)),
+        num_classes=NUM_CLASSES)),
+    ('fc_net_batchnorm', lambda: FullyConnectedNet(
+        [100, 100, 100], input_dim=int(np.prod(INPUT_DIM)),
+        num_classes=NUM_CLASSES, use_batchnorm=True)),
+    ('fc_net_dropout', lambda: FullyConnectedNet(
+        [100, 100, 100], input_dim=int(np.prod(INPUT_DIM)),
+        num_classes=NUM_CLASSES, dropout=0.5)),
+    ('fc_net_batchnorm_dropout', lambda: FullyConnectedNet(
+        [100, 100, 100], input_dim=int(np.prod(INPUT_DIM)),
+        num_classes=NUM_CLASSES, use_batchnorm=True, dropout=0.5)),
+    ('three_layer_convnet', lambda: ThreeLayerConvNet(
+        input_dim=INPUT_DIM, num_classes=NUM_CLASSES)),
+]
+
+
+def synthetic_data(num_train, num_val=100, dtype=np.float32, seed=0):
+    """
+    Generate a random dataset with the shapes of CIFAR-10, in the format
+    expected by Solver.
+    """
+    rng = np.random.RandomState(seed)
+    return {
+        'X_train': rng.randn(num_train, *INPUT_DIM).astype(dtype),
+        'y_train': rng.randint(NUM_CLASSES, size=num_train),
+        'X_val': rng.randn(num_val, *INPUT_DIM).astype(dtype),
+        'y_val': rng.randint(NUM_CLASSES, size=num_val),
+    }
+
+
+def peak_rss_bytes():
+    """ Peak resident set size of this process in bytes, or None. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return peak if sys.platform == 'darwin' else 1024 * peak
+
+
+def run_config(name, build_model, iterations=50, warmup=5, batch_size=50,
+               update_rule='sgd', seed=0):
+    """
+    Train one model configuration in this process.
+
+    Inputs:
+    - name: Name of the configuration.
+    - build_model: Function returning a new model.
+    - iterations: Number of training steps.
+    - warmup: Number of initial steps excluded from the throughput and latency
+      statistics.
+    - batch_size: Minibatch size.
+    - update_rule: Update rule used by the Solver.
+    - seed: Seed for the data, the model initialization and training.
+
+    Returns a dictionary with keys 'key', 'iterations', 'batch_size',
+    'images_per_s', 'median_time', 'p90_time', 'p99_time', 'train_time' and
+    'peak_rss_bytes', with times in seconds; median_time is the median step
+    latency.
+    """
+    data = synthetic_data(iterations * batch_size, seed=seed)
+    np.random.seed(seed)
+    model = build_model()
+    solver = Solver(model, data, update_rule=update_rule,
+                    optim_config={'learning_rate': 1e-3}, num_epochs=1,
+                    batch_size=batch_size, num_train_samples=100,
+                    verbose=False)
+
+    # Time every step by shadowing Solver._step with a timed wrapper
+    step_times = []
+    step = solver._step
+    def timed_step():
+        start = time.perf_counter()
+        step()
+        step_times.append(time.perf_counter() - start)
+    solver._step = timed_step
+
+    start = time.perf_counter()
+    solver.train()
+    train_time = time.perf_counter() - start
+
+    steady = np.array(step_times[warmup:] or step_times)
+    return {
+        'key': name,
+        'iterations': len(step_times),
+        'batch_size': batch_size,
+        'images_per_s': batch_size * len(steady) / steady.sum(),
+        'median_time': float(np.median(steady)),
+        'p90_time': float(np.percentile(steady, 90)),
+        'p99_time': float(np.percentile(steady, 99)),
+        'train_time': train_time,
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def _run_in_child(conn, name, build_model, kwargs):
+    try:
+        conn.send(run_config(name, build_model, **kwargs))
+    except Exception as e:
+        conn.send({'key': name, 'error': '%s: %s' % (type(e).__name__, e)})
+    finally:
+        conn.close()
+
+
+def run_training_benchmarks(model_filter=None, iterations=50, warmup=5,
+                            batch_size=50, update_rule='sgd', baseline=None,
+                            tolerance=0.1, verbose=True):
+    """
+    Run every configuration whose name contains model_filter, each in a
+    forked process.
+
+    Returns a JSON-serializable dictionary with key 'results' and, if a
+    baseline was given, 'regressions' (configurations whose median step time
+    grew by more than tolerance).
+    """
+    ctx = multiprocessing.get_context('fork')
+    kwargs = {'iterations': iterations, 'warmup': warmup,
+              'batch_size': batch_size, 'update_rule': update_rule}
+    results = []
+    for name, build_model in MODELS:
+        if model_filter is not None and model_filter not in name:
+            continue
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        p = ctx.Process(target=_run_in_child,
+                        args=(child_conn, name, build_model, kwargs))
+        p.start()
+        child_conn.close()
+        try:
+            r = parent_conn.recv()
+        except EOFError:
+            r = {'key': name, 'error': 'benchmark process exited with code %s'
+                                       % p.exitcode}
+        p.join()
+        results.append(r)
+        if verbose:
+            if 'error' in r:
+                print('%-28s ERROR %s' % (name, r['error']))
+            else:
+                rss = '-' if r['peak_rss_bytes'] is None else \
+                    '%.0f' % (r['peak_rss_bytes'] / 2**20)
+                print('%-28s %9.1f images/s  step p50 %8.2f ms  p90 %8.2f ms  '
+                      'p99 %8.2f ms  train %7.2f s  peak RSS %6s MB' % (
+                      name, r['images_per_s'], 1e3 * r['median_time'],
+                      1e3 * r['p90_time'], 1e3 * r['p99_time'],
+                      r['train_time'], rss))
+
+    report = {'results': results}
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline, tolerance)
+        report['regressions'] = [r[0] for r in regressions]
+        if verbose:
+            for key, old, new in regressions:
+                print('REGRESSION %s: step %.2f ms -> %.2f ms (%+.0f%%)' % (
+                      key, 1e3 * old, 1e3 * new, 100 * (new / old - 1)))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark end-to-end Solver training throughput.')
+    parser.add_argument('--models', default=None,
+                        help='Only run configurations whose name contains '
+                             'this string')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--update-rule', default='sgd')
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='Compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    report = run_training_benchmarks(
+        model_filter=args.models, iterations=args.iterations,
+        warmup=args.warmup, batch_size=args.batch_size,
+        update_rule=args.update_rule, baseline=baseline,
+        tolerance=args.tolerance)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())